@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.admission
+"""
+import unittest
+
+from xlib.admission import Admission
+
+__version__ = '0.1'
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_connections_capped_per_client(self):
+        admission = Admission(maxconnections=2)
+        self.assertTrue(admission.connect('10.0.0.1'))
+        self.assertTrue(admission.connect('10.0.0.1'))
+        self.assertFalse(admission.connect('10.0.0.1'))
+        self.assertTrue(admission.connect('10.0.0.2'))
+        admission.disconnect('10.0.0.1')
+        self.assertTrue(admission.connect('10.0.0.1'))
+        self.assertEqual(admission.rejected, 1)
+
+    def test_no_cap(self):
+        admission = Admission()
+        self.assertTrue(all(admission.connect('10.0.0.1') for _ in range(100)))
+        self.assertEqual(admission.clients, 0)
+
+    def test_rate_limited_after_burst(self):
+        admission = Admission(rate=1.0, burst=3)
+        self.assertEqual([admission.request('10.0.0.1') for _ in range(3)], [0, 0, 0])
+        self.assertGreaterEqual(admission.request('10.0.0.1'), 1)
+        self.assertEqual(admission.request('10.0.0.2'), 0)
+        self.assertEqual(admission.limited, 1)
+
+    def test_clients_bounded(self):
+        admission = Admission(maxconnections=1, rate=0.001, burst=1, maxclients=4)
+        for n in range(16):
+            admission.request('10.0.0.{}'.format(n))
+        self.assertLessEqual(admission.clients, 4 + 8)
+        self.assertGreater(admission.evicted, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
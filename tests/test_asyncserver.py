@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the shutdown of xlib.asyncserver
+"""
+import logging
+import os
+import signal
+import socket
+import unittest
+from http import HTTPStatus
+from threading import Thread
+from time import monotonic, sleep
+
+from xlib.asyncserver import AsyncHTTPServer
+from xlib.requesthandler import RequestHandler
+from xlib.responsecache import ResponseCache
+from xlib.router import Router
+
+__version__ = '0.1'
+
+
+class SlowHandler(RequestHandler):
+    logger = logging.getLogger('tests')
+    responsecache = ResponseCache()
+    router = Router()
+    routes = None
+    draining = False
+
+    def slow(self) -> None:
+        sleep(0.5)
+        self.send_body(HTTPStatus.OK, 'text/plain', b'slow')
+
+
+SlowHandler.router.add('GET', '/slow', SlowHandler.slow)
+
+
+class AsyncShutdownTest(unittest.TestCase):
+
+    def setUp(self):
+        SlowHandler.logger.addHandler(logging.NullHandler())
+        SlowHandler.logger.propagate = False
+        self.server = AsyncHTTPServer(('127.0.0.1', 0), SlowHandler)
+        self.server.draintimeout = 5.0
+
+    def tearDown(self):
+        self.server.server_close()
+        SlowHandler.draining = False
+
+    def test_sigint_drains(self):
+        received = {}
+
+        def client() -> None:
+            with socket.create_connection(self.server.server_address, timeout=5) as idle, \
+                    socket.create_connection(self.server.server_address, timeout=5) as connection:
+                connection.sendall(b'GET /slow HTTP/1.1\r\nHost: x\r\n\r\n')
+                sleep(0.2)
+                os.kill(os.getpid(), signal.SIGINT)
+                response = b''
+                while True:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    response += data
+                received['response'] = response
+                received['idle'] = idle.recv(1)
+
+        thread = Thread(target=client, daemon=True)
+        thread.start()
+        start = monotonic()
+        with self.assertRaises(KeyboardInterrupt):
+            self.server.serve_forever()
+        elapsed = monotonic() - start
+        thread.join()
+        self.assertTrue(received['response'].startswith(b'HTTP/1.1 200'))
+        self.assertTrue(received['response'].endswith(b'slow'))
+        self.assertIn(b'Connection: close', received['response'])
+        self.assertEqual(received['idle'], b'')
+        self.assertLess(elapsed, SlowHandler.idletimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
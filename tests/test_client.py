@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the retries of xlib.client, against a scripted server on a Unix domain socket
+"""
+import socket
+import tempfile
+import time
+import unittest
+from http.client import HTTPException, parse_headers
+from json import dumps
+from os.path import join
+from threading import Thread
+
+from xlib.client import Client
+from xlib.vardir import UNIXSOCKETFILE
+
+__version__ = '0.1'
+
+
+class ScriptedServer(object):
+    """
+    Answers the requests on its nth connection as script(n, request number on the connection) says:
+        'answer'        200 with the request number as body
+        'answerclose'   the same, then closes the connection without saying so
+        'close'         closes the connection without answering
+    requests lists (connection number, method) of every request read
+    """
+
+    def __init__(self, path: str, script: callable):
+        self.script = script
+        self.requests = []
+        self.closed = []
+        self.listening = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listening.bind(path)
+        self.listening.listen(8)
+        Thread(target=self.__serve__, daemon=True).start()
+
+    def close(self) -> None:
+        self.listening.close()
+
+    def __serve__(self) -> None:
+        number = 0
+        while True:
+            try:
+                connection, _ = self.listening.accept()
+            except OSError:
+                return
+            Thread(target=self.__connection__, args=(connection, number), daemon=True).start()
+            number += 1
+
+    def __connection__(self, connection: socket.socket, number: int) -> None:
+        with connection, connection.makefile('rb') as reader:
+            for request in range(1000):
+                line = reader.readline()
+                if not line:
+                    break
+                headers = parse_headers(reader)
+                reader.read(int(headers.get('Content-Length', 0)))
+                self.requests.append((number, line.split()[0].decode()))
+                action = self.script(number, request)
+                if action == 'close':
+                    break
+                body = str(request).encode()
+                connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                if action == 'answerclose':
+                    break
+        self.closed.append(number)
+
+
+class ClientRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = join(self.directory.name, 'test.sock')
+        with open(join(self.directory.name, UNIXSOCKETFILE), 'w') as socketfile:
+            socketfile.write(dumps(('http+unix://', path)))
+        self.path = path
+        self.server = None
+        self.client = None
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        if self.server is not None:
+            self.server.close()
+        self.directory.cleanup()
+
+    def serve(self, script: callable) -> Client:
+        self.server = ScriptedServer(self.path, script)
+        self.client = Client(self.directory.name, poolsize=1, timeout=5)
+        return self.client
+
+    def test_get_retried_on_stale_connection(self):
+        client = self.serve(lambda connection, request: 'close' if (connection, request) == (0, 1) else 'answer')
+        self.assertEqual(client.request('GET', '/').body, b'0')
+        self.assertEqual(client.request('GET', '/').body, b'0')
+        self.assertEqual(self.server.requests, [(0, 'GET'), (0, 'GET'), (1, 'GET')])
+
+    def test_post_not_retried_once_written(self):
+        client = self.serve(lambda connection, request: 'close' if (connection, request) == (0, 1) else 'answer')
+        client.request('GET', '/')
+        with self.assertRaises((OSError, HTTPException)):
+            client.request('POST', '/', b'body')
+        self.assertEqual(self.server.requests, [(0, 'GET'), (0, 'POST')])
+
+    def test_pipelined_gets_retried_after_partial_answer(self):
+        client = self.serve(lambda connection, request: 'close' if (connection, request) == (0, 2) else 'answer')
+        client.request('GET', '/')
+        responses = client.submit([('GET', '/a'), ('GET', '/b'), ('GET', '/c')])
+        self.assertEqual([response.body for response in responses], [b'1', b'0', b'1'])
+        self.assertEqual(self.server.requests, [(0, 'GET')] * 3 + [(1, 'GET')] * 2)
+
+    def test_pipeline_with_post_not_retried(self):
+        client = self.serve(lambda connection, request: 'close' if (connection, request) == (0, 2) else 'answer')
+        client.request('GET', '/')
+        with self.assertRaises((OSError, HTTPException)):
+            client.submit([('GET', '/a'), ('GET', '/b'), ('POST', '/c', b'body')])
+        self.assertEqual(self.server.requests, [(0, 'GET')] * 3)
+
+    def test_idle_connection_closed_by_server_not_used(self):
+        client = self.serve(lambda connection, request: 'answerclose' if connection == 0 else 'answer')
+        client.request('GET', '/')
+        deadline = time.monotonic() + 5
+        while 0 not in self.server.closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(client.request('POST', '/', b'body').body, b'0')
+        self.assertEqual(self.server.requests, [(0, 'GET'), (1, 'POST')])
+
+
+if __name__ == '__main__':
+    unittest.main()
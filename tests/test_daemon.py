@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the module functions of xlib.daemon
+"""
+import logging
+import os
+import select
+import signal
+import tempfile
+import unittest
+from contextlib import nullcontext
+from os.path import join
+from time import monotonic, perf_counter, sleep
+from unittest import mock
+
+from xlib import daemon
+
+__version__ = '0.1'
+
+
+class CloseFdsTest(unittest.TestCase):
+
+    def closefds(self, listed: bool) -> int:
+        """
+        Open pipes in a forked child, close all descriptors but one of them there
+        :return: exit code of the child, 0 if exactly the kept descriptor stayed open
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                fds = [fd for _ in range(4) for fd in os.pipe()]
+                with nullcontext() if listed else mock.patch.object(daemon, 'openfds', return_value=None):
+                    daemon.closefds({fds[3]})
+                status = 0
+                for fd in fds + [0, 1, 2]:
+                    try:
+                        os.fstat(fd)
+                        status |= 0 if fd == fds[3] else 2
+                    except OSError:
+                        status |= 4 if fd == fds[3] else 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    def test_openfds_lists_open_descriptors(self):
+        readfd, writefd = os.pipe()
+        try:
+            fds = daemon.openfds()
+            self.assertIn(readfd, fds)
+            self.assertIn(writefd, fds)
+        finally:
+            os.close(readfd)
+            os.close(writefd)
+        self.assertNotIn(readfd, daemon.openfds())
+
+    def test_closefds_listed(self):
+        self.assertEqual(self.closefds(True), 0)
+
+    def test_closefds_unlisted(self):
+        self.assertEqual(self.closefds(False), 0)
+
+
+class Supervisor(daemon.Daemon):
+    logger = logging.getLogger('tests')
+
+    def preworker(self, args: dict) -> None:
+        pass
+
+    def worker(self, args: dict) -> None:
+        pass
+
+    def postworker(self, args: dict) -> None:
+        pass
+
+
+class SuperviseTest(unittest.TestCase):
+
+    def setUp(self):
+        Supervisor.logger.addHandler(logging.NullHandler())
+        Supervisor.logger.propagate = False
+        self.directory = tempfile.TemporaryDirectory()
+        for name in ('base', 'log'):
+            os.mkdir(join(self.directory.name, name))
+        self.supervisor = Supervisor()
+        self.supervisor.basedir = join(self.directory.name, 'base')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def supervise(self, target: callable, processes: int, readyfd: int = None, fork: callable = None) -> int:
+        """
+        Run supervise() in a forked child until it ends; the child exits with 0 on KeyboardInterrupt
+        :param fork: replaces os.fork in the child
+        :return: pid of the child
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.supervisor.__readyfd__ = readyfd
+                self.supervisor.__phases__ = [('start', perf_counter())]
+                with nullcontext() if fork is None else mock.patch.object(daemon.os, 'fork', fork):
+                    self.supervisor.supervise(target, processes)
+            except KeyboardInterrupt:
+                status = 0
+            finally:
+                os._exit(status)
+        return pid
+
+    def test_ready_once_every_worker_is(self):
+        first = join(self.directory.name, 'first')
+
+        def target() -> None:
+            try:
+                os.close(os.open(first, os.O_CREAT | os.O_EXCL))
+                sleep(0.1)
+            except FileExistsError:
+                sleep(0.5)
+            self.supervisor.ready()
+            sleep(10)
+
+        readfd, writefd = os.pipe()
+        start = monotonic()
+        pid = self.supervise(target, 2, writefd)
+        os.close(writefd)
+        try:
+            self.assertTrue(select.select([readfd], [], [], 5)[0])
+            self.assertEqual(os.read(readfd, 1), b'1')
+            self.assertGreater(monotonic() - start, 0.45)
+            with open(self.supervisor.pidfile, 'r') as pidfile:
+                self.assertEqual(int(pidfile.read()), pid)
+        finally:
+            os.close(readfd)
+            os.kill(pid, signal.SIGINT)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def test_sigint_during_fork_stops_workers(self):
+        fork = os.fork
+        workers = join(self.directory.name, 'workers')
+
+        def interrupted() -> int:
+            pid = fork()
+            if pid != 0:
+                with open(workers, 'a') as pids:
+                    pids.write('{}\n'.format(pid))
+                os.kill(os.getpid(), signal.SIGINT)
+            return pid
+
+        pid = self.supervise(lambda: sleep(10), 1, fork=interrupted)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        with open(workers, 'r') as pids:
+            worker = int(pids.read())
+        try:
+            self.assertFalse(daemon.running(worker))
+        finally:
+            if daemon.running(worker):
+                os.kill(worker, signal.SIGKILL)
+
+
+if __name__ == '__main__':
+    unittest.main()
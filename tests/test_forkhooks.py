@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.forkhooks
+"""
+import gc
+import os
+import unittest
+
+from xlib.forkhooks import ForkHooks
+
+__version__ = '0.1'
+
+
+class State(object):
+
+    def __init__(self, hooks: ForkHooks):
+        self.forked = False
+        hooks.add(self.__reset__)
+
+    def __reset__(self) -> None:
+        self.forked = True
+
+
+class ForkHooksTest(unittest.TestCase):
+
+    def test_called_in_child_only(self):
+        hooks = ForkHooks()
+        state = State(hooks)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if state.forked else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertFalse(state.forked)
+
+    def test_collected_objects_dropped(self):
+        hooks = ForkHooks()
+        for _ in range(100):
+            State(hooks)
+        gc.collect()
+        kept = State(hooks)
+        self.assertEqual(len(hooks.__hooks__), 1)
+        self.assertFalse(kept.forked)
+
+
+if __name__ == '__main__':
+    unittest.main()
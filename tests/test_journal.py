@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.journal
+"""
+import os
+import tempfile
+import unittest
+
+from xlib.journal import Journal, JournalError, RECORDHEADER
+
+__version__ = '0.1'
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = Journal(self.directory.name)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_append_recover_replays_in_order(self):
+        self.journal.append(b'one')
+        self.journal.append(b'two', b'three')
+        self.journal.close()
+        replayed = []
+        result = Journal(self.directory.name).recover(replayed.append)
+        self.assertEqual(replayed, [b'one', b'two', b'three'])
+        self.assertEqual(result, dict(segments=1, records=3, bytes=3 * RECORDHEADER.size + 11, truncated=0))
+
+    def test_recover_truncates_torn_record(self):
+        self.journal.append(b'intact')
+        self.journal.close()
+        path, = self.journal.segments()
+        size = os.path.getsize(path)
+        with open(path, 'ab') as segment:
+            segment.write(RECORDHEADER.pack(100, 0) + b'torn')
+        replayed = []
+        result = Journal(self.directory.name).recover(replayed.append)
+        self.assertEqual(replayed, [b'intact'])
+        self.assertEqual(result['truncated'], RECORDHEADER.size + 4)
+        self.assertEqual(os.path.getsize(path), size)
+
+    def test_recover_truncates_after_corrupt_record(self):
+        self.journal.append(b'first', b'second')
+        self.journal.close()
+        path, = self.journal.segments()
+        with open(path, 'r+b') as segment:
+            segment.seek(RECORDHEADER.size + len(b'first') + RECORDHEADER.size)
+            segment.write(b'X')
+        replayed = []
+        Journal(self.directory.name).recover(replayed.append)
+        self.assertEqual(replayed, [b'first'])
+        self.assertEqual(os.path.getsize(path), RECORDHEADER.size + len(b'first'))
+
+    def test_append_after_close(self):
+        self.journal.close()
+        with self.assertRaises(JournalError):
+            self.journal.append(b'late')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.reaper
+"""
+import socket
+import unittest
+from time import sleep
+
+from xlib.reaper import Reaper
+
+__version__ = '0.1'
+
+
+class ReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reaper = Reaper(interval=0.01)
+        self.connection, self.peer = socket.socketpair()
+        self.connection.settimeout(5)
+
+    def tearDown(self):
+        self.connection.close()
+        self.peer.close()
+
+    def test_deadline_shuts_down(self):
+        self.reaper.arm(self.connection, 'headers', 0.02)
+        sleep(0.1)
+        self.assertEqual(self.connection.recv(1), b'')
+        self.assertEqual(self.reaper.timeouts['headers'], 1)
+
+    def test_drain_shuts_down_idle(self):
+        self.assertTrue(self.reaper.idle(self.connection))
+        self.assertEqual(self.reaper.drain(), 1)
+        self.assertEqual(self.connection.recv(1), b'')
+        other, peer = socket.socketpair()
+        with other, peer:
+            self.assertFalse(self.reaper.idle(other))
+
+    def test_drain_skips_busy(self):
+        self.reaper.idle(self.connection)
+        self.reaper.arm(self.connection, 'headers', 60)
+        self.assertEqual(self.reaper.drain(), 0)
+        self.peer.sendall(b'x')
+        self.assertEqual(self.connection.recv(1), b'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
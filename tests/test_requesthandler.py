@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.requesthandler, against a ThreadedHTTPServer on localhost
+"""
+import logging
+import socket
+import tempfile
+import unittest
+from http.client import HTTPResponse
+from threading import Thread
+from time import monotonic, sleep
+
+from xlib.asyncserver import AsyncHTTPServer
+from xlib.client import SharedReader
+from xlib.journal import Journal
+from xlib.reaper import Reaper
+from xlib.requesthandler import RequestHandler, ThreadedHTTPServer
+from xlib.responsecache import ResponseCache
+from xlib.router import Router
+
+__version__ = '0.1'
+
+
+class Handler(RequestHandler):
+    logger = logging.getLogger('tests')
+    responsecache = ResponseCache()
+    router = Router()
+    routes = None
+    maxjournalbody = 512 * 1024
+
+
+class RequestHandlerTest(unittest.TestCase):
+    serverclass = ThreadedHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        Handler.logger.addHandler(logging.NullHandler())
+        Handler.logger.propagate = False
+        cls.directory = tempfile.TemporaryDirectory()
+        Handler.journal = Journal(cls.directory.name)
+        cls.server = cls.serverclass(('127.0.0.1', 0), Handler)
+        cls.thread = Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.thread.join()
+        cls.server.server_close()
+        Handler.journal.close()
+        Handler.journal = None
+        cls.directory.cleanup()
+
+    def exchange(self, *requests: bytes) -> list:
+        """
+        :return: (status, headers, body) of the response to each of requests, sent at once on one connection
+        """
+        with socket.create_connection(self.server.server_address, timeout=5) as connection:
+            connection.sendall(b''.join(requests))
+            responses = []
+            with connection.makefile('rb') as reader:
+                for request in requests:
+                    response = HTTPResponse(SharedReader(reader), method=request.split(b' ', 1)[0].decode())
+                    response.begin()
+                    responses.append((response.status, response.headers, response.read()))
+                    if response.will_close:
+                        break
+        return responses
+
+    def journaled(self) -> list:
+        payloads = []
+        for path in Handler.journal.segments():
+            Journal.scan(path, payloads.append)
+        return payloads
+
+    def test_chunked_body_decoded(self):
+        before = len(self.journaled())
+        (status, _, _), = self.exchange(b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                        b'5;ext=1\r\nhello\r\n7\r\n, world\r\n0\r\nTrailer: x\r\n\r\n')
+        self.assertEqual(status, 200)
+        self.assertEqual(self.journaled()[before:], [b'hello, world'])
+
+    def test_chunked_body_keeps_connection(self):
+        chunked = b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n'
+        responses = self.exchange(chunked, b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertEqual([status for status, _, _ in responses], [200, 200])
+
+    def test_invalid_chunk_size(self):
+        (status, headers, _), = self.exchange(
+            b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\nabc\r\n0\r\n\r\n')
+        self.assertEqual(status, 400)
+        self.assertEqual(headers['Connection'], 'close')
+
+    def test_unterminated_chunk(self):
+        (status, _, _), = self.exchange(
+            b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabcdef\r\n0\r\n\r\n')
+        self.assertEqual(status, 400)
+
+    def test_chunked_body_too_large(self):
+        (status, _, _), = self.exchange(
+            b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n' +
+            '{:x}\r\n'.format(Handler.maxbodysize + 1).encode())
+        self.assertEqual(status, 413)
+
+    def test_unsupported_transfer_encoding(self):
+        (status, _, _), = self.exchange(b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: gzip\r\n\r\n')
+        self.assertEqual(status, 501)
+
+    def test_unread_body_closes_connection(self):
+        (status, headers, _), = self.exchange(b'GET / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc',
+                                              b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Connection'], 'close')
+
+    def test_large_body_streamed(self):
+        before = len(self.journaled())
+        body = bytes(range(256)) * 1024
+        (status, _, _), = self.exchange('POST /in HTTP/1.1\r\nHost: x\r\nContent-Length: {}\r\n\r\n'.format(
+            len(body)).encode() + body)
+        self.assertEqual(status, 200)
+        self.assertEqual(self.journaled()[before:], [body])
+
+    def test_journaled_body_too_large(self):
+        (status, _, _), = self.exchange('POST /in HTTP/1.1\r\nHost: x\r\nContent-Length: {}\r\n\r\n'.format(
+            Handler.maxjournalbody + 1).encode())
+        self.assertEqual(status, 413)
+        (status, _, _), = self.exchange(b'POST /in HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n' +
+                                        '{:x}\r\n'.format(Handler.maxjournalbody + 1).encode() +
+                                        b'x' * (Handler.maxjournalbody + 1))
+        self.assertEqual(status, 413)
+
+    def test_head_without_body(self):
+        (status, headers, body), = self.exchange(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        responses = self.exchange(b'HEAD / HTTP/1.1\r\nHost: x\r\n\r\n', b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertEqual([(status, response[0]) for response in responses], [(200, 200), (200, 200)])
+        self.assertEqual(responses[0][1]['Content-Length'], str(len(body)))
+        self.assertEqual(responses[0][1]['ETag'], headers['ETag'])
+        self.assertEqual(responses[1][2], body)
+
+    def test_head_metrics_without_body(self):
+        responses = self.exchange(b'HEAD /metrics HTTP/1.1\r\nHost: x\r\n\r\n', b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertEqual([status for status, _, _ in responses], [200, 200])
+        self.assertGreater(int(responses[0][1]['Content-Length']), 0)
+
+    def test_drain_closes_idle_connection(self):
+        if self.serverclass is not ThreadedHTTPServer:
+            self.skipTest('idle connections of the asyncio engine are closed by AsyncHTTPServer itself')
+        reaper, Handler.reaper = Handler.reaper, Reaper()
+        try:
+            with socket.create_connection(self.server.server_address, timeout=5) as connection:
+                connection.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+                response = HTTPResponse(connection)
+                response.begin()
+                response.read()
+                while not Handler.reaper.__idle__:
+                    sleep(0.01)
+                self.assertEqual(Handler.reaper.drain(), 1)
+                start = monotonic()
+                self.assertEqual(connection.recv(1), b'')
+                self.assertLess(monotonic() - start, 1)
+        finally:
+            Handler.reaper = reaper
+
+    def test_conditional_get_not_modified(self):
+        (status, headers, body), = self.exchange(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        (status, _, body), = self.exchange(
+            'GET / HTTP/1.1\r\nHost: x\r\nIf-None-Match: {}\r\n\r\n'.format(headers['ETag']).encode())
+        self.assertEqual((status, body), (304, b''))
+
+    def test_conditional_post_ignored(self):
+        (status, _, body), = self.exchange(
+            b'POST /in HTTP/1.1\r\nHost: x\r\nIf-None-Match: *\r\nContent-Length: 2\r\n\r\nab')
+        self.assertEqual(status, 200)
+        self.assertTrue(body)
+
+
+class AsyncRequestHandlerTest(RequestHandlerTest):
+    serverclass = AsyncHTTPServer
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.responsecache and the compressed body cache of xlib.compression
+"""
+import unittest
+from http import HTTPStatus
+
+from xlib.compression import Compressor
+from xlib.responsecache import CachedResponse, ResponseCache
+
+__version__ = '0.1'
+BODY = b'{"records": [' + b', '.join(b'{"n": %d}' % n for n in range(200)) + b']}'
+
+
+def response(body: bytes = BODY) -> CachedResponse:
+    return CachedResponse(HTTPStatus.OK, [('Content-Type', 'application/json')], body, 1453670360, 'tests')
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_put_invalidate(self):
+        cache = ResponseCache()
+        cache.put('a', response())
+        cache.put('b', response(b'other'))
+        cache.invalidate('a')
+        self.assertEqual(cache.size, response(b'other').size)
+        cache.invalidate()
+        self.assertEqual((cache.size, len(cache)), (0, 0))
+
+    def test_put_variant_invalidate(self):
+        cache = ResponseCache()
+        cached = cache.put('a', response())
+        stored = cache.size
+        cached.variant('gzip', Compressor().compress(BODY, 'gzip', cached.etag))
+        cache.account('a', cached)
+        self.assertGreater(cache.size, stored)
+        self.assertEqual(cache.size, cached.size)
+        cache.invalidate('a')
+        self.assertEqual(cache.size, 0)
+
+    def test_variant_unaccounted_invalidate(self):
+        cache = ResponseCache()
+        cached = cache.put('a', response())
+        cached.variant('gzip', b'compressed')
+        cache.invalidate('a')
+        self.assertEqual(cache.size, 0)
+
+    def test_replace_after_variant(self):
+        cache = ResponseCache()
+        cached = cache.put('a', response())
+        cached.variant('gzip', b'compressed')
+        replacement = cache.put('a', response(b'new'))
+        self.assertEqual(cache.size, replacement.size)
+        cache.account('a', cached)
+        self.assertEqual(cache.size, replacement.size)
+
+    def test_account_evicts(self):
+        cached = response()
+        cache = ResponseCache(maxsize=cached.size + 2000)
+        cache.put('small', response(b'x' * 1800))
+        cache.put('a', cached)
+        cached.variant('gzip', b'compressed')
+        cache.account('a', cached)
+        self.assertLessEqual(cache.size, cache.maxsize)
+        self.assertIsNone(cache.get('small'))
+        self.assertIs(cache.get('a'), cached)
+        self.assertEqual(cache.size, cached.size)
+
+    def test_lru_eviction(self):
+        size = response(b'x' * 100).size
+        cache = ResponseCache(maxsize=size * 2)
+        cache.put('a', response(b'a' * 100))
+        cache.put('b', response(b'b' * 100))
+        cache.get('a')
+        cache.put('c', response(b'c' * 100))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.size, size * 2)
+
+
+class CompressorCacheTest(unittest.TestCase):
+
+    def test_keyed_bodies_cached(self):
+        compressor = Compressor()
+        first = compressor.compress(BODY, 'gzip', '"etag"')
+        self.assertIs(compressor.compress(BODY, 'gzip', '"etag"'), first)
+        self.assertEqual((compressor.hits, compressor.misses), (1, 1))
+        self.assertEqual(compressor.size, len(first))
+
+    def test_unkeyed_bodies_not_cached(self):
+        compressor = Compressor()
+        for n in range(10):
+            compressor.compress(BODY + b' ' * n, 'gzip')
+        self.assertEqual((compressor.size, compressor.hits, compressor.misses), (0, 0, 0))
+        self.assertEqual(compressor.bytesin, sum(len(BODY) + n for n in range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
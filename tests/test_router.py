@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for xlib.router
+"""
+import unittest
+
+from xlib.router import Router
+
+__version__ = '0.1'
+
+
+def handler(name: str) -> callable:
+    def handle(requesthandler: object, **params) -> tuple:
+        return name, params
+    handle.__name__ = name
+    return handle
+
+
+class RouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        for method, pattern in (('GET', '/a/b/c'), ('GET', '/a/{x}/d'), ('GET', '/users/{user}'),
+                                ('POST', '/users/{user}'), ('GET', '/users/me'), ('GET', '/files/{path*}'),
+                                ('GET', '/files/{name}/info'), ('PUT', '/only/put'), ('GET', '/')):
+            self.router.add(method, pattern, handler(method + ' ' + pattern))
+
+    def match(self, method: str, path: str) -> tuple:
+        found, params, pattern, allowed = self.router.match(method, path)
+        return (pattern, params) if found is not None else allowed
+
+    def test_literal_before_param(self):
+        self.assertEqual(self.match('GET', '/users/me'), ('/users/me', {}))
+        self.assertEqual(self.match('GET', '/users/ann%20b'), ('/users/{user}', {'user': 'ann b'}))
+
+    def test_backtracks_to_param(self):
+        self.assertEqual(self.match('GET', '/a/b/c'), ('/a/b/c', {}))
+        self.assertEqual(self.match('GET', '/a/b/d'), ('/a/{x}/d', {'x': 'b'}))
+        self.assertEqual(self.match('GET', '/a/z/d'), ('/a/{x}/d', {'x': 'z'}))
+        self.assertEqual(self.match('GET', '/a/b/e'), [])
+
+    def test_backtracks_to_param_for_method(self):
+        self.assertEqual(self.match('POST', '/users/me'), ('/users/{user}', {'user': 'me'}))
+
+    def test_prefix(self):
+        self.assertEqual(self.match('GET', '/files/x/info'), ('/files/{name}/info', {'name': 'x'}))
+        self.assertEqual(self.match('GET', '/files/x/y/z'), ('/files/{path*}', {'path': 'x/y/z'}))
+        self.assertEqual(self.match('GET', '/files/'), ('/files/{path*}', {'path': ''}))
+
+    def test_method_not_allowed(self):
+        self.assertEqual(self.match('DELETE', '/users/ann'), ['GET', 'HEAD', 'POST'])
+        self.assertEqual(self.match('GET', '/only/put'), ['PUT'])
+        self.assertEqual(self.match('HEAD', '/only/put'), ['PUT'])
+
+    def test_not_found(self):
+        self.assertEqual(self.match('GET', '/nowhere'), [])
+        self.assertEqual(self.match('GET', 'nowhere'), [])
+
+    def test_head_uses_get(self):
+        self.assertEqual(self.match('HEAD', '/'), ('/', {}))
+        self.assertEqual(self.match('HEAD', '/a/b/d'), ('/a/{x}/d', {'x': 'b'}))
+        self.assertEqual(self.match('HEAD', '/files/x/y'), ('/files/{path*}', {'path': 'x/y'}))
+        head = handler('HEAD /users/{user}')
+        self.router.add('HEAD', '/users/{user}', head)
+        self.assertIs(self.router.match('HEAD', '/users/ann')[0], head)
+
+    def test_update_replaces(self):
+        other = Router()
+        replacement = handler('replacement')
+        other.add('GET', '/a/b/c', replacement)
+        self.router.update(other)
+        self.assertIs(self.router.match('GET', '/a/b/c')[0], replacement)
+
+
+if __name__ == '__main__':
+    unittest.main()
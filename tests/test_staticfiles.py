@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the Range parsing of xlib.staticfiles
+"""
+import unittest
+
+from xlib.staticfiles import byterange
+
+__version__ = '0.1'
+
+
+class ByteRangeTest(unittest.TestCase):
+
+    def test_satisfiable(self):
+        self.assertEqual(byterange('bytes=0-9', 100), (0, 10))
+        self.assertEqual(byterange('bytes=90-', 100), (90, 100))
+        self.assertEqual(byterange('bytes=90-200', 100), (90, 100))
+        self.assertEqual(byterange('bytes=-10', 100), (90, 100))
+        self.assertEqual(byterange('bytes=5-5', 100), (5, 6))
+
+    def test_unsatisfiable(self):
+        self.assertEqual(byterange('bytes=100-', 100), (100, 100))
+        self.assertEqual(byterange('bytes=100-200', 100), (100, 100))
+        self.assertEqual(byterange('bytes=-0', 100), (100, 100))
+
+    def test_invalid_ignored(self):
+        self.assertIsNone(byterange('bytes=5-3', 100))
+        self.assertIsNone(byterange('bytes=200-3', 100))
+        self.assertIsNone(byterange('bytes=x-3', 100))
+        self.assertIsNone(byterange('bytes=0-1,5-6', 100))
+        self.assertIsNone(byterange('items=0-1', 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
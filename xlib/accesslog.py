@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Access logging: every request, a sample of requests, or per-interval rollups per path
+"""
+import logging
+from json import dumps
+from random import random
+from threading import Lock
+from time import localtime, strftime, time
+
+from xlib.forkhooks import afterfork
+
+__version__ = '0.1'
+ACCESSLOGMODES = ('full', 'sample', 'rollup')
+QUANTILES = (0.5, 0.9, 0.99)
+OTHERPATHS = '-other-'
+
+
+class PathRollup(object):
+    """
+    Requests to one path within one rollup interval
+    """
+    __slots__ = ('count', 'statuses', 'bytesin', 'bytesout', 'latencies')
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.bytesin = 0
+        self.bytesout = 0
+        self.latencies = []
+
+    def add(self, status: int, bytesin: int, bytesout: int, seconds: float) -> None:
+        self.count += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytesin += bytesin
+        self.bytesout += bytesout
+        self.latencies.append(seconds)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        picks = [('p{:g}'.format(q * 100), latencies[min(len(latencies) - 1, int(q * len(latencies)))])
+                 for q in QUANTILES] + [('max', latencies[-1])]
+        return dict(count=self.count, status=dict((str(k), v) for k, v in sorted(self.statuses.items())),
+                    bytesin=self.bytesin, bytesout=self.bytesout,
+                    latencyms=dict((name, round(seconds * 1000, 3)) for name, seconds in picks))
+
+
+class AccessLog(object):
+    """
+    Decides which requests reach the access log, and in what form
+    mode 'full'     one line per request
+    mode 'sample'   one line for a random samplerate fraction of requests, and for every request that failed
+                    (status 400 or higher) or took slowseconds or longer
+    mode 'rollup'   one JSON line per path and interval seconds: request count, status mix, bytes and latency
+                    quantiles; an interval is written by the first request after it ends, or by flush()
+    At most maxpaths paths are kept per interval, requests to further paths are counted under OTHERPATHS
+    """
+
+    def __init__(self, mode: str = 'full', samplerate: float = 0.01, slowseconds: float = 1.0,
+                 interval: float = 1.0, maxpaths: int = 1000):
+        assert mode in ACCESSLOGMODES
+        self.mode = mode
+        self.samplerate = samplerate
+        self.slowseconds = slowseconds
+        self.interval = interval
+        self.maxpaths = maxpaths
+        self.lines = 0
+        self.skipped = 0
+        self.__reset__()
+        afterfork(self.__reset__)
+
+    def __reset__(self) -> None:
+        self.__lock__ = Lock()
+        self.__window__ = None
+        self.__paths__ = {}
+
+    def record(self, logger: logging.Logger, line: callable, path: str, status: int, bytesin: int, bytesout: int,
+               seconds: float) -> None:
+        """
+        Account for one request
+        :param logger: access logger
+        :param line: callable returning the access log line of the request, called only if the line is written
+        :param path: request path without query
+        :param status: response status
+        :param bytesin: request body bytes
+        :param bytesout: response body bytes
+        :param seconds: time taken to handle the request
+        :return: None
+        """
+        if self.mode == 'full' or (self.mode == 'sample' and (
+                status >= 400 or seconds >= self.slowseconds or random() < self.samplerate)):
+            self.lines += 1
+            logger.info(line(), stacklevel=2)
+        elif self.mode == 'sample':
+            self.skipped += 1
+        else:
+            self.__rollup__(logger, path, status, bytesin, bytesout, seconds)
+
+    def __rollup__(self, logger: logging.Logger, path: str, status: int, bytesin: int, bytesout: int,
+                   seconds: float) -> None:
+        window = int(time() // self.interval)
+        with self.__lock__:
+            if window != self.__window__:
+                ended = self.__window__, self.__paths__
+                self.__window__, self.__paths__ = window, {}
+            else:
+                ended = None
+            rollup = self.__paths__.get(path)
+            if rollup is None:
+                if len(self.__paths__) >= self.maxpaths:
+                    path = OTHERPATHS
+                rollup = self.__paths__.setdefault(path, PathRollup())
+            rollup.add(status, bytesin, bytesout, seconds)
+        if ended is not None:
+            self.__write__(logger, *ended)
+
+    def flush(self, logger: logging.Logger) -> None:
+        """
+        Write the rollups of the current interval
+        :param logger: access logger
+        :return: None
+        """
+        with self.__lock__:
+            ended = self.__window__, self.__paths__
+            self.__window__, self.__paths__ = None, {}
+        self.__write__(logger, *ended)
+
+    def __write__(self, logger: logging.Logger, window: int, paths: dict) -> None:
+        if window is None or not paths:
+            return
+        start = strftime('%Y-%m-%dT%H:%M:%S', localtime(window * self.interval))
+        for path, rollup in sorted(paths.items()):
+            self.lines += 1
+            logger.info(dumps(dict(interval=start, seconds=self.interval, path=path, **rollup.summary()),
+                              separators=(',', ':')))
+
+    def metrics(self) -> list:
+        """
+        :return: access log counters in Prometheus text format
+        """
+        return ['# TYPE opentrx_accesslog_lines_total counter', 'opentrx_accesslog_lines_total {}'.format(self.lines),
+                '# TYPE opentrx_accesslog_skipped_total counter',
+                'opentrx_accesslog_skipped_total {}'.format(self.skipped)]
+
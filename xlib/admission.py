@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-client admission control: concurrent connection caps and token-bucket request rates
+"""
+from collections import OrderedDict
+from math import ceil
+from threading import Lock
+from time import monotonic
+
+from xlib.forkhooks import afterfork
+
+__version__ = '0.1'
+
+
+class ClientState(object):
+    """
+    Open connections and request tokens of one client address
+    """
+    __slots__ = ('connections', 'tokens', 'updated')
+
+    def __init__(self, tokens: float, now: float):
+        self.connections = 0
+        self.tokens = tokens
+        self.updated = now
+
+
+class Admission(object):
+    """
+    Decides whether a client may open another connection or make another request
+    maxconnections  connections a client address may hold at once, 0 for no cap
+    rate            requests per second a client address may make on average, 0 for no limit
+    burst           requests a client address may make at once before rate applies
+    Clients are kept in least recently seen order; a client without connections whose bucket has refilled is no
+    different from one never seen and is dropped, and beyond maxclients the least recently seen idle clients are
+    dropped, so memory stays bounded however many addresses connect
+    State is per process: with several worker processes each one applies the limits to the connections it accepts
+    """
+
+    def __init__(self, maxconnections: int = 0, rate: float = 0.0, burst: int = 20, maxclients: int = 65536):
+        assert maxconnections >= 0 and rate >= 0 and burst >= 1 and maxclients > 0
+        self.maxconnections = maxconnections
+        self.rate = rate
+        self.burst = burst
+        self.maxclients = maxclients
+        self.rejected = 0
+        self.limited = 0
+        self.evicted = 0
+        self.__reset__()
+        afterfork(self.__reset__)
+
+    def __reset__(self) -> None:
+        self.__lock__ = Lock()
+        self.__clients__ = OrderedDict()
+
+    def connect(self, address: str) -> bool:
+        """
+        Admit a new connection from address; every admitted connection has to be released by disconnect()
+        :param address: client address
+        :return: True if admitted, False if the client already holds maxconnections connections
+        """
+        if self.maxconnections == 0:
+            return True
+        with self.__lock__:
+            client = self.__client__(address, monotonic())
+            if client.connections >= self.maxconnections:
+                self.rejected += 1
+                return False
+            client.connections += 1
+        return True
+
+    def disconnect(self, address: str) -> None:
+        """
+        Release a connection admitted by connect()
+        :param address: client address
+        :return: None
+        """
+        if self.maxconnections == 0:
+            return
+        with self.__lock__:
+            client = self.__clients__.get(address)
+            if client is not None and client.connections > 0:
+                client.connections -= 1
+
+    def request(self, address: str) -> int:
+        """
+        Take a token for a request from address
+        :param address: client address
+        :return: 0 if the request is admitted, else seconds until the client has a token again
+        """
+        if self.rate == 0:
+            return 0
+        now = monotonic()
+        with self.__lock__:
+            client = self.__client__(address, now)
+            client.tokens = min(self.burst, client.tokens + (now - client.updated) * self.rate)
+            client.updated = now
+            if client.tokens >= 1:
+                client.tokens -= 1
+                return 0
+            self.limited += 1
+            return max(1, ceil((1 - client.tokens) / self.rate))
+
+    def __client__(self, address: str, now: float) -> ClientState:
+        """
+        Look up the state of address, creating it, and drop clients that no longer need state; call with lock held
+        """
+        clients = self.__clients__
+        client = clients.get(address)
+        if client is not None:
+            clients.move_to_end(address)
+            return client
+        refilled = now - (self.burst / self.rate if self.rate else 0.0)
+        # clients holding connections are moved behind the idle ones, a bounded number of them per call
+        for _ in range(8):
+            if not clients:
+                break
+            oldest = next(iter(clients.values()))
+            if oldest.connections > 0:
+                clients.move_to_end(next(iter(clients)))
+            elif oldest.updated <= refilled:
+                clients.popitem(last=False)
+            elif len(clients) >= self.maxclients:
+                clients.popitem(last=False)
+                self.evicted += 1
+            else:
+                break
+        client = clients[address] = ClientState(self.burst, now)
+        return client
+
+    @property
+    def clients(self) -> int:
+        return len(self.__clients__)
+
+    def metrics(self) -> list:
+        """
+        :return: admission counters in Prometheus text format
+        """
+        return ['# TYPE opentrx_admission_clients gauge', 'opentrx_admission_clients {}'.format(self.clients),
+                '# TYPE opentrx_admission_connections_rejected_total counter',
+                'opentrx_admission_connections_rejected_total {}'.format(self.rejected),
+                '# TYPE opentrx_admission_requests_limited_total counter',
+                'opentrx_admission_requests_limited_total {}'.format(self.limited),
+                '# TYPE opentrx_admission_clients_evicted_total counter',
+                'opentrx_admission_clients_evicted_total {}'.format(self.evicted)]
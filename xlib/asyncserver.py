@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio HTTP server engine
+"""
+import asyncio
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import current_thread, main_thread
+from time import perf_counter
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from xlib.unixsocket import UnixSocketMixIn, peeraddress
+
+__version__ = '0.1'
+
+
+class BodyReader(object):
+    """
+    rfile of a BufferedConnection: the request head from memory, then the body from the stream of the connection,
+    read by the event loop as the handler asks for it and within the body deadline, never past what it asks for
+    """
+
+    def __init__(self, head: bytes, server: 'AsyncHTTPServer', reader: asyncio.StreamReader):
+        self.__head__ = BytesIO(head)
+        self.__server__ = server
+        self.__reader__ = reader
+        self.__started__ = None
+        self.__received__ = 0
+
+    def read(self, size: int) -> bytes:
+        data = self.__head__.read(size)
+        if data or size == 0:
+            return data
+        return self.__fromstream__(self.__reader__.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        data = self.__head__.readline(size)
+        if data:
+            return data
+        return self.__fromstream__(self.__readline__())
+
+    def close(self) -> None:
+        self.__head__.close()
+
+    async def __readline__(self) -> bytes:
+        try:
+            return await self.__reader__.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError:
+            # a line longer than the stream limit is malformed for the handler: it gets no line at all
+            return b''
+
+    def __fromstream__(self, coroutine: object) -> bytes:
+        """
+        Run coroutine on the event loop and wait for its result; called on the thread running the handler
+        :raises ConnectionAbortedError: if the body deadline was missed
+        """
+        server = self.__server__
+        if self.__started__ is None:
+            self.__started__ = perf_counter()
+        future = asyncio.run_coroutine_threadsafe(server.__within__(
+            coroutine, 'body', server.__bodyseconds__(self.__started__, self.__received__)), server.__loop__)
+        data = future.result()
+        self.__received__ += len(data)
+        return data
+
+
+class BufferedConnection(object):
+    """
+    Socket stand-in that presents one request to a RequestHandler and collects the response it writes
+    """
+
+    def __init__(self, rfile: BodyReader):
+        self.__rfile__ = rfile
+        self.__response__ = bytearray()
+
+    def makefile(self, mode: str = 'rb', buffering: int = -1) -> BodyReader:
+        assert mode == 'rb'
+        return self.__rfile__
+
+    def sendall(self, data: bytes) -> None:
+        self.__response__ += data
+
+    def settimeout(self, timeout: float) -> None:
+        pass
+
+    def setsockopt(self, *args) -> None:
+        pass
+
+    @property
+    def response(self) -> bytearray:
+        return self.__response__
+
+
+class AsyncHTTPServer(object):
+    """
+    HTTP server that holds connections on asyncio streams and runs RequestHandlerClass on a bounded thread pool
+    Idle and slow connections cost a coroutine, not a thread: the head of a request is read by the event loop and
+    handed to the pool as a BufferedConnection, whose handler reads the body through the event loop as it consumes
+    it, so a body is never held whole; the buffered response is written back by the event loop
+    Mirrors the socketserver interface used by Listener (bind_and_activate, serve_forever, shutdown, server_close)
+    On shutdown the server stops accepting, closes connections waiting for a request and gives the others draintimeout
+    seconds to finish, then aborts them
+    A connection beyond the connections RequestHandlerClass.admission allows its client is aborted before the handshake
+    The request headers, body and response write deadlines of RequestHandlerClass apply, and a connection that misses
+    one is aborted and counted by RequestHandlerClass.reaper
+    Uses the uvloop event loop policy if uvloop is installed
+    """
+    address_family = socket.AF_INET
+    request_queue_size = 1024
+    allow_reuse_address = True
+    allow_reuse_port = False
+    sslcontext = None
+    handshaketimeout = 5.0
+    draintimeout = 0.0
+    executorthreads = 32
+    maxheadersize = 65536
+    headertoolarge = b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+    def __init__(self, server_address: (str, int), RequestHandlerClass: type, bind_and_activate: bool = True):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.socket = socket.socket(self.address_family, socket.SOCK_STREAM)
+        self.__loop__ = None
+        self.__stopped__ = None
+        self.__shutdown__ = False
+        self.__interrupted__ = False
+        self.__serving__ = None
+        self.__executor__ = None
+        self.__connections__ = {}
+        self.__idle__ = set()
+        if bind_and_activate:
+            try:
+                self.server_bind()
+                self.server_activate()
+            except Exception:
+                self.server_close()
+                raise
+
+    def server_bind(self) -> None:
+        if self.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.allow_reuse_port and hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(self.server_address)
+        self.server_address = self.socket.getsockname()
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+
+    def server_activate(self) -> None:
+        self.socket.listen(self.request_queue_size)
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        """
+        Run the event loop until shutdown() is called or, in the main thread, SIGINT is received
+        SIGINT drains connections for draintimeout seconds as shutdown() does, a further SIGINT cuts that short, and
+        KeyboardInterrupt is then raised to the caller
+        :param poll_interval: unused, kept for compatibility with socketserver
+        :return: None
+        """
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(self.__serve__())
+        if self.__interrupted__:
+            self.__interrupted__ = False
+            raise KeyboardInterrupt
+
+    def shutdown(self) -> None:
+        """
+        Stop serve_forever(); may be called from any thread other than the one running serve_forever(), also before
+        serve_forever() has started
+        :return: None
+        """
+        self.__shutdown__ = True
+        if self.__loop__ is not None:
+            self.__loop__.call_soon_threadsafe(self.__stopped__.set)
+
+    def server_close(self) -> None:
+        self.socket.close()
+
+    async def __serve__(self) -> None:
+        self.__stopped__ = asyncio.Event()
+        self.__loop__ = asyncio.get_running_loop()
+        self.__serving__ = asyncio.current_task()
+        if self.__shutdown__:
+            self.__stopped__.set()
+        if current_thread() is main_thread():
+            self.__loop__.add_signal_handler(signal.SIGINT, self.__sigint__)
+        self.__executor__ = ThreadPoolExecutor(max_workers=self.executorthreads, thread_name_prefix='async')
+        try:
+            server = await asyncio.start_server(self.__connection__, sock=self.socket, limit=self.maxheadersize)
+            async with server:
+                await self.__stopped__.wait()
+                # stop accepting first: on the selector loop a connection accepted just before takes a few
+                # iterations to reach __connection__ and is dropped if close() detaches the server before that
+                if uvloop is None:
+                    self.__loop__.remove_reader(self.socket.fileno())
+                    for _ in range(3):
+                        await asyncio.sleep(0)
+                server.close()
+                for task in self.__idle__:
+                    task.cancel()
+                if self.__connections__ and self.draintimeout > 0:
+                    await asyncio.wait(list(self.__connections__), timeout=self.draintimeout)
+        except asyncio.CancelledError:
+            if not self.__interrupted__:
+                raise
+        finally:
+            self.__stopped__.set()
+            for writer in self.__connections__.values():
+                if writer is not None:
+                    writer.transport.abort()
+            if self.__connections__:
+                await asyncio.wait(list(self.__connections__))
+            self.__executor__.shutdown(wait=True)
+            if current_thread() is main_thread():
+                self.__loop__.remove_signal_handler(signal.SIGINT)
+            self.__loop__ = None
+            self.__serving__ = None
+            self.__shutdown__ = False
+
+    def __sigint__(self) -> None:
+        # the default handler of asyncio.run cancels __serve__, which drops every connection at once
+        if self.__interrupted__:
+            self.__serving__.cancel()
+        else:
+            self.__interrupted__ = True
+            self.RequestHandlerClass.draining = True
+            self.__stopped__.set()
+
+    async def __connection__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client_address = self.clientaddress(writer)
+        if not self.RequestHandlerClass.admission.connect(client_address[0]):
+            writer.transport.abort()
+            return
+        task = asyncio.current_task()
+        self.__connections__[task] = None
+        requests = 0
+        try:
+            if self.sslcontext is not None and not await self.__handshake__(writer, client_address):
+                return
+            # connections are aborted on shutdown only after the handshake, aborting during start_tls breaks it
+            self.__connections__[task] = writer
+            self.RequestHandlerClass.metrics.connection(1)
+            close = False
+            while not close and not self.__stopped__.is_set():
+                self.__idle__.add(task)
+                try:
+                    first = await asyncio.wait_for(reader.read(1), self.RequestHandlerClass.idletimeout)
+                except asyncio.TimeoutError:
+                    break
+                finally:
+                    self.__idle__.discard(task)
+                head = await self.__readhead__(first, reader, writer) if first else None
+                if head is None:
+                    break
+                response, close = await self.__loop__.run_in_executor(self.__executor__, self.__handle__,
+                                                                      BodyReader(head, self, reader),
+                                                                      client_address, requests)
+                requests += 1
+                await self.__writeresponse__(writer, response)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            self.RequestHandlerClass.logger.exception(e)
+        finally:
+            if self.__connections__.pop(task) is not None:
+                self.RequestHandlerClass.metrics.connection(-1)
+                self.RequestHandlerClass.log_connection(client_address, requests)
+            if writer.transport is not None:
+                writer.close()
+            self.RequestHandlerClass.admission.disconnect(client_address[0])
+
+    def clientaddress(self, writer: asyncio.StreamWriter) -> (str, int):
+        return writer.get_extra_info('peername')
+
+    async def __handshake__(self, writer: asyncio.StreamWriter, client_address: (str, int)) -> bool:
+        start = perf_counter()
+        try:
+            await writer.start_tls(self.sslcontext, ssl_handshake_timeout=self.handshaketimeout)
+        except Exception as e:
+            if isinstance(e, TimeoutError) or perf_counter() - start >= self.handshaketimeout:
+                self.RequestHandlerClass.reaper.timedout('handshake')
+            self.RequestHandlerClass.logger.error('{} - - TLS handshake failed after {:.3f}ms: {}'.format(
+                client_address[0], (perf_counter() - start) * 1000, e))
+            return False
+        elapsed = perf_counter() - start
+        self.RequestHandlerClass.metrics.handshake(elapsed)
+        self.RequestHandlerClass.logger.info('{} - - TLS handshake {} {:.3f}ms'.format(
+            client_address[0], writer.get_extra_info('ssl_object').version(), elapsed * 1000))
+        return True
+
+    async def __within__(self, awaitable: object, kind: str, seconds: float) -> object:
+        """
+        :param kind: one of DEADLINEKINDS
+        :param seconds: deadline for awaitable, None for none
+        :return: the result of awaitable
+        :raises ConnectionAbortedError: if awaitable missed the deadline, counted by RequestHandlerClass.reaper
+        """
+        if seconds is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(seconds, 0))
+        except asyncio.TimeoutError:
+            self.RequestHandlerClass.reaper.timedout(kind)
+            raise ConnectionAbortedError('missed the {} deadline'.format(kind))
+
+    async def __writeresponse__(self, writer: asyncio.StreamWriter, response: bytes) -> None:
+        """
+        Write response in pieces of writechunksize bytes, each drained within writetimeout seconds
+        :return: None
+        """
+        handler = self.RequestHandlerClass
+        response, size = memoryview(response), handler.writechunksize
+        for offset in range(0, len(response), size):
+            writer.write(response[offset:offset + size])
+            await self.__within__(writer.drain(), 'write', handler.writetimeout or None)
+
+    def __bodyseconds__(self, started: float, received: int) -> float:
+        """
+        :return: time left to read the body in, None if the body has no deadline
+        """
+        handler = self.RequestHandlerClass
+        if not handler.bodytimeout:
+            return None
+        return started + handler.bodytimeout - perf_counter() + (
+            received / handler.minbodyrate if handler.minbodyrate else 0)
+
+    async def __readhead__(self, first: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bytes:
+        """
+        Read the head of one request from the stream; its body is left to the handler
+        :param first: first byte of the request, already read
+        :return: request line and headers, None if the connection was closed or the head is too large
+        """
+        try:
+            return first + await self.__within__(reader.readuntil(b'\r\n\r\n'), 'headers',
+                                                 self.RequestHandlerClass.headertimeout or None)
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            writer.write(self.headertoolarge)
+            return None
+
+    def __handle__(self, rfile: BodyReader, client_address: (str, int), requests: int) -> (bytearray, bool):
+        """
+        Run RequestHandlerClass for one request; runs on the thread pool
+        :param rfile: the request
+        :param requests: number of requests already served on the connection
+        :return: response bytes and whether the connection is to be closed after writing them
+        """
+        connection = BufferedConnection(rfile)
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request, handler.client_address, handler.server = connection, client_address, self
+        handler.requestcount = requests
+        handler.setup()
+        try:
+            handler.close_connection = True
+            handler.handle_one_request()
+        finally:
+            handler.finish()
+        return connection.response, handler.close_connection
+
+
+class UnixAsyncHTTPServer(UnixSocketMixIn, AsyncHTTPServer):
+    """
+    AsyncHTTPServer on a Unix domain socket
+    """
+
+    def clientaddress(self, writer: asyncio.StreamWriter) -> (str, int):
+        return peeraddress(writer.get_extra_info('socket'))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thread-safe client for a Listener, over a pool of kept-alive connections
+"""
+import select
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException, HTTPResponse, HTTPSConnection
+from json import loads
+from os.path import exists, join
+from ssl import SSLContext, TLSVersion, create_default_context
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+from xlib.unixsocket import UnixHTTPConnection
+from xlib.vardir import CERTFILESTORE, HOSTNAMEFILE, UNIXSOCKETFILE
+
+__version__ = '0.1'
+BODYMETHODS = ('POST', 'PUT', 'PATCH')
+IDEMPOTENTMETHODS = ('GET', 'HEAD')
+
+
+class Response(object):
+    """
+    A response read in full
+    """
+    __slots__ = ('status', 'reason', 'headers', 'body')
+
+    def __init__(self, status: int, reason: str, headers: object, body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class ResumingHTTPSConnection(HTTPSConnection):
+    """
+    HTTPSConnection offering session, the TLS session of an earlier connection, so the server can resume it instead
+    of running a full handshake
+    """
+
+    def __init__(self, host: str, port: int, context: SSLContext, session: object = None, timeout: float = None):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self.context = context
+        self.session = session
+
+    def connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock = self.context.wrap_socket(sock, server_hostname=self.host, session=self.session)
+        except OSError:
+            sock.close()
+            raise
+
+
+class SharedReader(object):
+    """
+    Hands each HTTPResponse of a pipeline the same buffered reader, which they cannot close, so that bytes of the
+    next response read ahead into the buffer stay there for it
+    """
+
+    def __init__(self, reader: object):
+        self.reader = reader
+
+    def makefile(self, mode: str) -> object:
+        return self
+
+    def close(self) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.reader, name)
+
+
+class Client(object):
+    """
+    Client for the Listener whose files are in vardir: it connects to the address published in host.txt and trusts
+    only the certificate published in cert.pem, or with unixsocket, or when no host.txt is published, it connects to
+    the Unix domain socket published in socket.txt
+    Up to poolsize connections are kept alive and shared by all threads; a connection idle for idletimeout seconds,
+    shorter than the server's, is closed rather than reused. New TLS connections resume the session of the last
+    connection, so after the first a handshake costs no key exchange
+    submit() pipelines requests, up to pipelinedepth on a connection before reading their responses, and fanout()
+    spreads them over the pool; requests the server did not answer because it closed the connection are sent again
+    on another. An idle connection the server closed is discarded before use; if a kept-alive connection fails all
+    the same, its unanswered requests are sent again once on another only if none of them was written yet or all of
+    them are GET or HEAD, a request the server may have acted on is otherwise never repeated and the error raised
+    Requests are (method, path, body, headers) tuples, body and headers optional
+    """
+
+    def __init__(self, vardir: str, poolsize: int = 8, timeout: float = 30.0, idletimeout: float = 10.0,
+                 pipelinedepth: int = 32, unixsocket: bool = False):
+        assert poolsize > 0 and pipelinedepth > 0
+        self.vardir = vardir
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.idletimeout = idletimeout
+        self.pipelinedepth = pipelinedepth
+        self.unixsocket = unixsocket
+        self.handshakes = 0
+        self.resumed = 0
+        self.__endpoint__ = None
+        self.__context__ = None
+        self.__session__ = None
+        self.__idle__ = deque()
+        self.__lock__ = Lock()
+        self.__available__ = BoundedSemaphore(poolsize)
+        self.__executor__ = None
+        self.discover()
+
+    def discover(self) -> None:
+        """
+        Read the endpoint and the certificate the Listener published; pooled connections to the previous endpoint
+        are closed
+        :return: None
+        """
+        hostpath = join(self.vardir, HOSTNAMEFILE)
+        if not self.unixsocket and exists(hostpath):
+            with open(hostpath, 'r') as hostfile:
+                _, host, port = loads(hostfile.readline())
+            context = create_default_context(cafile=join(self.vardir, CERTFILESTORE))
+            context.minimum_version = TLSVersion.MINIMUM_SUPPORTED
+            endpoint = (host, port)
+        else:
+            with open(join(self.vardir, UNIXSOCKETFILE), 'r') as socketfile:
+                _, path = loads(socketfile.readline())
+            context, endpoint = None, (path,)
+        with self.__lock__:
+            self.__endpoint__, self.__context__, self.__session__ = endpoint, context, None
+            idle, self.__idle__ = self.__idle__, deque()
+        for connection, _ in idle:
+            connection.close()
+
+    @property
+    def hostheader(self) -> str:
+        return 'localhost' if self.__context__ is None else '{}:{}'.format(*self.__endpoint__)
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> Response:
+        """
+        :return: the response to one request
+        """
+        return self.submit([(method, path, body, headers)])[0]
+
+    def submit(self, requests: list) -> list:
+        """
+        Send requests pipelined over pooled connections, in order
+        :param requests: (method, path, body, headers) tuples
+        :return: their responses, in the same order
+        """
+        requests = [tuple(request) + (None,) * (4 - len(request)) for request in requests]
+        responses, retried, rediscovered = [], False, False
+        while len(responses) < len(requests):
+            answered = len(responses)
+            batch = requests[answered:answered + self.pipelinedepth]
+            connection = self.__acquire__()
+            reused = connection.sock is not None
+            try:
+                if not reused:
+                    self.__connect__(connection)
+            except OSError:
+                self.__release__(connection, False)
+                if rediscovered:
+                    raise
+                # the Listener may have been restarted with another address or certificate
+                rediscovered = True
+                self.discover()
+                continue
+            data, sent = memoryview(b''.join(self.__serialize__(*request) for request in batch)), 0
+            try:
+                while sent < len(data):
+                    sent += connection.sock.send(data[sent:])
+                keepalive = self.__exchange__(connection, batch, responses)
+            except (OSError, HTTPException):
+                self.__release__(connection, False)
+                unanswered = batch[len(responses) - answered:]
+                if not reused or retried or (sent and any(method not in IDEMPOTENTMETHODS
+                                                          for method, _, _, _ in unanswered)):
+                    raise
+                # the server closed the kept-alive connection before it saw the requests, or they can be repeated
+                retried = True
+                continue
+            retried = False
+            self.__release__(connection, keepalive)
+        return responses
+
+    def fanout(self, requests: list, concurrency: int = None) -> list:
+        """
+        Send requests concurrently, split over up to concurrency pooled connections, each share pipelined
+        :param requests: (method, path, body, headers) tuples
+        :param concurrency: number of connections to use, at most poolsize; None for poolsize
+        :return: their responses, in the same order
+        """
+        requests = list(requests)
+        shares = max(1, min(concurrency or self.poolsize, self.poolsize, len(requests)))
+        size = -(-len(requests) // shares)
+        with self.__lock__:
+            if self.__executor__ is None:
+                self.__executor__ = ThreadPoolExecutor(max_workers=self.poolsize, thread_name_prefix='client')
+        futures = [self.__executor__.submit(self.submit, requests[start:start + size])
+                   for start in range(0, len(requests), size)]
+        return [response for future in futures for response in future.result()]
+
+    def close(self) -> None:
+        """
+        Close the pooled connections
+        :return: None
+        """
+        with self.__lock__:
+            idle, self.__idle__ = self.__idle__, deque()
+            executor, self.__executor__ = self.__executor__, None
+        for connection, _ in idle:
+            connection.close()
+        if executor is not None:
+            executor.shutdown()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    def __acquire__(self) -> object:
+        self.__available__.acquire()
+        now = monotonic()
+        with self.__lock__:
+            while self.__idle__:
+                connection, since = self.__idle__.pop()
+                if now - since < self.idletimeout and not self.__closedbypeer__(connection):
+                    break
+                connection.close()
+            else:
+                connection = None
+            endpoint, context, session = self.__endpoint__, self.__context__, self.__session__
+            # older idle connections are closed by the server first
+            while self.__idle__ and now - self.__idle__[0][1] >= self.idletimeout:
+                self.__idle__.popleft()[0].close()
+        if connection is not None:
+            return connection
+        if context is None:
+            return UnixHTTPConnection(endpoint[0], timeout=self.timeout)
+        return ResumingHTTPSConnection(*endpoint, context=context, session=session, timeout=self.timeout)
+
+    @staticmethod
+    def __closedbypeer__(connection: object) -> bool:
+        # an idle connection has nothing to read unless the server closed it
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def __connect__(self, connection: object) -> None:
+        connection.connect()
+        if isinstance(connection, ResumingHTTPSConnection):
+            with self.__lock__:
+                self.handshakes += 1
+                self.resumed += connection.sock.session_reused
+
+    def __release__(self, connection: object, keepalive: bool) -> None:
+        try:
+            if not keepalive:
+                connection.close()
+                return
+            session = getattr(connection.sock, 'session', None)
+            with self.__lock__:
+                # a TLS 1.3 session ticket arrives after the handshake, so the session is taken after a response
+                if session is not None:
+                    self.__session__ = session
+                self.__idle__.append((connection, monotonic()))
+        finally:
+            self.__available__.release()
+
+    def __serialize__(self, method: str, path: str, body: bytes, headers: dict) -> bytes:
+        fields = {'Host': self.hostheader, 'Accept-Encoding': 'identity'}
+        fields.update(headers or {})
+        body = body or b''
+        if body or method in BODYMETHODS:
+            fields['Content-Length'] = str(len(body))
+        head = ['{} {} HTTP/1.1'.format(method, path)] + ['{}: {}'.format(*field) for field in fields.items()]
+        return '\r\n'.join(head + ['', '']).encode('latin-1') + body
+
+    def __exchange__(self, connection: object, requests: list, responses: list) -> bool:
+        """
+        Read the responses to requests, written at once, into responses, fewer if the server closes the connection
+        :return: True if the connection can be reused
+        """
+        reader = SharedReader(connection.sock.makefile('rb'))
+        try:
+            for method, _, _, _ in requests:
+                response = HTTPResponse(reader, method=method)
+                response.begin()
+                responses.append(Response(response.status, response.reason, response.headers, response.read()))
+                if response.will_close:
+                    return False
+        finally:
+            reader.reader.close()
+        return True
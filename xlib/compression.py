@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Negotiated response compression with a cache of compressed bodies
+"""
+import gzip
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__version__ = '0.1'
+COMPRESSIBLETYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+                     'application/ndjson', 'application/jsonl', 'image/svg+xml')
+
+
+def encoders() -> OrderedDict:
+    """
+    :return: compress function by content coding, in order of preference, for the codings available
+    """
+    available = OrderedDict()
+    if zstandard is not None:
+        # a ZstdCompressor may not be used by several threads at once
+        available['zstd'] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+    if brotli is not None:
+        available['br'] = lambda data: brotli.compress(bytes(data), quality=5)
+    available['gzip'] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+    available['deflate'] = lambda data: zlib.compress(data, 6)
+    return available
+
+
+def acceptable(acceptencoding: str) -> dict:
+    """
+    :param acceptencoding: value of Accept-Encoding
+    :return: quality value by lower case content coding
+    """
+    qualities = {}
+    for item in acceptencoding.split(','):
+        coding, _, parameters = item.partition(';')
+        coding, quality = coding.strip().lower(), 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+    return qualities
+
+
+def variantetag(etag: str, coding: str) -> str:
+    """
+    :param etag: entity tag of a response, quoted
+    :param coding: content coding
+    :return: entity tag of the response body compressed with coding
+    """
+    return '{}-{}"'.format(etag[:-1], coding)
+
+
+class Compressor(object):
+    """
+    Picks a content coding for a response and compresses its body
+    Bodies of compressible content types from minsize up to maxlength bytes are compressed, others sent as they are
+    Compressed bodies are kept in an LRU cache of at most maxsize bytes keyed by the entity tag of the body and the
+    coding, so a body sent repeatedly is compressed once; a body without one, which changes with every response, is
+    compressed every time and not kept. Time spent compressing and bytes saved are counted for metrics()
+    zstd and br are offered only if the zstandard and brotli modules are installed
+    """
+
+    def __init__(self, minsize: int = 1024, maxlength: int = 8 * 1024 * 1024, maxsize: int = 16 * 1024 * 1024):
+        self.minsize = minsize
+        self.maxlength = maxlength
+        self.maxsize = maxsize
+        self.encoders = encoders()
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+        self.bytesin = 0
+        self.bytesout = 0
+        self.__size__ = 0
+        self.__entries__ = OrderedDict()
+        self.__lock__ = Lock()
+
+    def compressible(self, contenttype: str, length: int) -> bool:
+        """
+        :param contenttype: value of Content-Type
+        :param length: body length
+        :return: True if the response is sent compressed to clients that accept it, and so varies on Accept-Encoding
+        """
+        return self.minsize <= length <= self.maxlength and (contenttype or '').lower().startswith(COMPRESSIBLETYPES)
+
+    def negotiate(self, acceptencoding: str, contenttype: str, length: int) -> str:
+        """
+        :param acceptencoding: value of Accept-Encoding or None
+        :param contenttype: value of Content-Type
+        :param length: body length
+        :return: content coding to send the body in, None to send it as it is
+        """
+        if not acceptencoding or not self.compressible(contenttype, length):
+            return None
+        qualities = acceptable(acceptencoding)
+        wildcard = qualities.get('*', 0.0)
+        best, bestquality = None, 0.0
+        for coding in self.encoders:
+            quality = qualities.get(coding, qualities.get('x-gzip', wildcard) if coding == 'gzip' else wildcard)
+            if quality > bestquality:
+                best, bestquality = coding, quality
+        return best
+
+    def compress(self, body: bytes, coding: str, key: str = None) -> bytes:
+        """
+        :param body: body to compress
+        :param coding: content coding returned by negotiate()
+        :param key: string identifying the content of body, like its entity tag; None not to cache it
+        :return: compressed body, from the cache if body was compressed before
+        """
+        entry = (key, coding)
+        if key is not None:
+            with self.__lock__:
+                compressed = self.__entries__.get(entry)
+                if compressed is not None:
+                    self.hits += 1
+                    self.bytesin += len(body)
+                    self.bytesout += len(compressed)
+                    self.__entries__.move_to_end(entry)
+                    return compressed
+                self.misses += 1
+        start = perf_counter()
+        compressed = self.encoders[coding](body)
+        elapsed = perf_counter() - start
+        with self.__lock__:
+            self.seconds += elapsed
+            self.bytesin += len(body)
+            self.bytesout += len(compressed)
+            if key is not None and len(compressed) <= self.maxsize and entry not in self.__entries__:
+                self.__entries__[entry] = compressed
+                self.__size__ += len(compressed)
+                while self.__size__ > self.maxsize:
+                    self.__size__ -= len(self.__entries__.popitem(last=False)[1])
+        return compressed
+
+    @property
+    def size(self) -> int:
+        return self.__size__
+
+    def metrics(self) -> list:
+        """
+        :return: compression counters in Prometheus text format
+        """
+        return ['# TYPE opentrx_compression_seconds_total counter',
+                'opentrx_compression_seconds_total {}'.format(self.seconds),
+                '# TYPE opentrx_compression_bytes_in_total counter',
+                'opentrx_compression_bytes_in_total {}'.format(self.bytesin),
+                '# TYPE opentrx_compression_bytes_saved_total counter',
+                'opentrx_compression_bytes_saved_total {}'.format(self.bytesin - self.bytesout),
+                '# TYPE opentrx_compression_cache_hits_total counter',
+                'opentrx_compression_cache_hits_total {}'.format(self.hits),
+                '# TYPE opentrx_compression_cache_misses_total counter',
+                'opentrx_compression_cache_misses_total {}'.format(self.misses),
+                '# TYPE opentrx_compression_cache_bytes gauge', 'opentrx_compression_cache_bytes {}'.format(self.size)]
@@ -2,18 +2,149 @@
 # -*- coding: utf-8 -*-
 import abc
 import atexit
+import logging
 import os
+import select
+import signal
 import sys
 from os.path import abspath, dirname, exists, expanduser, isdir, join
 from pwd import getpwuid
 from stat import filemode
-from time import sleep
+from threading import Thread, current_thread
+from time import monotonic, perf_counter, sleep
 
-from xlib.loggerconfig import LoggerConfiguration
+from xlib.loggerconfig import LoggerConfiguration, shutdownlogging
 
 __version__ = '0.1'
 
 
+def openfds() -> list:
+    """
+    :return: file descriptors open in this process, None if neither /proc/self/fd nor /dev/fd lists them
+    """
+    for fddir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            candidates = [int(fd) for fd in os.listdir(fddir)]
+        except OSError:
+            continue
+        break
+    else:
+        return None
+    fds = []
+    for fd in candidates:
+        try:
+            os.fstat(fd)
+        except OSError:
+            continue
+        fds.append(fd)
+    return fds
+
+
+def closefds(keep: set) -> None:
+    """
+    Close every file descriptor of this process but those in keep
+    The open descriptors are closed one by one; where they cannot be listed, the ranges between the kept ones are
+    closed by os.closerange() rather than checking every descriptor up to SC_OPEN_MAX, which can be millions
+    :param keep: file descriptors to leave open
+    :return: None
+    """
+    fds = openfds()
+    if fds is None:
+        start = 0
+        for fd in sorted(keep) + [os.sysconf('SC_OPEN_MAX')]:
+            os.closerange(start, fd)
+            start = fd + 1
+        return
+    for fd in fds:
+        if fd not in keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def running(pid: int) -> bool:
+    """
+    :param pid: process id
+    :return: True if a process with this pid exists and has not exited, an exited process not yet reaped has
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as procstat:
+            # the state is the field after the parenthesised command name
+            return procstat.read().rpartition(')')[2].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def started(pid: int) -> float:
+    """
+    :param pid: process id
+    :return: start time of the process in epoch seconds, None if it is not known
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as procstat:
+            # fields after the parenthesised command name start with the third field, starttime is the 22nd
+            starttime = int(procstat.read().rpartition(')')[2].split()[19])
+        with open('/proc/stat', 'r') as systemstat:
+            boottime = next(int(line.split()[1]) for line in systemstat if line.startswith('btime'))
+    except (OSError, IndexError, ValueError, StopIteration):
+        return None
+    return boottime + starttime / os.sysconf('SC_CLK_TCK')
+
+
+def waitexit(pid: int, timeout: float) -> bool:
+    """
+    Wait for a process, which need not be a child of this one, to exit
+    With a pidfd (Linux 5.3 and later) the exit is noticed as it happens, else the pid is checked every 10ms
+    :param pid: process id
+    :param timeout: seconds to wait
+    :return: True if the process does not exist any more
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        pidfd = None
+    if pidfd is not None:
+        try:
+            readable, _, _ = select.select([pidfd], [], [], max(timeout, 0))
+            return bool(readable)
+        finally:
+            os.close(pidfd)
+    deadline = monotonic() + timeout
+    while running(pid):
+        if monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+def reopenlogs() -> list:
+    """
+    Give every logging file handler, including those behind a BatchWriter, a newly opened stream
+    In a forked child the buffer lock of the old stream may be held by a thread that does not exist there
+    :return: the old streams, which must be kept referenced and never flushed or closed
+    """
+    loggers = [logging.getLogger()] + [logger for logger in list(logging.Logger.manager.loggerDict.values())
+                                       if isinstance(logger, logging.Logger)]
+    handlers = sum([list(logger.handlers) for logger in loggers], [])
+    handlers += sum([list(getattr(handler, 'targets', [])) for handler in handlers], [])
+    stale = []
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler) and handler.stream is not None:
+            stale.append(handler.stream)
+            # noinspection PyProtectedMember
+            handler.stream = handler._open()
+    return stale
+
+
 class Daemon(object, metaclass=abc.ABCMeta):
     """
     Daemon is an abstract class implementation of well-behaved Unix daemon specification of PEP 3143.
@@ -21,17 +152,31 @@ class Daemon(object, metaclass=abc.ABCMeta):
     Abstract methods preworker(), worker(), and postworker() must be overridden in the derived class.
     Invocation of the start() method results in:
         if not already running as daemon,
-            current process is forked, code execution continues in the parent and child process is daemonised;
+            current process is forked, code execution continues in the parent once the daemon is ready (see ready())
+            and child process is daemonised;
             stdout and stdrr are mapped to files in basedir/../log/ dir;
             current dir is changed to basedir/../var/ dir
             if started as root (uid 0), the process owner is switched to file owner
             the three methods preworker(), worker(), and postworker() of the derived class are invoked in order
             KeyboardInterrupt is trapped while executing worker()
     Invocation of the stop() method results in sending SIGINT signal to (any) running daemon instance
-    status() returns 0 if no daemon is running, else the PID of the running daemon process
+    supervise() can be called from worker() to turn the daemon into a supervisor of N forked worker processes
+    Invocation of the reload() method (or SIGHUP) replaces the running daemon with a new generation:
+            the daemon forks the new generation, which inherits its state and the file descriptors returned by
+            handoverfds() (e.g. a bound listening socket) and runs preworker(), worker() and postworker() again;
+            worker() calls ready() once it serves, which moves the pidfile to the new generation atomically;
+            the old generation then calls stopworker() (or sends SIGHUP to its supervised workers) so that worker()
+            drains in-flight work and returns, and exits without removing the pidfile
+    A daemon is ready when worker() is called, or, if notifiesready is True, when worker() calls ready(); ready()
+            logs how long each startup phase took, phases being marked with startupphase()
+    status() returns 0 if no daemon is running, else the PID of the running daemon process; a pidfile left behind by
+            a daemon that did not exit cleanly, or whose pid now belongs to another process, is removed
+    keepalive() runs in the foreground as a supervisor of the daemon: it starts the daemon, is woken by its exit
+            through a pidfd and restarts it with exponential backoff, and restarts it if healthcheck() keeps failing
     Refer https://www.python.org/dev/peps/pep-3143/
     TODO: Trap other interrupts
     """
+    notifiesready = False
 
     def __init__(self):
         self.__uid__ = None
@@ -43,6 +188,17 @@ class Daemon(object, metaclass=abc.ABCMeta):
         self.__umask__ = None
         self.__basedir__ = None
         self.__umask__ = None
+        self.__queuedlogging__ = False
+        self.__readytimeout__ = 30.0
+        self.__readyfd__ = None
+        self.__reloading__ = False
+        self.__handedover__ = False
+        self.__draining__ = False
+        self.__supervisedworker__ = False
+        self.__workers__ = {}
+        self.__args__ = ((), (), ())
+        self.__stalestreams__ = []
+        self.__phases__ = []
 
     @abc.abstractmethod
     def preworker(self, args: dict) -> None:
@@ -72,47 +228,206 @@ class Daemon(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    def handoverfds(self) -> list:
+        """
+        Override this; file descriptors, such as bound listening sockets, that a new generation started by reload()
+        inherits; any other file descriptor except those of log files is closed in the new generation
+        :return: list of file descriptors
+        """
+        return []
+
+    def stopworker(self) -> None:
+        """
+        Override this; called from a separate thread once a new generation is ready, to make worker() drain and return
+        The default interrupts worker() as SIGINT does
+        :return: None
+        """
+        os.kill(os.getpid(), signal.SIGINT)
+
+    def ready(self) -> None:
+        """
+        Call this from worker() once it is ready to serve if notifiesready is True, else it is called before worker()
+        The pidfile is replaced atomically, which in a generation started by reload() takes it over, the startup phases
+        are logged and the process that started this generation is told that it is ready; later calls do nothing
+        In a worker started by supervise() before the daemon was ready, this reports the worker ready to supervise()
+        :return: None
+        """
+        # cleared before the descriptor is closed, so a process forked meanwhile never holds a closed descriptor
+        readyfd, self.__readyfd__ = self.__readyfd__, None
+        if readyfd is None:
+            return
+        if self.__supervisedworker__:
+            os.write(readyfd, b'1')
+            os.close(readyfd)
+            return
+        pending = '{}.{}'.format(self.pidfile, os.getpid())
+        with open(pending, 'w') as pidfile:
+            pidfile.write(str(os.getpid()) + '\n')
+        os.replace(pending, self.pidfile)
+        self.startupphase('ready')
+        self.logger.info('ready, startup {} total {:.1f}ms'.format(
+            ' '.join('{} {:.1f}ms'.format(phase, (end - start) * 1000)
+                     for (_, start), (phase, end) in zip(self.__phases__, self.__phases__[1:])),
+            (self.__phases__[-1][1] - self.__phases__[0][1]) * 1000))
+        os.write(readyfd, b'1')
+        os.close(readyfd)
+
+    def healthcheck(self) -> bool:
+        """
+        Override this; probe of the running daemon made by keepalive() from outside the daemon
+        :return: True if the daemon is healthy
+        """
+        return True
+
+    def startupphase(self, phase: str) -> None:
+        """
+        Mark the end of a startup phase; ready() logs the time taken by each phase since the previous mark
+        :param phase: name of the phase that ended
+        :return: None
+        """
+        self.__phases__.append((phase, perf_counter()))
+
     def status(self) -> int:
         """
         Check if pidfile exists, read the pid and check if it is still running
-        Else only check if the pid is still running
+        A pidfile whose pid is not running, or belongs to a process started after the pidfile was written, is stale
+        and removed
         :return: PID of any running daemon instance, 0 if no daemon instance is running
         """
         try:
             with open(self.pidfile, 'r') as pidfile:
+                written = os.fstat(pidfile.fileno()).st_mtime
                 pid = int(pidfile.read())
-            os.kill(pid, 0)
-        except (FileNotFoundError, OSError):
+        except FileNotFoundError:
             return 0
-        else:
-            return pid
+        except (OSError, ValueError):
+            pid = 0
+        if pid > 0 and running(pid):
+            start = started(pid)
+            # one second of slack, process start times are relative to a boot time with a resolution of a second
+            if start is None or start <= written + 1:
+                return pid
+        try:
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+        return 0
 
-    def stop(self, attempts: int = 10) -> int:
+    def stop(self, timeout: float = None) -> int:
         """
-        Get status and send SIGINT to any running PID
-        :param attempts: number of times to try to send SIGINT to any running PID, default 10
-        :return: PID of any running daemon instance, 0 if no daemon instance is running
+        Get status and send SIGINT to any running PID, returning as soon as it has exited
+        SIGINT is sent once to each PID found, a new generation taking over the pidfile included; the daemon drains
+        its connections before it exits, so it is given timeout seconds to
+        :param timeout: seconds to wait for the daemon to exit, readytimeout if None
+        :return: PID of any running daemon instance, 0 if no daemon instance is running; a PID means the daemon is
+            still shutting down after timeout seconds, draining or stuck, so it can be waited for or killed
         """
-        pid = self.status()
-        while not (pid == 0 or attempts < 0):
-            try:
-                os.kill(pid, 2)  # signal.SIGINT
-            except OSError:
-                pass
-            sleep(0.1)
+        deadline = monotonic() + (self.readytimeout if timeout is None else timeout)
+        pid, signalled = self.status(), 0
+        while pid != 0:
+            if pid != signalled:
+                try:
+                    os.kill(pid, signal.SIGINT)
+                except OSError:
+                    pass
+                signalled = pid
+            elif monotonic() >= deadline:
+                break
+            waitexit(pid, deadline - monotonic())
             pid = self.status()
-            attempts -= 1
         return pid
 
-    def start(self, preworkerargs: dict = (), workerargs: dict = (), postworkerargs: dict = ()) -> None:
+    def keepalive(self, preworkerargs: dict = (), workerargs: dict = (), postworkerargs: dict = (),
+                  probeinterval: float = 5.0, probefailures: int = 3, maxbackoff: float = 60.0,
+                  stableafter: float = 60.0) -> None:
+        """
+        Supervise the daemon from the calling process until KeyboardInterrupt, then stop the daemon
+        The daemon is started if it is not running and restarted as soon as it exits; a daemon that exits within
+        stableafter seconds of its start is restarted after a delay doubling from 1s up to maxbackoff seconds
+        Between exits healthcheck() is called every probeinterval seconds; after probefailures failures in a row the
+        daemon is stopped and restarted. A reload is followed to the new generation, not treated as an exit
+        :param preworkerargs: optional dictionary to pass to preworker()
+        :param workerargs: optional dictionary to pass to worker()
+        :param postworkerargs: optional dictionary to pass to postworker()
+        :param probeinterval: seconds between health checks
+        :param probefailures: consecutive failed health checks after which the daemon is restarted
+        :param maxbackoff: maximum delay in seconds before restarting a daemon that keeps exiting
+        :param stableafter: seconds a daemon has to run for its next restart to be immediate
+        :return: None
+        """
+        logger = logging.getLogger(self.classname)
+        backoff = 0.0
+        try:
+            while True:
+                pid = self.status()
+                if pid == 0:
+                    if backoff:
+                        logger.info('restarting daemon in {:.1f}s'.format(backoff))
+                        sleep(backoff)
+                    pid = self.start(preworkerargs, workerargs, postworkerargs)
+                    if pid == 0:
+                        logger.error('daemon did not start')
+                        backoff = min(maxbackoff, max(1.0, backoff * 2))
+                        continue
+                    logger.info('started daemon pid {}'.format(pid))
+                since, failures = monotonic(), 0
+                while pid != 0:
+                    if waitexit(pid, probeinterval):
+                        current = self.status()
+                        if current != 0:
+                            logger.info('daemon pid {} reloaded as pid {}'.format(pid, current))
+                        else:
+                            logger.warning('daemon pid {} exited after {:.3f}s'.format(pid, monotonic() - since))
+                        pid = current
+                    elif self.healthcheck():
+                        failures = 0
+                    else:
+                        failures += 1
+                        logger.warning('daemon pid {} failed health check {} of {}'.format(pid, failures,
+                                                                                           probefailures))
+                        if failures >= probefailures:
+                            pid = self.stop()
+                            if pid != 0:
+                                # still running readytimeout seconds after SIGINT, well past draining
+                                os.kill(pid, signal.SIGKILL)
+                                waitexit(pid, self.readytimeout)
+                                self.status()
+                                pid = 0
+                backoff = 0.0 if monotonic() - since >= stableafter else min(maxbackoff, max(1.0, backoff * 2))
+        except KeyboardInterrupt:
+            logger.info('stopping daemon')
+            self.stop()
+
+    def reload(self, timeout: float = 30.0) -> int:
+        """
+        Send SIGHUP to any running daemon and wait until a new generation has taken over the pidfile
+        :param timeout: seconds to wait for the new generation
+        :return: PID of the new generation, of the running daemon if it did not reload in time, 0 if none is running
+        """
+        pid = self.status()
+        if pid == 0:
+            return 0
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except OSError:
+            return self.status()
+        deadline = monotonic() + timeout
+        current = self.status()
+        while current == pid and monotonic() < deadline:
+            sleep(0.1)
+            current = self.status()
+        return current
+
+    def start(self, preworkerargs: dict = (), workerargs: dict = (), postworkerargs: dict = ()) -> int:
         """
         Deamonise the process and execute preworker(), worker(), and postworker() in order
-        Code execution will continue in the calling process
+        Code execution will continue in the calling process once the daemon is ready, has exited or readytimeout
+        seconds have passed; the daemon reports readiness on a pipe, so there is no fixed wait
         Trap SIGINT while executing worker()
         :param preworkerargs: optional dictionary to pass to preworker()
         :param workerargs: optional dictionary to pass to worker()
         :param postworkerargs: optional dictionary to pass to postworker()
-        :return: None
+        :return: PID of the running daemon, 0 if it did not start
         """
         if self.status() == 0:
             for target in (self.logdir, self.vardir, self.logfile, self.errfile):
@@ -121,20 +436,248 @@ class Daemon(object, metaclass=abc.ABCMeta):
                     filestat.st_uid == self.uid and filemode(filestat.st_mode)[1:3] == 'rw'), \
                     'file ownership or permissions not correct\n file {0}\n owner {1}\n mode {2}\n'.format(
                         target, getpwuid(filestat.st_uid).pw_name, filestat.st_uid, filemode(filestat.st_mode))
-            if os.fork() == 0:
+            self.__phases__ = [('start', perf_counter())]
+            readfd, writefd = os.pipe()
+            child = os.fork()
+            if child == 0:
+                os.close(readfd)
+                self.__readyfd__ = writefd
                 if self.__daemonize__:
+                    self.__args__ = (preworkerargs, workerargs, postworkerargs)
+                    self.__generation__()
+                    sys.exit(0)
+                # noinspection PyProtectedMember
+                os._exit(1)
+            os.close(writefd)
+            try:
+                # reap the intermediate child, which exits as soon as it has forked
+                os.waitpid(child, 0)
+                # returns on ready() or, if the daemon exits before, on end of file
+                if select.select([readfd], [], [], self.readytimeout)[0]:
+                    os.read(readfd, 1)
+            finally:
+                os.close(readfd)
+        return self.status()
+
+    def __generation__(self) -> None:
+        """
+        Execute preworker(), worker(), and postworker() in order, trapping SIGINT while executing worker()
+        SIGHUP starts the next generation while worker() runs
+        :return: None
+        """
+        preworkerargs, workerargs, postworkerargs = self.__args__
+        try:
+            self.preworker(preworkerargs)
+            self.startupphase('preworker')
+            signal.signal(signal.SIGHUP, self.__sighup__)
+            if not self.notifiesready:
+                self.ready()
+            try:
+                self.worker(workerargs)
+            except KeyboardInterrupt:
+                self.logger.info('worker recieved KeyboardInterrupt')
+            self.postworker(postworkerargs)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def __sighup__(self, signum: int, frame: object) -> None:
+        if self.__supervisedworker__:
+            Thread(target=self.stopworker, name='stopworker', daemon=True).start()
+        elif not self.__reloading__:
+            self.__reloading__ = True
+            Thread(target=self.__handover__, name='handover', daemon=True).start()
+
+    def __handover__(self) -> None:
+        """
+        Fork the next generation and wait until it is ready, then stop this one; runs in its own thread
+        If the new generation is not ready within readytimeout seconds it is interrupted and this one keeps running
+        :return: None
+        """
+        self.logger.info('reload requested, starting next generation')
+        self.__phases__ = [('reload', perf_counter())]
+        readfd, writefd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readfd)
+            self.__nextgeneration__(writefd)
+        os.close(writefd)
+        try:
+            readable, _, _ = select.select([readfd], [], [], self.readytimeout)
+            ready = bool(readable) and os.read(readfd, 1) == b'1'
+        finally:
+            os.close(readfd)
+        if not ready:
+            self.logger.error('next generation pid {} not ready within {}s, reload abandoned'.format(
+                pid, self.readytimeout))
+            try:
+                os.kill(pid, signal.SIGINT)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            self.__reloading__ = False
+            return
+        self.logger.info('handed over to generation pid {}, draining'.format(pid))
+        self.__handedover__ = True
+        self.__draining__ = True
+        if self.__workers__:
+            for worker in list(self.__workers__):
+                try:
+                    os.kill(worker, signal.SIGHUP)
+                except OSError:
+                    pass
+        else:
+            self.stopworker()
+
+    def __nextgeneration__(self, readyfd: int) -> None:
+        """
+        Run the next generation in the forked child: file descriptors other than handoverfds() and readyfd are pointed
+        at /dev/null, so connections of the previous generation are released here, and log files reopened; never returns
+        Where open descriptors cannot be listed they are closed instead
+        :param readyfd: write end of the pipe on which ready() reports to the previous generation
+        :return: None
+        """
+        status = 0
+        try:
+            self.startupphase('fork')
+            keep = set(self.handoverfds()) | {readyfd}
+            fds = openfds()
+            if fds is None:
+                closefds(keep)
+            else:
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in fds:
+                    if fd not in keep and fd != devnull:
+                        os.dup2(devnull, fd)
+                os.close(devnull)
+            self.startupphase('closefds')
+            self.__stalestreams__ += reopenlogs()
+            self.startupphase('logs')
+            self.__readyfd__ = readyfd
+            self.__reloading__, self.__handedover__, self.__draining__ = False, False, False
+            self.__workers__ = {}
+            current_thread().name = 'MainThread'
+            self.logger.info('started as next generation')
+            self.__generation__()
+        except BaseException as e:
+            status = 1
+            self.logger.exception(e)
+        finally:
+            shutdownlogging()
+            self.__doatexit__()
+            # noinspection PyProtectedMember
+            os._exit(status)
+
+    def supervise(self, target: callable, processes: int, restartdelay: float = 1.0) -> None:
+        """
+        Run target() in processes forked worker processes, restarting any worker that exits, until SIGINT is received
+        On SIGINT the signal is forwarded to the workers and they are waited for before KeyboardInterrupt is re-raised
+        The daemon process (and pidfile) remains the single handle on the group, so status() and stop() keep working
+        After a reload has handed over, workers get SIGHUP, which calls stopworker() in them, and are not restarted;
+        supervise() returns once all of them have exited
+        If the daemon is not ready yet, each worker calls ready() itself once it serves, and the daemon becomes ready
+        once processes workers have
+        :param target: callable run in each worker process; a worker exits when target returns
+        :param processes: number of worker processes
+        :param restartdelay: minimum delay before restarting a worker that exited within this many seconds of start
+        :return: None
+        """
+        assert isinstance(processes, int) and processes > 0
+        workers = self.__workers__ = {}
+        reports = None
+        if self.__readyfd__ is not None:
+            reports = os.pipe()
+            Thread(target=self.__awaitworkers__, args=(reports[0], processes), name='awaitworkers',
+                   daemon=True).start()
+
+        def spawn(slot: int) -> None:
+            # a SIGINT raised in an at-fork hook is lost; blocked, it is raised once the worker is recorded
+            blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT})
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+                    self.__supervisedworker__ = True
+                    if reports is not None:
+                        os.close(reports[0])
+                        readyfd, self.__readyfd__ = self.__readyfd__, None
+                        if readyfd is None:
+                            os.close(reports[1])
+                        else:
+                            os.close(readyfd)
+                            self.__readyfd__ = reports[1]
+                    self.__stalestreams__ += reopenlogs()
+                    status = 0
                     try:
-                        self.preworker(preworkerargs)
-                        try:
-                            self.worker(workerargs)
-                        except KeyboardInterrupt:
-                            self.logger.info('worker recieved KeyboardInterrupt')
-                        self.postworker(postworkerargs)
+                        target()
+                    except KeyboardInterrupt:
+                        pass
                     except Exception as e:
                         self.logger.exception(e)
-                    sys.exit(0)
-            else:
-                sleep(0.1)
+                        status = 1
+                    finally:
+                        shutdownlogging()
+                        # noinspection PyProtectedMember
+                        os._exit(status)
+                workers[pid] = (slot, monotonic())
+            finally:
+                signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+            self.logger.info('started worker {} pid {}'.format(slot, pid))
+            if self.__draining__:
+                os.kill(pid, signal.SIGHUP)
+
+        try:
+            for slot in range(processes):
+                spawn(slot)
+            while True:
+                pid, status = os.wait()
+                if pid not in workers:
+                    continue
+                slot, started = workers.pop(pid)
+                if self.__draining__:
+                    self.logger.info('worker {} pid {} drained with status {}'.format(slot, pid, status))
+                    if not workers:
+                        break
+                    continue
+                self.logger.warning('worker {} pid {} exited with status {}'.format(slot, pid, status))
+                if monotonic() - started < restartdelay:
+                    sleep(restartdelay)
+                spawn(slot)
+        except KeyboardInterrupt:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGINT)
+                except OSError:
+                    pass
+            for pid in workers:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.logger.info('stopped {} workers'.format(len(workers)))
+            raise
+        finally:
+            if reports is not None:
+                os.close(reports[1])
+
+    def __awaitworkers__(self, reportfd: int, processes: int) -> None:
+        """
+        Call ready() once processes workers started by supervise() have reported ready; runs in its own thread
+        :param reportfd: read end of the pipe the workers report on, closed on return
+        :param processes: number of reports to wait for
+        :return: None
+        """
+        try:
+            reported = 0
+            while reported < processes:
+                report = os.read(reportfd, processes - reported)
+                if not report:
+                    return
+                reported += len(report)
+            self.logger.info('{} workers ready'.format(reported))
+            self.ready()
+        finally:
+            os.close(reportfd)
 
     @property
     def __daemonize__(self) -> bool:
@@ -145,28 +688,39 @@ class Daemon(object, metaclass=abc.ABCMeta):
         if os.fork() == 0:
             os.setsid()
             if os.fork() == 0:
+                self.startupphase('fork')
                 sys.stdout.flush()
                 sys.stderr.flush()
                 os.setgid(self.gid)
                 os.setuid(self.uid)
                 os.chdir(self.vardir)
-                for fd in range(0, os.sysconf('SC_OPEN_MAX')):
-                    try:
-                        os.close(fd)
-                    except OSError:
-                        pass
+                self.startupphase('setuid')
+                # only the descriptors that are open, not every one up to SC_OPEN_MAX (possibly millions)
+                closefds({self.__readyfd__})
+                self.startupphase('closefds')
+                # handlers the starting process (e.g. keepalive()) configured write to descriptors just closed
+                logging.getLogger().handlers.clear()
                 os.umask(self.umask)
                 self.logger, sys.stdout, sys.stderr = LoggerConfiguration(loggername=self.classname,
                                                                           logfile=self.logfile,
-                                                                          errfile=self.errfile).getfilehandles
+                                                                          errfile=self.errfile,
+                                                                          queued=self.queuedlogging).getfilehandles
+                self.startupphase('logs')
+                # the pidfile appears complete or not at all: written aside, then linked, which fails if it exists
+                pending = '{}.{}'.format(self.pidfile, os.getpid())
+                with open(pending, 'w') as pidfile:
+                    pidfile.write(str(os.getpid()) + '\n')
                 try:
-                    with open(self.pidfile, 'x') as pidfile:
-                        pidfile.write(str(os.getpid()) + '\n')
+                    os.link(pending, self.pidfile)
                 except FileExistsError:
+                    self.logger.error('pidfile {} exists, daemon pid {} not started'.format(self.pidfile, os.getpid()))
                     return False
                 else:
                     atexit.register(self.__doatexit__)
+                    self.startupphase('pidfile')
                     return True
+                finally:
+                    os.remove(pending)
             else:
                 # noinspection PyProtectedMember
                 os._exit(0)
@@ -176,11 +730,14 @@ class Daemon(object, metaclass=abc.ABCMeta):
 
     def __doatexit__(self) -> None:
         """
-        Remove the pid file
+        Remove the pid file, unless a new generation has taken it over
         :return: None
         """
         try:
-            os.remove(self.pidfile)
+            with open(self.pidfile, 'r') as pidfile:
+                owner = int(pidfile.read())
+            if owner == os.getpid():
+                os.remove(self.pidfile)
         except Exception as e:
             self.logger.exception(e)
 
@@ -244,6 +801,29 @@ class Daemon(object, metaclass=abc.ABCMeta):
         assert isinstance(mask, int)
         self.__umask__ = mask
 
+    @property
+    def queuedlogging(self) -> bool:
+        return self.__queuedlogging__
+
+    @queuedlogging.setter
+    def queuedlogging(self, queued: bool) -> None:
+        assert isinstance(queued, bool)
+        self.__queuedlogging__ = queued
+
+    @property
+    def readytimeout(self) -> float:
+        return self.__readytimeout__
+
+    @readytimeout.setter
+    def readytimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds > 0
+        self.__readytimeout__ = float(seconds)
+
+    @property
+    def handedover(self) -> bool:
+        return self.__handedover__
+
     @property
     def basedir(self) -> str:
         if self.__basedir__ is None:
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reset of fork-sensitive state in forked children, through one fork hook for the process
+"""
+import os
+from threading import Lock
+from weakref import WeakMethod
+
+__version__ = '0.1'
+
+
+class ForkHooks(object):
+    """
+    Methods called in every forked child, before any other code of the child runs, in the order they were added
+    Only weak references are kept: the hook of an object is dropped once the object is garbage collected, so objects
+    that add one per instance neither stay alive nor make the hooks of the process grow
+    """
+
+    def __init__(self):
+        self.__hooks__ = []
+        self.__lock__ = Lock()
+        os.register_at_fork(after_in_child=self.__afterfork__)
+
+    def add(self, method: callable) -> None:
+        """
+        :param method: bound method taking no arguments, typically one recreating locks, threads and queues
+        :return: None
+        """
+        with self.__lock__:
+            self.__hooks__ = [hook for hook in self.__hooks__ if hook() is not None] + [WeakMethod(method)]
+
+    def __afterfork__(self) -> None:
+        # a thread of the parent may have held the lock, it does not exist here
+        self.__lock__ = Lock()
+        for hook in self.__hooks__:
+            method = hook()
+            if method is not None:
+                method()
+
+
+FORKHOOKS = ForkHooks()
+
+
+def afterfork(method: callable) -> None:
+    """
+    Call method in every child forked from now on, see ForkHooks
+    :param method: bound method taking no arguments
+    :return: None
+    """
+    FORKHOOKS.add(method)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only transaction journal with group commit
+"""
+import mmap
+import os
+import struct
+from os.path import join
+from threading import Condition, Event, Lock, Thread
+from time import perf_counter, time_ns
+from zlib import crc32
+
+from xlib.daemon import running
+from xlib.forkhooks import afterfork
+from xlib.metrics import Histogram, Metrics
+
+__version__ = '0.1'
+RECORDHEADER = struct.Struct('>II')  # payload length, crc32 of payload
+SEGMENTSUFFIX = '.jnl'
+BATCHBUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+COMMITBUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class JournalError(Exception):
+    """
+    Records that could not be made durable
+    """
+
+
+class Batch(object):
+    """
+    Records appended while the previous batch was being committed; done is set once they are durable
+    """
+    __slots__ = ('records', 'done', 'error')
+
+    def __init__(self):
+        self.records = []
+        self.done = Event()
+        self.error = None
+
+
+class Journal(object):
+    """
+    Journal of length-prefixed, crc32-checksummed records in segment files under directory
+    append() blocks until its records are on disk; appends from concurrent threads that arrive while a commit is
+    in progress are written together by one writer thread with one write and one fdatasync (group commit)
+    Each process writes its own segments, named by creation time and pid, and starts a new one after segmentsize bytes
+    The writer thread and segment are created on first append, so a Journal created before fork is usable in children
+    recover() checks every segment and truncates a torn last record, it is run before any process appends
+    """
+
+    def __init__(self, directory: str, segmentsize: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segmentsize = segmentsize
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0
+        self.batchsize = Histogram(BATCHBUCKETS)
+        self.commitlatency = Histogram(COMMITBUCKETS)
+        self.__reset__()
+        afterfork(self.__reset__)
+
+    def __reset__(self) -> None:
+        self.__lock__ = Lock()
+        self.__ready__ = Condition(self.__lock__)
+        self.__pending__ = Batch()
+        self.__writer__ = None
+        self.__closed__ = False
+        self.__segment__ = None
+        self.__segmentsize__ = 0
+
+    def append(self, *payloads: bytes) -> None:
+        """
+        Append payloads as records and wait until they are durable
+        :param payloads: record payloads, written in order and in the same batch
+        :return: None
+        :raises JournalError: if the journal is closed or the batch could not be written or synced
+        """
+        records = [RECORDHEADER.pack(len(payload), crc32(payload)) + payload for payload in payloads]
+        with self.__lock__:
+            if self.__closed__:
+                raise JournalError('journal closed')
+            if self.__writer__ is None:
+                self.__writer__ = Thread(target=self.__write__, name='journal', daemon=True)
+                self.__writer__.start()
+            batch = self.__pending__
+            batch.records.extend(records)
+            self.__ready__.notify()
+        batch.done.wait()
+        if batch.error is not None:
+            raise JournalError('journal commit failed') from batch.error
+
+    def close(self) -> None:
+        """
+        Commit pending records, stop the writer thread and close the segment
+        :return: None
+        """
+        with self.__lock__:
+            self.__closed__ = True
+            writer = self.__writer__
+            self.__ready__.notify()
+        if writer is not None:
+            writer.join()
+
+    def __write__(self) -> None:
+        while True:
+            with self.__lock__:
+                while not self.__pending__.records and not self.__closed__:
+                    self.__ready__.wait()
+                batch, self.__pending__ = self.__pending__, Batch()
+            if not batch.records:
+                break
+            start = perf_counter()
+            data = b''.join(batch.records)
+            try:
+                if self.__segment__ is None or self.__segmentsize__ >= self.segmentsize:
+                    self.__rotate__()
+                written = 0
+                while written < len(data):
+                    written += os.write(self.__segment__, data[written:])
+                self.__segmentsize__ += len(data)
+                os.fdatasync(self.__segment__)
+            except OSError as e:
+                batch.error = e
+                self.errors += 1
+                self.__segment__ = self.__close__(self.__segment__)
+            else:
+                self.batches += 1
+                self.records += len(batch.records)
+                self.bytes += len(data)
+                self.batchsize.observe(len(batch.records))
+                self.commitlatency.observe(perf_counter() - start)
+            batch.done.set()
+        self.__segment__ = self.__close__(self.__segment__)
+
+    def __rotate__(self) -> None:
+        self.__segment__ = self.__close__(self.__segment__)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        name = '{:020d}-{}{}'.format(time_ns(), os.getpid(), SEGMENTSUFFIX)
+        self.__segment__ = os.open(join(self.directory, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND,
+                                   0o600)
+        self.__segmentsize__ = 0
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    @staticmethod
+    def __close__(segment: int) -> None:
+        if segment is not None:
+            try:
+                os.close(segment)
+            except OSError:
+                pass
+        return None
+
+    def segments(self) -> list:
+        """
+        :return: paths of segment files, oldest first
+        """
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENTSUFFIX))
+        except FileNotFoundError:
+            return []
+        return [join(self.directory, name) for name in names]
+
+    def recover(self, replay: callable = None) -> dict:
+        """
+        Check the records of every segment, truncating each segment after its last intact record
+        Segments of other processes that are still running are left alone
+        :param replay: optional callable invoked with the payload of every intact record, in order
+        :return: dictionary with the number of segments, records and bytes found and bytes truncated
+        """
+        result = dict(segments=0, records=0, bytes=0, truncated=0)
+        for path in self.segments():
+            pid = int(path[:-len(SEGMENTSUFFIX)].rsplit('-', 1)[1])
+            if pid != os.getpid() and running(pid):
+                continue
+            records, intact, size = self.scan(path, replay)
+            if intact < size:
+                with open(path, 'r+b') as segment:
+                    segment.truncate(intact)
+                    os.fsync(segment.fileno())
+            result['segments'] += 1
+            result['records'] += records
+            result['bytes'] += intact
+            result['truncated'] += size - intact
+        return result
+
+    @staticmethod
+    def scan(path: str, replay: callable = None) -> (int, int, int):
+        """
+        :param path: segment file
+        :param replay: optional callable invoked with the payload of every intact record
+        :return: number of intact records, offset after the last of them and size of the file
+        """
+        with open(path, 'rb') as segment:
+            size = os.fstat(segment.fileno()).st_size
+            if size == 0:
+                return 0, 0, 0
+            with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    records, offset = 0, 0
+                    while offset + RECORDHEADER.size <= size:
+                        length, checksum = RECORDHEADER.unpack_from(view, offset)
+                        end = offset + RECORDHEADER.size + length
+                        if end > size or crc32(view[offset + RECORDHEADER.size:end]) != checksum:
+                            break
+                        if replay is not None:
+                            replay(bytes(view[offset + RECORDHEADER.size:end]))
+                        records, offset = records + 1, end
+                finally:
+                    view.release()
+        return records, offset, size
+
+    def metrics(self) -> list:
+        """
+        :return: journal counters, batch size and commit latency in Prometheus text format
+        """
+        return ['# TYPE opentrx_journal_records_total counter',
+                'opentrx_journal_records_total {}'.format(self.records),
+                '# TYPE opentrx_journal_bytes_total counter', 'opentrx_journal_bytes_total {}'.format(self.bytes),
+                '# TYPE opentrx_journal_errors_total counter', 'opentrx_journal_errors_total {}'.format(self.errors)] \
+            + Metrics.histogram('opentrx_journal_batch_records', 'Records written per group commit', self.batchsize) \
+            + Metrics.histogram('opentrx_journal_commit_seconds', 'Time to write and sync a batch', self.commitlatency)
+
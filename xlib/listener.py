@@ -3,27 +3,56 @@
 """
 SSL listener
 """
+import os
 import random
 import socket
 from _ssl import PROTOCOL_TLSv1 as protocolTLS
 from base64 import b64encode
-from json import dumps
-from os import urandom, unlink
-from ssl import SSLContext
-from tempfile import NamedTemporaryFile
+from datetime import datetime, timezone
+from http.client import HTTPException, HTTPSConnection
+from http.server import HTTPServer
+from json import dumps, loads
+from os import O_CREAT, O_TRUNC, O_WRONLY, chmod, makedirs, open as os_open, replace, urandom, unlink
+from os.path import join
+from ssl import SSLContext, TLSVersion, create_default_context
+from tempfile import mkstemp
+from threading import Thread
+from time import monotonic, perf_counter, sleep, time
 
 from OpenSSL import crypto
+from cryptography.hazmat.primitives.asymmetric import ec
 
+from xlib.accesslog import ACCESSLOGMODES, AccessLog
+from xlib.admission import Admission
+from xlib.asyncserver import AsyncHTTPServer, UnixAsyncHTTPServer
+from xlib.compression import Compressor
 from xlib.daemon import Daemon
-from xlib.requesthandler import ThreadedHTTPServer, RequestHandler
+from xlib.journal import Journal
+from xlib.loggerconfig import flushlogger
+from xlib.metrics import Metrics
+from xlib.reaper import Reaper
+from xlib.requesthandler import ThreadedHTTPServer, PooledHTTPServer, RequestHandler, UnixThreadedHTTPServer, \
+    UnixPooledHTTPServer
+from xlib.responsecache import ResponseCache
+from xlib.staticfiles import StaticFiles
+from xlib.unixsocket import UnixHTTPConnection
+from xlib.vardir import CERTFILESTORE, HOSTNAMEFILE, UNIXSOCKETFILE
 
 __version__ = '0.1'
-CERTFILESTORE = 'cert.pem'
-HOSTNAMEFILE = 'host.txt'
+UNIXSOCKET = 'listener.sock'
+UNIXSOCKETMODES = ('off', 'also', 'only')
+KEYSTOREDIR = 'keystore'
+KEYFILE = 'key.pem'
+KEYSTORERENEWAL = 7 * 24 * 3600
+KEYTYPES = ('rsa', 'ec')
+JOURNALDIR = 'journal'
+ENGINES = {'threaded': ThreadedHTTPServer, 'pooled': PooledHTTPServer, 'asyncio': AsyncHTTPServer}
+UNIXENGINES = {'threaded': UnixThreadedHTTPServer, 'pooled': UnixPooledHTTPServer, 'asyncio': UnixAsyncHTTPServer}
 
 
 class Listener(Daemon):
     encoding = 'utf-8'
+    notifiesready = True
 
     def __init__(self):
         super().__init__()
@@ -33,47 +62,328 @@ class Listener(Daemon):
         self.__passphrase__ = None
         self.__sslkey__ = None
         self.__sslcert__ = None
+        self.__deferhandshake__ = True
+        self.__handshaketimeout__ = 5.0
+        self.__engine__ = 'threaded'
+        self.__processes__ = 1
+        self.__idletimeout__ = RequestHandler.idletimeout
+        self.__headertimeout__ = RequestHandler.headertimeout
+        self.__bodytimeout__ = RequestHandler.bodytimeout
+        self.__minbodyrate__ = RequestHandler.minbodyrate
+        self.__writetimeout__ = RequestHandler.writetimeout
+        self.__maxrequests__ = RequestHandler.maxrequests
+        self.__maxbodysize__ = RequestHandler.maxbodysize
+        self.__responsecachesize__ = RequestHandler.responsecache.maxsize
+        self.__keystore__ = False
+        self.__staticfiles__ = False
+        self.__journal__ = False
+        self.__keytype__ = 'rsa'
+        self.__reuseport__ = False
+        self.__accesslog__ = 'full'
+        self.__accesslogsamplerate__ = 0.01
+        self.__accesslogrotatesize__ = 0
+        self.__maxclientconnections__ = 0
+        self.__clientrate__ = 0.0
+        self.__clientburst__ = 20
+        self.__compression__ = True
+        self.__compressionminsize__ = RequestHandler.compression.minsize
+        self.__poolsize__ = PooledHTTPServer.poolsize
+        self.__queuesize__ = PooledHTTPServer.queuesize
+        self.__overloadpolicy__ = PooledHTTPServer.overloadpolicy
+        self.__draintimeout__ = 10.0
+        self.__unixsocket__ = 'off'
+        self.__unixsocketmode__ = 0o660
+        self.__listening__ = None
+        self.__unixlistening__ = None
+        self.__servers__ = ()
 
     def preworker(self, args: dict) -> None:
         self.logger.info('started preworker')
         self.initserver()
-        self.__certstore__ = NamedTemporaryFile()
-        with open(self.__certstore__.name, 'w') as tempcertfile:
+        self.startupphase('keygen')
+        if self.journal:
+            start = perf_counter()
+            recovered = Journal(self.journaldir).recover()
+            self.logger.info('journal recovered {segments} segments {records} records {bytes} bytes, '
+                             'truncated {truncated} bytes in {elapsed:.3f}ms'.format(
+                                 elapsed=(perf_counter() - start) * 1000, **recovered))
+            self.startupphase('journal')
+        descriptor, self.__certstore__ = mkstemp(suffix='.pem')
+        with open(descriptor, 'w') as tempcertfile:
             tempcertfile.write(self.__sslkey__ + self.__sslcert__)
             tempcertfile.flush()
-            self.logger.info('key written to file ' + self.__certstore__.name)
+            self.logger.info('key written to file ' + self.__certstore__)
         self.logger.info('done preworker')
 
     def postworker(self, args: dict) -> None:
         self.logger.info('started postworker')
-        self.__certstore__.close()
-        self.logger.info('removed key file ' + self.__certstore__.name)
-        for cleanupfile in CERTFILESTORE, HOSTNAMEFILE:
+        unlink(self.__certstore__)
+        self.logger.info('removed key file ' + self.__certstore__)
+        # after a reload the next generation serves the same cert, host and socket files
+        for cleanupfile in () if self.handedover else self.publishedfiles:
             try:
                 unlink(cleanupfile)
                 self.logger.info('deleted file ' + cleanupfile)
             except Exception as e:
                 self.logger.exception(e)
         self.logger.info('done postworker')
+        if hasattr(RequestHandler, 'logger'):
+            flushlogger(RequestHandler.logger)
+        flushlogger(self.logger)
 
     def worker(self, args: dict) -> None:
         self.logger.info('started worker')
         context = SSLContext(protocol=protocolTLS)
-        context.load_cert_chain(certfile=self.__certstore__.name, password=self.__passphrase__.decode())
-        https_server = ThreadedHTTPServer(self.address, RequestHandlerClass=RequestHandler)
-        https_server.RequestHandlerClass.setlogger(self.logdir)
-        https_server.socket = context.wrap_socket(https_server.socket, server_side=True)
+        context.load_cert_chain(certfile=self.__certstore__, password=self.__passphrase__.decode())
+        self.startupphase('context')
+        if self.processes == 1:
+            servers = self.servers(context)
+            self.startupphase('bind')
+            self.ready()
+            self.serve(*servers)
+        elif self.reuseport:
+            if self.unixsocket != 'off':
+                # a Unix domain socket cannot be bound once per worker, it is bound here and adopted by each of them
+                self.unixserver().server_close()
+                self.startupphase('bind')
+            self.logger.info('pre-forking {} workers binding with SO_REUSEPORT'.format(self.processes))
+            # each worker binds its own socket, so the daemon is ready only once every worker is
+            self.supervise(lambda: self.serve(*self.servers(context), ready=True), self.processes)
+        else:
+            servers = self.servers(context)
+            self.startupphase('bind')
+            self.logger.info('pre-forking {} workers sharing the listening socket'.format(self.processes))
+            self.ready()
+            try:
+                self.supervise(lambda: self.serve(*servers), self.processes)
+            finally:
+                for server in servers:
+                    server.server_close()
+        self.logger.info('done worker')
+
+    def servers(self, context: SSLContext) -> list:
+        """
+        Configure RequestHandler and create the servers unixsocket asks for
+        :param context: SSL context holding the server key and certificate
+        :return: the TLS server on address, the server on the Unix domain socket, or both in that order
+        """
+        self.requesthandler()
+        servers = [] if self.unixsocket == 'only' else [self.httpserver(context)]
+        if self.unixsocket != 'off':
+            servers.append(self.unixserver())
+        return servers
+
+    def requesthandler(self) -> None:
+        """
+        Configure RequestHandler, which handles the requests of every server
+        :return: None
+        """
+        RequestHandler.setlogger(self.logdir, queued=self.queuedlogging, maxbytes=self.accesslogrotatesize)
+        RequestHandler.accesslog = AccessLog(mode=self.accesslog, samplerate=self.accesslogsamplerate)
+        RequestHandler.idletimeout = self.idletimeout
+        RequestHandler.headertimeout = self.headertimeout
+        RequestHandler.bodytimeout = self.bodytimeout
+        RequestHandler.minbodyrate = self.minbodyrate
+        RequestHandler.writetimeout = self.writetimeout
+        RequestHandler.maxrequests = self.maxrequests
+        RequestHandler.maxbodysize = self.maxbodysize
+        RequestHandler.metrics = Metrics()
+        RequestHandler.metrics.collectors.append(RequestHandler.accesslog.metrics)
+        RequestHandler.admission = Admission(maxconnections=self.maxclientconnections, rate=self.clientrate,
+                                             burst=self.clientburst)
+        RequestHandler.metrics.collectors.append(RequestHandler.admission.metrics)
+        RequestHandler.reaper = Reaper()
+        RequestHandler.metrics.collectors.append(RequestHandler.reaper.metrics)
+        RequestHandler.compression = Compressor(minsize=self.compressionminsize) if self.compression else None
+        if RequestHandler.compression is not None:
+            RequestHandler.metrics.collectors.append(RequestHandler.compression.metrics)
+        RequestHandler.draining = False
+        RequestHandler.responsecache = ResponseCache(maxsize=self.responsecachesize)
+        RequestHandler.staticfiles = StaticFiles(self.vardir) if self.staticfiles else None
+        RequestHandler.compileroutes()
+        if self.journal:
+            RequestHandler.journal = Journal(self.journaldir)
+            RequestHandler.metrics.collectors.append(RequestHandler.journal.metrics)
+
+    def httpserver(self, context: SSLContext) -> HTTPServer:
+        """
+        Create and bind the TLS server on address for the configured engine
+        The asyncio engine always runs the TLS handshake on its event loop, regardless of deferhandshake
+        A generation started by reload adopts the listening socket of the previous one instead of binding; with
+        reuseport each worker binds its own socket to the same port instead
+        Connections over maxclientconnections per client address are turned away before the handshake, except with
+        deferhandshake off on the threaded and pooled engines, where accept() itself completes the handshake
+        :param context: SSL context holding the server key and certificate
+        :return: bound and listening server
+        """
+        https_server = ENGINES[self.engine](self.address, RequestHandlerClass=RequestHandler, bind_and_activate=False)
+        https_server.allow_reuse_port = self.reuseport
+        if self.__listening__ is not None and not self.reuseport:
+            https_server.socket.close()
+            https_server.socket = self.__listening__
+            https_server.server_address = https_server.socket.getsockname()
+            https_server.server_name, https_server.server_port = socket.getfqdn(self.host), self.port
+            self.logger.info('adopted listening socket {}'.format(https_server.server_address))
+        else:
+            try:
+                https_server.server_bind()
+                https_server.server_activate()
+            except Exception:
+                https_server.server_close()
+                raise
+        if not self.reuseport:
+            self.__listening__ = self.__shared__(https_server)
+        self.__engineconfig__(https_server)
+        if self.deferhandshake or self.engine == 'asyncio':
+            https_server.sslcontext = context
+            https_server.handshaketimeout = self.handshaketimeout
+        else:
+            https_server.socket = context.wrap_socket(https_server.socket, server_side=True)
+        return https_server
+
+    def unixserver(self) -> HTTPServer:
+        """
+        Create and bind the plaintext server on the Unix domain socket at unixsocketpath for the configured engine
+        The socket is bound once and then adopted: by the next generation after reload, and by every worker
+        :return: bound and listening server
+        """
+        unix_server = UNIXENGINES[self.engine](self.unixsocketpath, RequestHandlerClass=RequestHandler,
+                                               bind_and_activate=False)
+        unix_server.socketmode = self.unixsocketmode
+        if self.__unixlistening__ is not None:
+            unix_server.socket.close()
+            unix_server.socket = self.__unixlistening__
+            unix_server.server_name, unix_server.server_port = socket.gethostname(), 0
+        else:
+            try:
+                unix_server.server_bind()
+                unix_server.server_activate()
+            except Exception:
+                unix_server.server_close()
+                raise
+            self.logger.info('bound unix socket {}'.format(self.unixsocketpath))
+        self.__unixlistening__ = self.__shared__(unix_server)
+        self.__engineconfig__(unix_server)
+        return unix_server
+
+    @staticmethod
+    def __shared__(server: HTTPServer) -> socket.socket:
+        """
+        :return: duplicate of the listening socket of server, kept open for handing over to the next generation
+            whatever the server does with its own socket
+        """
+        # accept() must not block in a process that lost the race for a connection to another process sharing
+        # the socket; socket.dup() would reset O_NONBLOCK, which is shared by every process holding the socket
+        os.set_blocking(server.socket.fileno(), False)
+        return socket.socket(fileno=os.dup(server.socket.fileno()))
+
+    def __engineconfig__(self, server: HTTPServer) -> None:
+        if self.engine == 'pooled':
+            server.poolsize = self.poolsize
+            server.queuesize = self.queuesize
+            server.overloadpolicy = self.overloadpolicy
+        elif self.engine == 'asyncio':
+            server.executorthreads = self.poolsize
+            server.draintimeout = self.draintimeout
+
+    def serve(self, *servers: HTTPServer, ready: bool = False) -> None:
+        """
+        Serve until KeyboardInterrupt or stopworker(), then drain and close the servers
+        The first server is served by the calling thread, any others each by a thread of its own
+        :param servers: servers returned by servers()
+        :param ready: call ready() once the servers are started
+        :return: None
+        """
+        self.__servers__ = servers
+        threads = [Thread(target=server.serve_forever, name='serve-{}'.format(index), daemon=True)
+                   for index, server in enumerate(servers[1:], 1)]
         try:
+            for thread in threads:
+                thread.start()
+            if ready:
+                self.ready()
             self.logger.info('ready to serve httpd')
-            https_server.serve_forever()
+            servers[0].serve_forever()
         except KeyboardInterrupt as k:
             self.logger.info('httpd recieved KeyboardInterrupt')
             raise k
         except Exception as e:
             self.logger.exception(e)
         finally:
-            https_server.server_close()
-        self.logger.info('done worker')
+            self.__servers__ = ()
+            for server, thread in zip(servers[1:], threads):
+                server.shutdown()
+                thread.join()
+            self.drain(*servers)
+            for server in servers:
+                server.server_close()
+            RequestHandler.accesslog.flush(RequestHandler.logger)
+            if RequestHandler.journal is not None:
+                RequestHandler.journal.close()
+
+    def drain(self, *servers: HTTPServer) -> None:
+        """
+        Close connections after their current response, and those waiting for a request at once, and wait up to
+        draintimeout seconds for them to finish
+        Connections still open after that are dropped when the process exits; a further SIGINT ends the wait
+        :param servers: servers that stopped accepting
+        :return: None
+        """
+        RequestHandler.draining = True
+        RequestHandler.reaper.drain()
+        deadline = monotonic() + self.draintimeout
+        try:
+            while RequestHandler.metrics.merged().connections + sum(
+                    getattr(server, 'queuedepth', 0) for server in servers) > 0:
+                if monotonic() > deadline:
+                    self.logger.warning('{} connections still open after draining {}s'.format(
+                        RequestHandler.metrics.merged().connections, self.draintimeout))
+                    break
+                sleep(0.05)
+        except KeyboardInterrupt:
+            self.logger.info('draining interrupted')
+        for server in servers:
+            server.block_on_close = False
+
+    def handoverfds(self) -> list:
+        return [listening.fileno() for listening in (self.__listening__, self.__unixlistening__)
+                if listening is not None]
+
+    def stopworker(self) -> None:
+        """
+        Stop accepting connections; serve() then drains the connections in flight and returns
+        :return: None
+        """
+        RequestHandler.draining = True
+        for server in self.__servers__:
+            server.shutdown()
+
+    def healthcheck(self) -> bool:
+        """
+        GET metricspath from the running daemon at the address it published, verifying the certificate it published,
+        or on the Unix domain socket it published if it serves only there
+        :return: True if the daemon answered 200 OK within handshaketimeout seconds
+        """
+        try:
+            if self.unixsocket == 'only':
+                with open(join(self.vardir, UNIXSOCKETFILE), 'r') as socketfile:
+                    _, socketpath = loads(socketfile.readline())
+                connection = UnixHTTPConnection(socketpath, timeout=self.handshaketimeout)
+            else:
+                with open(join(self.vardir, HOSTNAMEFILE), 'r') as hostfile:
+                    _, host, port = loads(hostfile.readline())
+                context = create_default_context(cafile=join(self.vardir, CERTFILESTORE))
+                context.minimum_version = TLSVersion.MINIMUM_SUPPORTED
+                connection = HTTPSConnection(host, port, timeout=self.handshaketimeout, context=context)
+            try:
+                connection.request('GET', RequestHandler.metricspath)
+                response = connection.getresponse()
+                response.read()
+                return response.status == 200
+            finally:
+                connection.close()
+        except (OSError, ValueError, HTTPException):
+            return False
 
     @property
     def address(self) -> (str, int):
@@ -109,33 +419,434 @@ class Listener(Daemon):
         assert portnumber <= 65535
         self.__port__ = portnumber
 
+    @property
+    def deferhandshake(self) -> bool:
+        return self.__deferhandshake__
+
+    @deferhandshake.setter
+    def deferhandshake(self, defer: bool) -> None:
+        assert isinstance(defer, bool)
+        self.__deferhandshake__ = defer
+
+    @property
+    def handshaketimeout(self) -> float:
+        return self.__handshaketimeout__
+
+    @handshaketimeout.setter
+    def handshaketimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds > 0
+        self.__handshaketimeout__ = float(seconds)
+
+    @property
+    def engine(self) -> str:
+        return self.__engine__
+
+    @engine.setter
+    def engine(self, name: str) -> None:
+        assert name in ENGINES
+        self.__engine__ = name
+
+    @property
+    def idletimeout(self) -> float:
+        return self.__idletimeout__
+
+    @idletimeout.setter
+    def idletimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds > 0
+        self.__idletimeout__ = float(seconds)
+
+    @property
+    def headertimeout(self) -> float:
+        return self.__headertimeout__
+
+    @headertimeout.setter
+    def headertimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds >= 0
+        self.__headertimeout__ = float(seconds)
+
+    @property
+    def bodytimeout(self) -> float:
+        return self.__bodytimeout__
+
+    @bodytimeout.setter
+    def bodytimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds >= 0
+        self.__bodytimeout__ = float(seconds)
+
+    @property
+    def minbodyrate(self) -> int:
+        return self.__minbodyrate__
+
+    @minbodyrate.setter
+    def minbodyrate(self, rate: int) -> None:
+        assert isinstance(rate, int)
+        assert rate >= 0
+        self.__minbodyrate__ = rate
+
+    @property
+    def writetimeout(self) -> float:
+        return self.__writetimeout__
+
+    @writetimeout.setter
+    def writetimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds >= 0
+        self.__writetimeout__ = float(seconds)
+
+    @property
+    def maxrequests(self) -> int:
+        return self.__maxrequests__
+
+    @maxrequests.setter
+    def maxrequests(self, requests: int) -> None:
+        assert isinstance(requests, int)
+        assert requests > 0
+        self.__maxrequests__ = requests
+
+    @property
+    def maxbodysize(self) -> int:
+        return self.__maxbodysize__
+
+    @maxbodysize.setter
+    def maxbodysize(self, size: int) -> None:
+        assert isinstance(size, int)
+        assert size >= 0
+        self.__maxbodysize__ = size
+
+    @property
+    def responsecachesize(self) -> int:
+        return self.__responsecachesize__
+
+    @responsecachesize.setter
+    def responsecachesize(self, size: int) -> None:
+        assert isinstance(size, int)
+        assert size >= 0
+        self.__responsecachesize__ = size
+
+    @property
+    def staticfiles(self) -> bool:
+        return self.__staticfiles__
+
+    @staticfiles.setter
+    def staticfiles(self, serve: bool) -> None:
+        assert isinstance(serve, bool)
+        self.__staticfiles__ = serve
+
+    @property
+    def journal(self) -> bool:
+        return self.__journal__
+
+    @journal.setter
+    def journal(self, durable: bool) -> None:
+        assert isinstance(durable, bool)
+        self.__journal__ = durable
+
+    @property
+    def journaldir(self) -> str:
+        return join(self.vardir, JOURNALDIR)
+
+    @property
+    def processes(self) -> int:
+        return self.__processes__
+
+    @processes.setter
+    def processes(self, count: int) -> None:
+        assert isinstance(count, int)
+        assert count > 0
+        self.__processes__ = count
+
+    @property
+    def reuseport(self) -> bool:
+        return self.__reuseport__
+
+    @reuseport.setter
+    def reuseport(self, reuse: bool) -> None:
+        assert isinstance(reuse, bool)
+        assert not reuse or hasattr(socket, 'SO_REUSEPORT')
+        self.__reuseport__ = reuse
+
+    @property
+    def accesslog(self) -> str:
+        return self.__accesslog__
+
+    @accesslog.setter
+    def accesslog(self, mode: str) -> None:
+        assert mode in ACCESSLOGMODES
+        self.__accesslog__ = mode
+
+    @property
+    def accesslogsamplerate(self) -> float:
+        return self.__accesslogsamplerate__
+
+    @accesslogsamplerate.setter
+    def accesslogsamplerate(self, rate: float) -> None:
+        assert isinstance(rate, (int, float))
+        assert 0 <= rate <= 1
+        self.__accesslogsamplerate__ = float(rate)
+
+    @property
+    def accesslogrotatesize(self) -> int:
+        return self.__accesslogrotatesize__
+
+    @accesslogrotatesize.setter
+    def accesslogrotatesize(self, size: int) -> None:
+        assert isinstance(size, int)
+        assert size >= 0
+        self.__accesslogrotatesize__ = size
+
+    @property
+    def maxclientconnections(self) -> int:
+        return self.__maxclientconnections__
+
+    @maxclientconnections.setter
+    def maxclientconnections(self, connections: int) -> None:
+        assert isinstance(connections, int)
+        assert connections >= 0
+        self.__maxclientconnections__ = connections
+
+    @property
+    def clientrate(self) -> float:
+        return self.__clientrate__
+
+    @clientrate.setter
+    def clientrate(self, rate: float) -> None:
+        assert isinstance(rate, (int, float))
+        assert rate >= 0
+        self.__clientrate__ = float(rate)
+
+    @property
+    def clientburst(self) -> int:
+        return self.__clientburst__
+
+    @clientburst.setter
+    def clientburst(self, requests: int) -> None:
+        assert isinstance(requests, int)
+        assert requests > 0
+        self.__clientburst__ = requests
+
+    @property
+    def compression(self) -> bool:
+        return self.__compression__
+
+    @compression.setter
+    def compression(self, compression: bool) -> None:
+        assert isinstance(compression, bool)
+        self.__compression__ = compression
+
+    @property
+    def compressionminsize(self) -> int:
+        return self.__compressionminsize__
+
+    @compressionminsize.setter
+    def compressionminsize(self, size: int) -> None:
+        assert isinstance(size, int)
+        assert size >= 0
+        self.__compressionminsize__ = size
+
+    @property
+    def unixsocket(self) -> str:
+        """
+        :return: 'also' when serving on a Unix domain socket at unixsocketpath as well as on address, 'only' when
+            serving there instead of on address, 'off' when not
+        """
+        return self.__unixsocket__
+
+    @unixsocket.setter
+    def unixsocket(self, mode: str) -> None:
+        assert mode in UNIXSOCKETMODES
+        self.__unixsocket__ = mode
+
+    @property
+    def unixsocketmode(self) -> int:
+        return self.__unixsocketmode__
+
+    @unixsocketmode.setter
+    def unixsocketmode(self, mode: int) -> None:
+        assert isinstance(mode, int)
+        assert 0 <= mode <= 0o777
+        self.__unixsocketmode__ = mode
+
+    @property
+    def unixsocketpath(self) -> str:
+        return join(self.vardir, UNIXSOCKET)
+
+    @property
+    def publishedfiles(self) -> list:
+        """
+        :return: files in vardir that tell clients where and how to connect
+        """
+        return [CERTFILESTORE] + ([HOSTNAMEFILE] if self.unixsocket != 'only' else []) + (
+            [UNIXSOCKETFILE, self.unixsocketpath] if self.unixsocket != 'off' else [])
+
+    @property
+    def poolsize(self) -> int:
+        return self.__poolsize__
+
+    @poolsize.setter
+    def poolsize(self, threads: int) -> None:
+        assert isinstance(threads, int)
+        assert threads > 0
+        self.__poolsize__ = threads
+
+    @property
+    def queuesize(self) -> int:
+        return self.__queuesize__
+
+    @queuesize.setter
+    def queuesize(self, connections: int) -> None:
+        assert isinstance(connections, int)
+        assert connections > 0
+        self.__queuesize__ = connections
+
+    @property
+    def overloadpolicy(self) -> str:
+        return self.__overloadpolicy__
+
+    @overloadpolicy.setter
+    def overloadpolicy(self, policy: str) -> None:
+        assert policy in PooledHTTPServer.overloadpolicies
+        self.__overloadpolicy__ = policy
+
+    @property
+    def draintimeout(self) -> float:
+        return self.__draintimeout__
+
+    @draintimeout.setter
+    def draintimeout(self, seconds: float) -> None:
+        assert isinstance(seconds, (int, float))
+        assert seconds >= 0
+        self.__draintimeout__ = float(seconds)
+
+    @property
+    def keystore(self) -> bool:
+        return self.__keystore__
+
+    @keystore.setter
+    def keystore(self, reuse: bool) -> None:
+        assert isinstance(reuse, bool)
+        self.__keystore__ = reuse
+
+    @property
+    def keystoredir(self) -> str:
+        return join(self.vardir, KEYSTOREDIR)
+
+    @property
+    def keytype(self) -> str:
+        return self.__keytype__
+
+    @keytype.setter
+    def keytype(self, keytype: str) -> None:
+        assert keytype in KEYTYPES
+        self.__keytype__ = keytype
+
     @property
     def passphrase(self) -> bytes:
         return self.__passphrase__
 
     def initserver(self) -> None:
-        self.__passphrase__ = b64encode(urandom(128))
         if self.__sslkey__ is None:
-            key = crypto.PKey()
-            key.generate_key(type=crypto.TYPE_RSA, bits=4096)
-            cert = crypto.X509()
-            cert.get_subject().C = 'NL'
-            cert.get_subject().O = 'opentrx'
-            cert.get_subject().OU = self.classname
-            cert.get_subject().CN = self.host
-            cert.set_serial_number(self.port)
-            cert.gmtime_adj_notBefore(0)
-            cert.gmtime_adj_notAfter(365 * 24 * 3600)
-            cert.set_issuer(cert.get_subject())
-            cert.set_pubkey(key)
-            # noinspection PyTypeChecker
-            cert.sign(key, 'sha1')
+            start = perf_counter()
+            key, cert = self.loadkeystore() if self.keystore else (None, None)
+            origin = 'loaded from keystore'
+            if key is None:
+                key, cert = self.generatekey()
+                origin = 'generated {} key'.format(self.keytype)
+                if self.keystore:
+                    self.savekeystore(key, cert)
+            self.__passphrase__ = b64encode(urandom(128))
             self.__sslkey__ = crypto.dump_privatekey(type=crypto.FILETYPE_PEM, pkey=key, cipher='aes256',
                                                      passphrase=self.__passphrase__).decode()
             self.__sslcert__ = crypto.dump_certificate(type=crypto.FILETYPE_PEM, cert=cert).decode()
-        with open(CERTFILESTORE, 'w') as certfile:
-            certfile.write(self.__sslcert__)
-            self.logger.info('saved cert in file ' + CERTFILESTORE)
-        with open(HOSTNAMEFILE, 'w') as hostfile:
-            hostfile.write(dumps(('https://', self.__host__, self.__port__)))
+            self.logger.info('key material {} in {:.3f}s'.format(origin, perf_counter() - start))
+        self.publish(CERTFILESTORE, self.__sslcert__)
+        self.logger.info('saved cert in file ' + CERTFILESTORE)
+        if self.unixsocket != 'only':
+            self.publish(HOSTNAMEFILE, dumps(('https://', self.__host__, self.__port__)))
             self.logger.info('saved host info in file ' + HOSTNAMEFILE)
+        if self.unixsocket != 'off':
+            self.publish(UNIXSOCKETFILE, dumps(('http+unix://', self.unixsocketpath)))
+            self.logger.info('saved unix socket path in file ' + UNIXSOCKETFILE)
+
+    @staticmethod
+    def publish(filename: str, content: str) -> None:
+        """
+        Replace filename in vardir with one holding content, by renaming a new file over it: a client never reads a
+        partly written file, and a file mapped by staticfiles is never rewritten under the mapping
+        :param filename: name of the file in vardir
+        :param content: text to publish
+        :return: None
+        """
+        with open(filename + '.tmp', 'w') as publishedfile:
+            publishedfile.write(content)
+        replace(filename + '.tmp', filename)
+
+    def generatekey(self) -> (crypto.PKey, crypto.X509):
+        """
+        Generate a key of keytype and a self-signed certificate for host, valid for a year
+        :return: key and certificate
+        """
+        if self.keytype == 'ec':
+            key = crypto.PKey.from_cryptography_key(ec.generate_private_key(ec.SECP256R1()))
+        else:
+            key = crypto.PKey()
+            key.generate_key(type=crypto.TYPE_RSA, bits=4096)
+        cert = crypto.X509()
+        cert.get_subject().C = 'NL'
+        cert.get_subject().O = 'opentrx'
+        cert.get_subject().OU = self.classname
+        cert.get_subject().CN = self.host
+        cert.set_serial_number(self.port)
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(365 * 24 * 3600)
+        cert.set_issuer(cert.get_subject())
+        cert.set_pubkey(key)
+        # noinspection PyTypeChecker
+        cert.sign(key, 'sha256' if self.keytype == 'ec' else 'sha1')
+        return key, cert
+
+    def loadkeystore(self) -> (crypto.PKey, crypto.X509):
+        """
+        Load key and certificate from keystoredir if they are usable: certificate not expiring within
+        KEYSTORERENEWAL seconds, issued for host, and key of keytype
+        :return: key and certificate, or (None, None) if they are missing or have to be regenerated
+        """
+        try:
+            with open(join(self.keystoredir, KEYFILE), 'rb') as keyfile:
+                key = crypto.load_privatekey(crypto.FILETYPE_PEM, keyfile.read())
+            with open(join(self.keystoredir, CERTFILESTORE), 'rb') as certfile:
+                cert = crypto.load_certificate(crypto.FILETYPE_PEM, certfile.read())
+        except (OSError, crypto.Error) as e:
+            self.logger.info('keystore not usable: {}'.format(e))
+            return None, None
+        expires = datetime.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ').replace(tzinfo=timezone.utc)
+        if expires.timestamp() - time() < KEYSTORERENEWAL:
+            self.logger.info('keystore certificate expires {}, regenerating'.format(expires))
+        elif cert.get_subject().CN != self.host:
+            self.logger.info('keystore certificate is for {}, regenerating'.format(cert.get_subject().CN))
+        elif isinstance(key.to_cryptography_key(), ec.EllipticCurvePrivateKey) != (self.keytype == 'ec'):
+            self.logger.info('keystore key is not {}, regenerating'.format(self.keytype))
+        else:
+            return key, cert
+        return None, None
+
+    def savekeystore(self, key: crypto.PKey, cert: crypto.X509) -> None:
+        """
+        Save key and certificate in keystoredir, readable by the daemon user only
+        :param key: private key
+        :param cert: certificate
+        :return: None
+        """
+        makedirs(self.keystoredir, mode=0o700, exist_ok=True)
+        chmod(self.keystoredir, 0o700)
+        for filename, data in ((KEYFILE, crypto.dump_privatekey(crypto.FILETYPE_PEM, key)),
+                               (CERTFILESTORE, crypto.dump_certificate(crypto.FILETYPE_PEM, cert))):
+            target = join(self.keystoredir, filename)
+            fd = os_open(target + '.tmp', O_WRONLY | O_CREAT | O_TRUNC, 0o600)
+            with open(fd, 'wb') as storefile:
+                storefile.write(data)
+            replace(target + '.tmp', target)
+        self.logger.info('saved key and cert in keystore ' + self.keystoredir)
@@ -3,8 +3,19 @@
 """
 Logger configuration
 """
+import atexit
+import gzip
 import logging
 import logging.handlers
+import os
+import shutil
+from functools import partial
+from queue import Queue, Full, Empty
+from threading import Lock, Thread
+from time import monotonic
+from weakref import WeakSet
+
+from xlib.forkhooks import afterfork
 
 __version__ = '0.1'
 
@@ -12,55 +23,259 @@ __version__ = '0.1'
 class StreamToLogger(object):
     """
     Fake file-like stream object that redirects writes to a logger instance.
+    A line is logged once complete; the complete lines of one write are logged as one record, a partial line is
+    kept in linebuf until a later write completes it or flush()
     """
 
     def __init__(self, logger: logging.Logger, loglevel: int):
         self.logger = logger
         self.loglevel = loglevel
         self.linebuf = ''
+        self.__lock__ = Lock()
 
-    def write(self, buf: str) -> None:
-        for line in buf.rstrip().splitlines():
-            self.logger.log(self.loglevel, line.rstrip())
+    def write(self, buf: str) -> int:
+        with self.__lock__:
+            lines = (self.linebuf + buf).split('\n')
+            self.linebuf = lines.pop()
+            self.__log__(lines)
+        return len(buf)
 
     def flush(self) -> None:
-        pass
+        with self.__lock__:
+            lines, self.linebuf = [self.linebuf], ''
+            self.__log__(lines)
+
+    def __log__(self, lines: list) -> None:
+        lines = [line.rstrip() for line in lines if line.strip()]
+        if lines:
+            self.logger.log(self.loglevel, '\n'.join(lines))
 
     def filter(self, logrecord: logging.LogRecord) -> bool:
         return logrecord.levelno <= self.loglevel
 
 
+class BatchWriter(logging.Handler):
+    """
+    Handler that only enqueues records; a background thread formats them and writes them to the target handlers
+    in batches of up to batchsize records, with one write and one flush per target per batch
+    At most queuesize records are buffered; records that do not fit are dropped, counted and reported once a second
+    flush() blocks until queued records are written; shutdownlogging() stops the writer before its targets are closed
+    The writer thread is restarted with an empty queue in forked children
+    """
+    writers = WeakSet()
+
+    def __init__(self, queuesize: int = 10000, batchsize: int = 512):
+        super().__init__()
+        self.targets = []
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.__dropped__ = 0
+        self.__reported__ = 0
+        self.__reportedat__ = 0.0
+        self.__droppedlock__ = Lock()
+        self.__targetslock__ = Lock()
+        self.__start__()
+        self.writers.add(self)
+        afterfork(self.__start__)
+
+    def __start__(self) -> None:
+        self.__queue__ = Queue(maxsize=self.queuesize)
+        self.__thread__ = Thread(target=self.__write__, name='logwriter', daemon=True)
+        self.__thread__.start()
+
+    def addtarget(self, handler: logging.StreamHandler) -> None:
+        with self.__targetslock__:
+            self.targets.append(handler)
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Emit without taking the handler lock, the queue does its own locking."""
+        filtered = self.filter(record)
+        if filtered:
+            self.emit(record)
+        return filtered
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        try:
+            self.__queue__.put_nowait(record)
+        except Full:
+            with self.__droppedlock__:
+                self.__dropped__ += 1
+
+    def flush(self) -> None:
+        if self.__thread__.is_alive():
+            self.__queue__.join()
+
+    def close(self) -> None:
+        if self.__thread__.is_alive():
+            self.__queue__.put(None)
+            self.__thread__.join()
+        super().close()
+
+    @property
+    def dropped(self) -> int:
+        return self.__dropped__
+
+    def __write__(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.__queue__.get()]
+            while len(batch) < self.batchsize:
+                try:
+                    batch.append(self.__queue__.get_nowait())
+                except Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            stopping = len(records) < len(batch)
+            dropped = self.dropped
+            if dropped > self.__reported__ and (stopping or monotonic() - self.__reportedat__ >= 1.0):
+                records.append(logging.makeLogRecord(dict(
+                    name=records[0].name if records else 'logwriter', levelno=logging.ERROR, levelname='ERROR',
+                    msg='log queue full, dropped {} records'.format(dropped - self.__reported__))))
+                self.__reported__, self.__reportedat__ = dropped, monotonic()
+            with self.__targetslock__:
+                targets = list(self.targets)
+            for handler in targets:
+                self.__writebatch__(handler, records)
+            for _ in batch:
+                self.__queue__.task_done()
+
+    @staticmethod
+    def __writebatch__(handler: logging.StreamHandler, records: list) -> None:
+        records = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+        if not records:
+            return
+        handler.acquire()
+        try:
+            if getattr(handler, '_closed', False):
+                # never reopen a target closed under the writer
+                return
+            if isinstance(handler, logging.handlers.BaseRotatingHandler) and handler.shouldRollover(records[0]):
+                handler.doRollover()
+            if handler.stream is None:
+                handler.stream = handler._open()
+            handler.stream.write(''.join([handler.format(record) + handler.terminator for record in records]))
+            handler.flush()
+        except Exception:
+            handler.handleError(records[0])
+        finally:
+            handler.release()
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotates the file when a record would take it past maxBytes, keeping backupCount rotated files gzip-compressed
+    The rotated file is only renamed by the writing thread and compressed by a background thread
+    """
+
+    def __init__(self, filename: str, maxBytes: int, backupCount: int = 5):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount)
+        self.namer = lambda name: name + '.gz'
+        self.__compressor__ = None
+
+    def doRollover(self) -> None:
+        # rotated files are shifted by name, so the previous one has to be compressed by now
+        self.__join__()
+        super().doRollover()
+
+    def rotate(self, source: str, dest: str) -> None:
+        pending = dest[:-len('.gz')]
+        os.rename(source, pending)
+        self.__compressor__ = Thread(target=self.__compress__, args=(pending, dest), name='logcompressor', daemon=True)
+        self.__compressor__.start()
+
+    @staticmethod
+    def __compress__(source: str, dest: str) -> None:
+        try:
+            with open(source, 'rb') as rotated, gzip.open(dest + '.tmp', 'wb') as compressed:
+                shutil.copyfileobj(rotated, compressed, 1024 * 1024)
+            os.replace(dest + '.tmp', dest)
+            os.remove(source)
+        except OSError:
+            # left uncompressed under its rotated name
+            pass
+
+    def __join__(self) -> None:
+        if self.__compressor__ is not None:
+            self.__compressor__.join()
+            self.__compressor__ = None
+
+    def close(self) -> None:
+        self.__join__()
+        super().close()
+
+
+def flushlogger(logger: logging.Logger) -> None:
+    """
+    Write out everything buffered by the logger's handlers
+    :param logger: logger to flush
+    :return: None
+    """
+    for handler in logger.handlers:
+        handler.flush()
+
+
+def shutdownlogging() -> None:
+    """
+    Stop every BatchWriter, writing out the records it queued, then logging.shutdown()
+    logging.shutdown() closes handlers newest first, so the targets of a writer before the writer; run at exit ahead
+    of the one logging registered, and to be called instead of it
+    :return: None
+    """
+    for writer in list(BatchWriter.writers):
+        writer.close()
+    logging.shutdown()
+
+
+atexit.register(shutdownlogging)
+
+
 class LoggerConfiguration(object):
     """
     Helper object that sets up logging handlers
+    With queued=True records are written by a BatchWriter; logging threads only enqueue them
+    Log files are rotated at midnight, or with maxbytes set, whenever they reach maxbytes, keeping backupcount
+    compressed files
     """
 
     def __init__(self, loggername: str, logfile: str, errfile: str,
-                 loglevel: int = logging.INFO, errlevel: int = logging.ERROR):
+                 loglevel: int = logging.INFO, errlevel: int = logging.ERROR,
+                 queued: bool = False, queuesize: int = 10000, maxbytes: int = 0, backupcount: int = 5):
         self.__logger__ = logging.getLogger(loggername)
         self.__logger__.setLevel(logging.INFO)
         self.__stdout__ = StreamToLogger(self.__logger__, loglevel)
         self.__stderr__ = StreamToLogger(self.__logger__, errlevel)
-        handlers = dict([(h.handlerid, h) for h in self.__logger__.handlers if hasattr(h, 'handlerid')])
+        writers = [h for h in self.__logger__.handlers if isinstance(h, BatchWriter)]
+        if queued and not writers:
+            writers.append(BatchWriter(queuesize=queuesize))
+            self.__logger__.addHandler(writers[0])
+        addhandler = writers[0].addtarget if queued else self.__logger__.addHandler
+        handlers = dict([(h.handlerid, h) for h in self.__logger__.handlers + sum([w.targets for w in writers], [])
+                         if hasattr(h, 'handlerid')])
         loghandlerid = self.__logger__.name + '://' + logfile + ':' + str(loglevel)
         errhandlerid = self.__logger__.name + '://' + errfile + ':' + str(errlevel)
+        if maxbytes > 0:
+            filehandler = partial(CompressingRotatingFileHandler, maxBytes=maxbytes, backupCount=backupcount)
+        else:
+            filehandler = partial(logging.handlers.TimedRotatingFileHandler, when='midnight')
         if loghandlerid not in handlers:
-            handler = logging.handlers.TimedRotatingFileHandler(logfile, when='midnight')
+            handler = filehandler(logfile)
             handler.setLevel(loglevel)
             handler.handlerid = loghandlerid
             handler.addFilter(self.__stdout__.filter)
             handler.setFormatter(
                 logging.Formatter(
                     '%(asctime)s|%(levelname)s|%(process)d|%(threadName)s|%(module)s|%(funcName)s|%(message)s'))
-            self.__logger__.addHandler(handler)
+            addhandler(handler)
         if errhandlerid not in handlers:
-            handler = logging.handlers.TimedRotatingFileHandler(errfile, when='midnight')
+            handler = filehandler(errfile)
             handler.setLevel(errlevel)
             handler.handlerid = errhandlerid
             handler.setFormatter(
                 logging.Formatter(
                     '%(asctime)s|%(levelname)s|%(process)d|%(threadName)s|%(module)s|%(funcName)s|%(message)s'))
-            self.__logger__.addHandler(handler)
+            addhandler(handler)
 
     @property
     def logger(self) -> logging.Logger:
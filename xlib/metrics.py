@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process request instrumentation rendered in Prometheus text format
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+from xlib.forkhooks import afterfork
+
+__version__ = '0.1'
+LATENCYBUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENTTYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram; counts holds one non-cumulative count per bucket plus one for +Inf
+    """
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, other: 'Histogram') -> None:
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.sum += other.sum
+
+
+class ThreadMetrics(object):
+    """
+    Counters written only by the thread that owns them, so updates need no lock
+    """
+    __slots__ = ('requests', 'latency', 'handshake', 'bytesin', 'bytesout', 'connections')
+
+    def __init__(self, buckets: tuple):
+        self.requests = {}
+        self.latency = Histogram(buckets)
+        self.handshake = Histogram(buckets)
+        self.bytesin = 0
+        self.bytesout = 0
+        self.connections = 0
+
+    def merge(self, other: 'ThreadMetrics') -> None:
+        for key, count in dict(other.requests).items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        self.latency.merge(other.latency)
+        self.handshake.merge(other.handshake)
+        self.bytesin += other.bytesin
+        self.bytesout += other.bytesout
+        self.connections += other.connections
+
+
+class ThreadToken(object):
+    """
+    Referenced only from a thread's local storage, so it is collected when the thread exits
+    """
+    __slots__ = ('__weakref__',)
+
+
+class Metrics(object):
+    """
+    Request metrics kept per thread and merged only when rendered
+    Each thread updates its own ThreadMetrics; when a thread exits its counters are folded into a retired total
+    collectors are callables returning lines of Prometheus text for gauges owned by other components
+    """
+
+    def __init__(self, buckets: tuple = LATENCYBUCKETS, prefix: str = 'opentrx'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.collectors = []
+        self.__local__ = threading.local()
+        self.__live__ = {}
+        self.__retired__ = ThreadMetrics(buckets)
+        self.__afterfork__()
+        afterfork(self.__afterfork__)
+
+    def __afterfork__(self) -> None:
+        # threads that held the lock do not exist in a forked child, and their counters are retired there
+        self.__lock__ = threading.Lock()
+
+    @property
+    def local(self) -> ThreadMetrics:
+        try:
+            return self.__local__.metrics
+        except AttributeError:
+            metrics = ThreadMetrics(self.buckets)
+            with self.__lock__:
+                self.__live__[id(metrics)] = metrics
+            self.__local__.metrics = metrics
+            self.__local__.token = ThreadToken()
+            weakref.finalize(self.__local__.token, self.__retire__, id(metrics))
+            return metrics
+
+    def __retire__(self, key: int) -> None:
+        with self.__lock__:
+            metrics = self.__live__.pop(key, None)
+            if metrics is not None:
+                self.__retired__.merge(metrics)
+
+    def request(self, method: str, status: int, seconds: float, bytesin: int, bytesout: int) -> None:
+        metrics = self.local
+        key = (method, status)
+        metrics.requests[key] = metrics.requests.get(key, 0) + 1
+        metrics.latency.observe(seconds)
+        metrics.bytesin += bytesin
+        metrics.bytesout += bytesout
+
+    def handshake(self, seconds: float) -> None:
+        self.local.handshake.observe(seconds)
+
+    def connection(self, delta: int) -> None:
+        self.local.connections += delta
+
+    def merged(self) -> ThreadMetrics:
+        """
+        :return: sum of the retired counters and those of live threads
+        """
+        total = ThreadMetrics(self.buckets)
+        with self.__lock__:
+            total.merge(self.__retired__)
+            for metrics in list(self.__live__.values()):
+                total.merge(metrics)
+        return total
+
+    def render(self) -> bytes:
+        """
+        :return: all metrics in Prometheus text exposition format
+        """
+        total = self.merged()
+        name = self.prefix
+        lines = ['# HELP {}_requests_total Requests handled, by method and status'.format(name),
+                 '# TYPE {}_requests_total counter'.format(name)]
+        lines += ['{}_requests_total{{method="{}",status="{}"}} {}'.format(name, method, status, count)
+                  for (method, status), count in sorted(total.requests.items(), key=str)]
+        lines += self.histogram(name + '_request_duration_seconds', 'Time to handle a request', total.latency)
+        lines += self.histogram(name + '_tls_handshake_seconds', 'Time to complete a TLS handshake',
+                                total.handshake)
+        lines += ['# HELP {}_connections_in_flight Open client connections'.format(name),
+                  '# TYPE {}_connections_in_flight gauge'.format(name),
+                  '{}_connections_in_flight {}'.format(name, total.connections),
+                  '# HELP {}_received_bytes_total Request body bytes received'.format(name),
+                  '# TYPE {}_received_bytes_total counter'.format(name),
+                  '{}_received_bytes_total {}'.format(name, total.bytesin),
+                  '# HELP {}_sent_bytes_total Response body bytes sent'.format(name),
+                  '# TYPE {}_sent_bytes_total counter'.format(name),
+                  '{}_sent_bytes_total {}'.format(name, total.bytesout),
+                  '# HELP {}_threads Threads in the serving process'.format(name),
+                  '# TYPE {}_threads gauge'.format(name),
+                  '{}_threads {}'.format(name, threading.active_count())]
+        for collector in list(self.collectors):
+            lines += collector()
+        return ('\n'.join(lines) + '\n').encode()
+
+    @staticmethod
+    def histogram(name: str, description: str, histogram: Histogram) -> list:
+        lines = ['# HELP {} {}'.format(name, description), '# TYPE {} histogram'.format(name)]
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, cumulative))
+        lines.append('{}_sum {}'.format(name, histogram.sum))
+        lines.append('{}_count {}'.format(name, cumulative))
+        return lines
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deadlines for connections, enforced by a reaper thread
+"""
+import socket
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from xlib.forkhooks import afterfork
+
+__version__ = '0.1'
+DEADLINEKINDS = ('handshake', 'headers', 'body', 'write')
+
+
+class Reaper(object):
+    """
+    Closes connections that miss their deadline: a thread blocked reading from or writing to a client that trickles
+    its bytes, or does not read, gets an error from the connection, where a socket timeout would be reset by each byte
+    A connection has at most one deadline at a time, of one of DEADLINEKINDS; deadlines are checked every interval
+    seconds by a thread started with the first deadline. Timeouts are counted by kind for metrics()
+    Connections waiting for their next request are tracked too, so that drain() can end the wait
+    """
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.timeouts = dict.fromkeys(DEADLINEKINDS, 0)
+        self.__reset__()
+        afterfork(self.__reset__)
+
+    def __reset__(self) -> None:
+        self.__lock__ = Lock()
+        self.__deadlines__ = {}
+        self.__idle__ = set()
+        self.__draining__ = False
+        self.__thread__ = None
+
+    def arm(self, connection: socket.socket, kind: str, seconds: float) -> None:
+        """
+        Set the deadline of connection, replacing any it had
+        :param connection: connected socket
+        :param kind: one of DEADLINEKINDS
+        :param seconds: time from now the connection has to meet the deadline in
+        :return: None
+        """
+        with self.__lock__:
+            self.__idle__.discard(connection)
+            self.__deadlines__[connection] = (kind, monotonic() + seconds)
+            if self.__thread__ is None:
+                self.__thread__ = Thread(target=self.__run__, name='reaper', daemon=True)
+                self.__thread__.start()
+
+    def disarm(self, connection: socket.socket) -> None:
+        """
+        Clear the deadline of connection; must be called before the connection is closed
+        :param connection: connected socket
+        :return: None
+        """
+        with self.__lock__:
+            self.__idle__.discard(connection)
+            self.__deadlines__.pop(connection, None)
+
+    def idle(self, connection: socket.socket) -> bool:
+        """
+        Mark connection as waiting for its next request, until its next deadline is set or cleared
+        :param connection: connected socket
+        :return: False once drain() was called, the connection is then not to wait
+        """
+        with self.__lock__:
+            if self.__draining__:
+                return False
+            self.__deadlines__.pop(connection, None)
+            self.__idle__.add(connection)
+            return True
+
+    def drain(self) -> int:
+        """
+        Shut down reading on the connections waiting for a request, which ends their wait; from now on idle() tells
+        every connection not to wait
+        :return: number of connections shut down
+        """
+        with self.__lock__:
+            self.__draining__ = True
+            idle, self.__idle__ = self.__idle__, set()
+            for connection in idle:
+                try:
+                    socket.socket.shutdown(connection, socket.SHUT_RD)
+                except OSError:
+                    pass
+        return len(idle)
+
+    def timedout(self, kind: str) -> None:
+        """
+        Count a timeout detected elsewhere, like on an event loop
+        :param kind: one of DEADLINEKINDS
+        :return: None
+        """
+        with self.__lock__:
+            self.timeouts[kind] += 1
+
+    def reap(self) -> int:
+        """
+        Shut down the connections past their deadline
+        :return: number of connections shut down
+        """
+        now, reaped = monotonic(), 0
+        with self.__lock__:
+            for connection, (kind, deadline) in list(self.__deadlines__.items()):
+                if deadline > now:
+                    continue
+                del self.__deadlines__[connection]
+                self.timeouts[kind] += 1
+                reaped += 1
+                try:
+                    # the plain socket shutdown: SSLSocket.shutdown would drop its SSL object under the owning thread
+                    socket.socket.shutdown(connection, socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        return reaped
+
+    def __run__(self) -> None:
+        while True:
+            sleep(self.interval)
+            self.reap()
+
+    def metrics(self) -> list:
+        """
+        :return: deadline counters in Prometheus text format
+        """
+        return ['# TYPE opentrx_connection_timeouts_total counter'] + [
+            'opentrx_connection_timeouts_total{{kind="{}"}} {}'.format(kind, count)
+            for kind, count in self.timeouts.items()]
@@ -6,37 +6,413 @@ HTTP Request Handler
 import os
 import sys
 from http.server import HTTPServer, BaseHTTPRequestHandler, HTTPStatus
+from json import dumps, loads
+from queue import Queue, Full
+from socket import socket
 from socketserver import ThreadingMixIn
+from ssl import SSLError, SSLSocket
+from threading import Lock, Thread
+from time import perf_counter
 
+from xlib.accesslog import AccessLog
+from xlib.admission import Admission
+from xlib.compression import Compressor, variantetag
+from xlib.journal import JournalError
 from xlib.loggerconfig import LoggerConfiguration
+from xlib.metrics import CONTENTTYPE as METRICSCONTENTTYPE, Metrics
+from xlib.reaper import Reaper
+from xlib.responsecache import CachedResponse, ResponseCache, notmodified
+from xlib.router import ROUTEMETHODS, Router
+from xlib.unixsocket import UnixSocketMixIn
+from xlib.staticfiles import byterange
 
 __version__ = '0.1'
 RESPONSESTUB = """<html><body><h1>ana</h1></body></html>""".encode()
+RESPONSESTUBMODIFIED = 1453670360  # Sun, 24 Jan 2016 21:19:20 GMT
+NDJSONTYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
 
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Handle requests in a separate thread."""
+class RequestBodyError(Exception):
+    """
+    Request body that cannot be read; status is the error response to send
+    """
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DeadlineWriter(object):
+    """
+    Wraps the wfile of a RequestHandler to write in pieces of writechunksize bytes, each within writetimeout seconds
+    """
+
+    def __init__(self, wfile: object, handler: 'RequestHandler'):
+        self.wfile = wfile
+        self.handler = handler
+
+    def write(self, data: bytes) -> int:
+        data, size = memoryview(data).cast('B'), self.handler.writechunksize
+        try:
+            for offset in range(0, len(data), size):
+                self.handler.deadline('write', self.handler.writetimeout)
+                self.wfile.write(data[offset:offset + size])
+        finally:
+            self.handler.deadline(None, 0)
+        return len(data)
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.wfile, name)
+
+
+class BodylessWriter(object):
+    """
+    Stands in for the wfile of a RequestHandler once the headers of a response to HEAD are written: the body the
+    handler goes on to write is dropped
+    """
+
+    def __init__(self, wfile: object):
+        self.wfile = wfile
+
+    def write(self, data: bytes) -> int:
+        return memoryview(data).nbytes
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.wfile, name)
+
+
+class AdmissionMixIn(object):
+    """
+    Mix-in class to turn away a connection at accept, before it costs a TLS handshake, a thread or a place in the
+    queue, if its client already holds the connections RequestHandlerClass.admission allows
+    The connection is closed without a reply and counted by admission
+    """
+
+    def verify_request(self, request, client_address) -> bool:
+        return self.RequestHandlerClass.admission.connect(client_address[0])
+
+    def finish_request(self, request, client_address) -> None:
+        try:
+            super().finish_request(request, client_address)
+        finally:
+            self.RequestHandlerClass.admission.disconnect(client_address[0])
+
+    def overload(self, request, client_address) -> None:
+        # PoolingMixIn turns away a connection that did not fit in its queue without finishing it
+        try:
+            super().overload(request, client_address)
+        finally:
+            self.RequestHandlerClass.admission.disconnect(client_address[0])
+
+
+class DeferredHandshakeMixIn(object):
+    """
+    Mix-in class to run the TLS handshake in the thread that handles the request instead of in accept()
+    Set sslcontext to enable; the listening socket must then be a plain (unwrapped) socket
+    A handshake that does not complete within handshaketimeout seconds is abandoned and the connection closed, and
+    counted by RequestHandlerClass.reaper; the socket timeout bounds the whole handshake, not each read
+    Handshake latency is logged separately from the request log
+    """
+    sslcontext = None
+    handshaketimeout = 5.0
+
+    def finish_request(self, request, client_address) -> None:
+        if self.sslcontext is None:
+            super().finish_request(request, client_address)
+            return
+        start = perf_counter()
+        try:
+            request.settimeout(self.handshaketimeout)
+            sslrequest = self.sslcontext.wrap_socket(request, server_side=True)
+        except (SSLError, OSError) as e:
+            if isinstance(e, TimeoutError):
+                self.RequestHandlerClass.reaper.timedout('handshake')
+            self.RequestHandlerClass.logger.error('{} - - TLS handshake failed after {:.3f}ms: {}'.format(
+                client_address[0], (perf_counter() - start) * 1000, e))
+            return
+        elapsed = perf_counter() - start
+        self.RequestHandlerClass.metrics.handshake(elapsed)
+        self.RequestHandlerClass.logger.info('{} - - TLS handshake {} {:.3f}ms'.format(
+            client_address[0], sslrequest.version(), elapsed * 1000))
+        try:
+            sslrequest.settimeout(None)
+            super().finish_request(sslrequest, client_address)
+        finally:
+            self.shutdown_request(sslrequest)
+
+
+class PoolingMixIn(object):
+    """
+    Mix-in class to handle requests in a fixed pool of poolsize threads fed by a queue of at most queuesize connections
+    overloadpolicy decides what happens to a connection accepted while the queue is full:
+        'block'     accept loop waits for room in the queue, pushing back onto the listen backlog
+        'reply'     connection is answered with 503 Service Unavailable and closed, over TLS by the replier thread
+        'refuse'    connection is closed without a reply
+    queuedepth and queuewait expose the current queue length and time connections spent waiting in the queue
+    server_close() waits for the pool threads to finish unless block_on_close is False
+    """
+    block_on_close = True
+    poolsize = 32
+    queuesize = 128
+    overloadpolicy = 'block'
+    overloadpolicies = ('block', 'reply', 'refuse')
+    overloadtimeout = 0.5
+    replyqueuesize = 16
+    overloadresponse = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                        b'Content-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n')
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self.startpool()
+        super().serve_forever(poll_interval)
+
+    def startpool(self) -> None:
+        """
+        Start the worker threads; called by serve_forever() so that threads are started in the serving process
+        :return: None
+        """
+        assert self.overloadpolicy in self.overloadpolicies
+        if getattr(self, '__pool__', None):
+            return
+        self.__queue__ = Queue(maxsize=self.queuesize)
+        self.__statslock__ = Lock()
+        self.__waitcount__, self.__waittotal__, self.__waitmax__, self.__overloads__ = 0, 0.0, 0.0, 0
+        self.__pool__ = [Thread(target=self.__poolworker__, name='pool-{}'.format(n), daemon=True)
+                         for n in range(self.poolsize)]
+        self.__replies__ = Queue(maxsize=self.replyqueuesize)
+        if self.overloadpolicy == 'reply':
+            self.__pool__.append(Thread(target=self.__replier__, name='replier', daemon=True))
+        if self.poolmetrics not in self.RequestHandlerClass.metrics.collectors:
+            self.RequestHandlerClass.metrics.collectors.append(self.poolmetrics)
+        for thread in self.__pool__:
+            thread.start()
+
+    def process_request(self, request, client_address) -> None:
+        """Queue the connection for the pool, apply overloadpolicy if the queue is full."""
+        item = (request, client_address, perf_counter())
+        if self.overloadpolicy == 'block':
+            self.__queue__.put(item)
+            return
+        try:
+            self.__queue__.put_nowait(item)
+        except Full:
+            self.overload(request, client_address)
+
+    def overload(self, request, client_address) -> None:
+        """
+        Turn away a connection that did not fit in the queue
+        With sslcontext set, the 503 of 'reply' takes a TLS handshake, so it is left to the replier thread instead of
+        holding up the accept loop; a connection that does not fit in its queue of replyqueuesize either is closed
+        without a reply
+        :param request: accepted socket
+        :param client_address: address of the client
+        :return: None
+        """
+        with self.__statslock__:
+            self.__overloads__ += 1
+        if self.overloadpolicy == 'reply':
+            if getattr(self, 'sslcontext', None) is None:
+                self.__reply__(request)
+                return
+            try:
+                self.__replies__.put_nowait(request)
+                return
+            except Full:
+                pass
+        self.shutdown_request(request)
+
+    def __reply__(self, request) -> None:
+        try:
+            request.settimeout(self.overloadtimeout)
+            sslcontext = getattr(self, 'sslcontext', None)
+            if sslcontext is not None:
+                request = sslcontext.wrap_socket(request, server_side=True)
+            request.sendall(self.overloadresponse)
+        except (SSLError, OSError):
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def __replier__(self) -> None:
+        while True:
+            request = self.__replies__.get()
+            if request is None:
+                break
+            self.__reply__(request)
+
+    def __poolworker__(self) -> None:
+        while True:
+            item = self.__queue__.get()
+            if item is None:
+                break
+            request, client_address, queued = item
+            waited = perf_counter() - queued
+            with self.__statslock__:
+                self.__waitcount__ += 1
+                self.__waittotal__ += waited
+                self.__waitmax__ = max(self.__waitmax__, waited)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        for thread in getattr(self, '__pool__', ()):
+            (self.__replies__ if thread.name == 'replier' else self.__queue__).put(None)
+        if self.block_on_close:
+            for thread in getattr(self, '__pool__', ()):
+                thread.join()
+        self.__pool__ = []
+
+    @property
+    def queuedepth(self) -> int:
+        return self.__queue__.qsize() if getattr(self, '__pool__', None) else 0
+
+    @property
+    def queuewait(self) -> dict:
+        """
+        :return: dictionary with count, total, mean and max seconds spent in the queue, and count of overloads
+        """
+        if not getattr(self, '__pool__', None):
+            return dict(count=0, total=0.0, mean=0.0, max=0.0, overloads=0)
+        with self.__statslock__:
+            count, total, maximum = self.__waitcount__, self.__waittotal__, self.__waitmax__
+            overloads = self.__overloads__
+        return dict(count=count, total=total, mean=total / count if count else 0.0, max=maximum, overloads=overloads)
+
+    def poolmetrics(self) -> list:
+        """
+        :return: queue depth and queue wait in Prometheus text format
+        """
+        stats = self.queuewait
+        return ['# TYPE opentrx_pool_queue_depth gauge', 'opentrx_pool_queue_depth {}'.format(self.queuedepth),
+                '# TYPE opentrx_pool_queue_wait_seconds summary',
+                'opentrx_pool_queue_wait_seconds_sum {}'.format(stats['total']),
+                'opentrx_pool_queue_wait_seconds_count {}'.format(stats['count']),
+                '# TYPE opentrx_pool_overloads_total counter',
+                'opentrx_pool_overloads_total {}'.format(stats['overloads'])]
+
+
+class ThreadedHTTPServer(AdmissionMixIn, DeferredHandshakeMixIn, ThreadingMixIn, HTTPServer):
+    """Handle requests in a separate thread; threads do not hold up exit, Listener drains them with a deadline."""
+    daemon_threads = True
+
+
+class PooledHTTPServer(AdmissionMixIn, DeferredHandshakeMixIn, PoolingMixIn, HTTPServer):
+    """Handle requests in a bounded pool of threads."""
+
+
+class UnixThreadedHTTPServer(UnixSocketMixIn, ThreadedHTTPServer):
+    """ThreadedHTTPServer on a Unix domain socket."""
+
+
+class UnixPooledHTTPServer(UnixSocketMixIn, PooledHTTPServer):
+    """PooledHTTPServer on a Unix domain socket."""
 
 
 class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Speaks HTTP/1.1 with persistent connections: requests on a connection, pipelined or not, are handled in turn
+    A connection is closed after idletimeout seconds without a request or after maxrequests requests
+    Every response is framed with Content-Length, or with chunked transfer encoding by send_chunked()
+    Responses that do not change are serialized once into responsecache and sent by send_cached() with one write,
+    answering If-None-Match / If-Modified-Since on GET and HEAD with 304; handler code calls
+    responsecache.invalidate() on change
+    Requests are counted and timed in metrics, which GET on metricspath returns in Prometheus text format
+    With staticfiles set, GET below staticprefix serves files by send_static(): from memory maps over TLS, by
+    sendfile() on plaintext sockets, with Range and conditional requests
+    POST bodies are streamed by readbody() in readbuffersize pieces, Content-Length or chunked, up to maxbodysize;
+    an NDJSON body is parsed as it arrives and its records passed in batches to handle_records()
+    With journal set, a POST is answered only after its body (or its NDJSON records) is durable in the journal; a
+    body journaled as one record is held whole until then, so one over maxjournalbody is refused with 413
+    Setting draining closes every connection after its current response, and reaper.drain() those waiting for one
+    Each request is passed to accesslog once handled, which logs it in full, samples it or rolls it up per path
+    A request beyond the request rate admission allows its client is answered 429 Too Many Requests with Retry-After
+    Requests are dispatched by routes, compiled by compileroutes() from the built-in routes and those added to router:
+    plugins register handler(requesthandler, **params) there by method and path pattern, see Router; HEAD is handled
+    by the GET handler of a route without one for HEAD, and whatever body a handler writes is dropped
+    On sockets, reaper closes a connection whose client does not send its request headers within headertimeout
+    seconds, sends its body slower than bodytimeout seconds plus minbodyrate bytes per second, or does not take
+    writechunksize bytes of the response within writetimeout seconds; a deadline set to 0 is not enforced
+    Cached responses, metrics and whole static files are compressed by compression for clients that accept it;
+    compressed bodies are cached by entity tag, so each is compressed once, while metrics are compressed every time.
+    Setting compression to None disables it
+    """
     server_version = 'ListnerRequestHandler {} BaseHTTPRequestHandler {}'.format(__version__,
                                                                                  BaseHTTPRequestHandler.server_version)
+    protocol_version = 'HTTP/1.1'
+    idletimeout = 15.0
+    maxrequests = 100
+    readbuffersize = 65536
+    requestcount = 0
+    responsecache = ResponseCache()
+    metrics = Metrics()
+    metricspath = '/metrics'
+    staticfiles = None
+    staticprefix = '/static/'
+    writechunksize = 262144
+    maxbodysize = 64 * 1024 * 1024
+    maxchunkline = 1024
+    maxrecordsize = 1024 * 1024
+    maxjournalbody = 1024 * 1024
+    recordbatchsize = 1000
+    journal = None
+    draining = False
+    accesslog = AccessLog()
+    admission = Admission()
+    compression = Compressor()
+    reaper = Reaper()
+    headertimeout = 10.0
+    bodytimeout = 10.0
+    minbodyrate = 1024
+    writetimeout = 10.0
+    router = Router()
+    routes = None
+
+    @classmethod
+    def compileroutes(cls) -> None:
+        """
+        Compile the built-in routes together with those added to router, which replace built-in routes registered
+        for the same method and pattern; called at server start, or by the first request
+        :return: None
+        """
+        routes = Router()
+        routes.add('GET', '/*', cls.stub)
+        routes.add('POST', '/*', cls.receive)
+        routes.add('GET', cls.metricspath, cls.send_metrics)
+        if cls.staticfiles is not None:
+            routes.add('GET', cls.staticprefix + '{urlpath*}', cls.send_static)
+        routes.update(cls.router)
+        cls.routes = routes.compile()
 
     @classmethod
-    def setlogger(cls, basedir: str) -> None:
+    def setlogger(cls, basedir: str, queued: bool = False, maxbytes: int = 0) -> None:
         logfile = os.path.join(basedir, 'stdout_' + cls.__name__ + '.txt')
         errfile = os.path.join(basedir, 'stderr_' + cls.__name__ + '.txt')
         cls.logger, sys.stdout, sys.stderr = LoggerConfiguration(loggername=cls.__name__,
                                                                  logfile=logfile,
-                                                                 errfile=errfile).getfilehandles
+                                                                 errfile=errfile,
+                                                                 queued=queued,
+                                                                 maxbytes=maxbytes).getfilehandles
 
     def log_request(self, code: HTTPStatus = None, size: int = None) -> None:
-        self.logger.info(
-            '{} {} {} {} "{}" {} {}'.format(self.address_string(), '-', '-', self.log_date_time_string(),
-                                            self.requestline,
-                                            code.value if isinstance(code, HTTPStatus) else '-',
-                                            size or ' - ')
-        )
+        """Note the status and body size of the response; the request is logged by accesslog once handled."""
+        self.__status__ = code
+        if size:
+            self.__bytesout__ += size
+
+    def accessline(self) -> str:
+        """
+        :return: access log line of the request handled last
+        """
+        return '{} {} {} {} "{}" {} {}'.format(self.address_string(), '-', '-', self.log_date_time_string(),
+                                               self.requestline,
+                                               self.__status__.value if isinstance(self.__status__, HTTPStatus)
+                                               else self.__status__,
+                                               self.__bytesout__ or ' - ')
 
     def log_error(self, formatstring, *args) -> None:
         self.logger.error('%s - - [%s] %s' % (self.address_string(), self.log_date_time_string(), formatstring % args))
@@ -56,21 +432,506 @@ class RequestHandler(BaseHTTPRequestHandler):
         """
         self.logger.info('%s - - [%s] %s' % (self.address_string(), self.log_date_time_string(), formatstring % args))
 
-    def stub(self) -> None:
-        status = HTTPStatus.OK
-        result = RESPONSESTUB
+    @classmethod
+    def log_connection(cls, client_address: (str, int), requests: int) -> None:
+        cls.logger.info('{} - - connection closed after {} requests'.format(client_address[0], requests))
+
+    def setup(self) -> None:
+        super().setup()
+        if isinstance(self.connection, socket) and self.writetimeout:
+            self.wfile = DeadlineWriter(self.wfile, self)
+
+    def deadline(self, kind: str, seconds: float) -> None:
+        """
+        Set the deadline reaper enforces on the connection, replacing the one it had
+        :param kind: one of DEADLINEKINDS; None to clear the deadline
+        :param seconds: time from now to meet it in; 0 to clear the deadline
+        :return: None
+        """
+        if not isinstance(self.connection, socket):
+            return
+        if kind is None or not seconds:
+            self.reaper.disarm(self.connection)
+        else:
+            self.reaper.arm(self.connection, kind, seconds)
+
+    def handle(self) -> None:
+        """Handle requests until the connection is closed, idles for idletimeout or maxrequests are served."""
+        self.close_connection = True
+        self.requestcount = 0
+        self.connection.settimeout(self.idletimeout)
+        self.metrics.connection(1)
+        try:
+            self.handle_one_request()
+            while not self.close_connection and self.awaitrequest():
+                self.handle_one_request()
+        except ConnectionError as e:
+            # the client went away, or reaper shut the connection down: not worth a traceback
+            self.log_error('connection lost: %s', e)
+        finally:
+            self.deadline(None, 0)
+            self.metrics.connection(-1)
+            self.log_connection(self.client_address, self.requestcount)
+
+    def handle_one_request(self) -> None:
+        self.__started__ = None
+        self.deadline('headers', self.headertimeout)
+        wfile = self.wfile
+        try:
+            super().handle_one_request()
+        finally:
+            self.deadline(None, 0)
+            self.wfile = wfile
+        if self.__started__ is not None and self.__status__ is not None:
+            elapsed = perf_counter() - self.__started__
+            self.metrics.request(self.command or '-', int(self.__status__), elapsed, self.__bytesin__,
+                                 self.__bytesout__)
+            self.accesslog.record(self.logger, self.accessline, self.path.partition('?')[0], int(self.__status__),
+                                  self.__bytesin__, self.__bytesout__, elapsed)
+            if self.route is not None:
+                self.routes.observe(self.command, self.route, int(self.__status__), elapsed)
+
+    def awaitrequest(self) -> bool:
+        """
+        Wait up to idletimeout for the next request on a persistent connection; pipelined requests are already buffered
+        A connection on a socket waits only until the server drains, see Reaper.drain()
+        :return: True if a request is waiting, False if the connection was closed, idled out or the server drains
+        """
+        if isinstance(self.connection, socket) and not self.reaper.idle(self.connection):
+            return False
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except (TimeoutError, OSError):
+            return False
+
+    def parse_request(self) -> bool:
+        self.__started__ = perf_counter()
+        self.__status__, self.__bytesin__, self.__bytesout__ = None, 0, 0
+        self.path = '-'
+        self.route = None
+        self.requestcount += 1
+        self.__connectionheader__ = False
+        self.__bodyread__ = False
+        parsed = super().parse_request()
+        self.deadline(None, 0)
+        if not parsed:
+            return False
+        retryafter = self.admission.request(self.client_address[0])
+        if retryafter:
+            self.send_refusal(HTTPStatus.TOO_MANY_REQUESTS, [('Retry-After', str(retryafter))])
+            return False
+        return True
+
+    def send_refusal(self, status: HTTPStatus, headers: list) -> None:
+        """
+        Answer with an empty response without handling the request; a request body is left unread, so the connection
+        is closed after it
+        :param status: response status
+        :param headers: list of (header, value) to send
+        :return: None
+        """
         self.send_response(status)
-        self.send_header("Content-type", 'text/html')
-        self.send_header("Last-Modified", 'Sun, 24 Jan 2016 21:19:20 GMT')
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        self.send_header('Content-Length', '0')
         self.end_headers()
-        self.wfile.write(result)
-        self.log_request(status, len(result))
-        return
 
-    def do_GET(self) -> None:
-        self.stub()
+    def send_header(self, keyword: str, value: str) -> None:
+        if keyword.lower() == 'connection':
+            self.__connectionheader__ = True
+        super().send_header(keyword, value)
+
+    def end_headers(self) -> None:
+        if self.requestcount >= self.maxrequests or self.draining or self.__bodyunread__():
+            self.close_connection = True
+        if not getattr(self, '__connectionheader__', True):
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            else:
+                if self.request_version != 'HTTP/1.1':
+                    self.send_header('Connection', 'keep-alive')
+                self.send_header('Keep-Alive', 'timeout={:d}, max={:d}'.format(
+                    int(self.idletimeout), self.maxrequests - self.requestcount))
+        super().end_headers()
+
+    def __bodyunread__(self) -> bool:
+        # a body not read to its end leaves the connection unable to carry another request
+        headers = getattr(self, 'headers', None)
+        if headers is None or getattr(self, '__bodyread__', True):
+            return False
+        return headers.get('Transfer-Encoding') is not None or headers.get('Content-Length', '0') != '0'
+
+    def readbody(self) -> iter:
+        """
+        Read the request body as it arrives, delimited by Content-Length or by chunked transfer encoding
+        Never holds more than readbuffersize bytes of it; a body larger than maxbodysize is refused
+        :return: iterator of body pieces of at most readbuffersize bytes
+        :raises RequestBodyError: if the body is malformed, too large or has an unsupported transfer encoding
+        """
+        self.__bodystarted__ = perf_counter()
+        try:
+            yield from self.__readbody__()
+            self.__bodyread__ = True
+        finally:
+            self.deadline(None, 0)
+
+    def __readbody__(self) -> iter:
+        encoding = self.headers.get('Transfer-Encoding')
+        if encoding is not None:
+            if encoding.strip().lower() != 'chunked':
+                raise RequestBodyError(HTTPStatus.NOT_IMPLEMENTED, 'Unsupported Transfer-Encoding ' + encoding)
+            yield from self.__readchunked__()
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length')
+        if length < 0:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length')
+        if length > self.maxbodysize:
+            raise RequestBodyError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body exceeds {} bytes'.format(
+                self.maxbodysize))
+        yield from self.__readexactly__(length)
+
+    def __readexactly__(self, length: int) -> iter:
+        remaining = length
+        while remaining > 0:
+            self.__bodydeadline__()
+            data = self.rfile.read(min(remaining, self.readbuffersize))
+            if not data:
+                raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Request body ended early')
+            remaining -= len(data)
+            self.__bytesin__ += len(data)
+            yield data
+
+    def __readchunked__(self) -> iter:
+        total = 0
+        while True:
+            self.__bodydeadline__()
+            line = self.rfile.readline(self.maxchunkline + 1)
+            if not line.endswith(b'\n'):
+                raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Invalid chunk size line')
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Invalid chunk size line')
+            if size == 0:
+                break
+            total += size
+            if size < 0 or total > self.maxbodysize:
+                raise RequestBodyError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body exceeds {} bytes'.format(
+                    self.maxbodysize))
+            yield from self.__readexactly__(size)
+            if self.rfile.readline(3) not in (b'\r\n', b'\n'):
+                raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Chunk not terminated by CRLF')
+        while self.rfile.readline(self.maxchunkline + 1) not in (b'\r\n', b'\n', b''):
+            pass
+
+    def __bodydeadline__(self) -> None:
+        # the body has bodytimeout seconds, plus a second for every minbodyrate bytes received so far
+        if self.bodytimeout:
+            self.deadline('body', self.__bodystarted__ + self.bodytimeout - perf_counter() + (
+                self.__bytesin__ / self.minbodyrate if self.minbodyrate else 0))
+
+    def discardbody(self) -> None:
+        """
+        Read and drop the request body so that the next request on the connection can be parsed
+        :return: None
+        :raises RequestBodyError: as readbody()
+        """
+        for _ in self.readbody():
+            pass
+
+    def readrecords(self) -> int:
+        """
+        Parse an NDJSON request body record by record as it arrives
+        Records are passed to handle_records() in batches of up to recordbatchsize
+        :return: number of records read
+        :raises RequestBodyError: as readbody(), or if a record is not JSON or is longer than maxrecordsize
+        """
+        pending, batch, count = b'', [], 0
+        for data in self.readbody():
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            if len(pending) > self.maxrecordsize:
+                raise RequestBodyError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Record {} exceeds {} bytes'.format(
+                    count + len(batch) + 1, self.maxrecordsize))
+            for line in lines:
+                if line.strip():
+                    batch.append(self.__record__(line, count + len(batch) + 1))
+                if len(batch) >= self.recordbatchsize:
+                    self.handle_records(batch)
+                    count, batch = count + len(batch), []
+        if pending.strip():
+            batch.append(self.__record__(pending, count + len(batch) + 1))
+        if batch:
+            self.handle_records(batch)
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def __record__(line: bytes, number: int) -> object:
+        try:
+            return loads(line)
+        except ValueError:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, 'Record {} is not valid JSON'.format(number))
+
+    def handle_records(self, records: list) -> None:
+        """
+        Hook called by readrecords() with each batch of parsed NDJSON records; override to ingest them
+        By default the records are appended to journal, one journal record each
+        :param records: decoded JSON values, in the order received
+        :return: None
+        """
+        if self.journal is not None:
+            self.journal.append(*[dumps(record, separators=(',', ':')).encode() for record in records])
+
+    def send_chunked(self, status: HTTPStatus, contenttype: str, chunks: iter) -> int:
+        """
+        Send a response whose length is not known up front, chunked for HTTP/1.1 clients, else delimited by close
+        :param status: response status
+        :param contenttype: value of the Content-Type header
+        :param chunks: iterable of bytes
+        :return: number of body bytes sent
+        """
+        chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(status)
+        self.send_header('Content-type', contenttype)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+        self.end_headers()
+        size = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            self.wfile.write(b''.join((b'%X\r\n' % len(chunk), chunk, b'\r\n')) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.log_request(status, size)
+        return size
+
+    def send_cached(self, route: object, build: callable) -> None:
+        """
+        Send the cached response for route, building and caching it first if needed
+        :param route: responsecache key
+        :param build: callable returning (status, list of (header, value), body, last modified epoch seconds)
+        :return: None
+        """
+        response = self.responsecache.get(route)
+        if response is None:
+            status, headers, body, lastmodified = build()
+            response = self.responsecache.put(route, CachedResponse(status, headers, body, lastmodified,
+                                                                    self.version_string()))
+        etag, head, nothead, body = response.etag, response.head, response.nothead, response.body
+        vary = self.compression is not None and self.compression.compressible(response.contenttype, len(body))
+        coding = vary and self.compression.negotiate(self.headers.get('Accept-Encoding'), response.contenttype,
+                                                     len(body))
+        if coding:
+            body = self.compression.compress(body, coding, response.etag)
+            size = response.size
+            etag, head, nothead = response.variant(coding, body)
+            if response.size != size:
+                self.responsecache.account(route, response)
+        if self.isnotmodified(etag, response.lastmodified):
+            status, head, body = HTTPStatus.NOT_MODIFIED, nothead, b''
+        else:
+            status = response.status
+        self._headers_buffer = [head]
+        self.send_header('Date', self.date_time_string())
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.__pendingbody__ = body
+        self.end_headers()
+        self.log_request(status, len(body))
+
+    def isnotmodified(self, etag: str, lastmodified: float) -> bool:
+        """
+        Evaluate the conditional headers of the request against a response's validators; only GET and HEAD can be
+        answered 304 Not Modified, other methods ignore If-None-Match and If-Modified-Since
+        :param etag: entity tag of the response, quoted
+        :param lastmodified: last modification of the response in epoch seconds
+        :return: True if 304 Not Modified is to be sent
+        """
+        if self.command not in ('GET', 'HEAD'):
+            return False
+        return notmodified(etag, lastmodified, self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since'))
+
+    def flush_headers(self) -> None:
+        """Write the headers, together with any body queued by send_cached(), in one write; HEAD gets no body."""
+        body = getattr(self, '__pendingbody__', None)
+        if body and self.command != 'HEAD':
+            self._headers_buffer.append(body)
+        self.__pendingbody__ = None
+        super().flush_headers()
+        if self.command == 'HEAD' and not isinstance(self.wfile, BodylessWriter):
+            self.wfile = BodylessWriter(self.wfile)
+
+    def stub(self) -> None:
+        self.send_cached('stub', lambda: (HTTPStatus.OK, [('Content-type', 'text/html')], RESPONSESTUB,
+                                          RESPONSESTUBMODIFIED))
         return
 
-    def do_POST(self) -> None:
+    def send_body(self, status: HTTPStatus, contenttype: str, body: bytes) -> None:
+        """
+        Send a response with body, compressed if compression and the client agree on a content coding
+        :param status: response status
+        :param contenttype: value of the Content-Type header
+        :param body: response body
+        :return: None
+        """
+        vary = self.compression is not None and self.compression.compressible(contenttype, len(body))
+        coding = vary and self.compression.negotiate(self.headers.get('Accept-Encoding'), contenttype, len(body))
+        if coding:
+            body = self.compression.compress(body, coding)
+        self.send_response(status)
+        self.send_header('Content-Type', contenttype)
+        if coding:
+            self.send_header('Content-Encoding', coding)
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.log_request(status, len(body))
+
+    def send_metrics(self) -> None:
+        self.send_body(HTTPStatus.OK, METRICSCONTENTTYPE, self.metrics.render())
+
+    def send_static(self, urlpath: str) -> None:
+        """
+        Send a file from staticfiles, or the requested byte range of it
+        :param urlpath: path of the file below staticfiles.root
+        :return: None
+        """
+        path, filestat = self.staticfiles.resolve(urlpath)
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        entry = self.staticfiles.mapped(path, filestat)
+        # a compressed representation is sent whole: byte ranges are served from the file as it is
+        vary = self.compression is not None and self.compression.compressible(entry.contenttype, entry.size)
+        coding = vary and self.headers.get('Range') is None and self.compression.negotiate(
+            self.headers.get('Accept-Encoding'), entry.contenttype, entry.size)
+        etag = variantetag(entry.etag, coding) if coding else entry.etag
+        validators = (('ETag', etag), ('Last-Modified', entry.lastmodifiedstring)) + (
+            (('Vary', 'Accept-Encoding'),) if vary else ())
+        if self.isnotmodified(etag, entry.lastmodified):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for keyword, value in validators:
+                self.send_header(keyword, value)
+            self.end_headers()
+            return
+        if coding:
+            body = self.compression.compress(entry.body, coding, entry.etag)
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', entry.contenttype)
+            self.send_header('Content-Encoding', coding)
+            self.send_header('Content-Length', str(len(body)))
+            for keyword, value in validators:
+                self.send_header(keyword, value)
+            self.end_headers()
+            self.wfile.write(body)
+            self.log_request(HTTPStatus.OK, len(body))
+            return
+        status, start, end = HTTPStatus.OK, 0, entry.size
+        ranges = self.headers.get('Range')
+        if ranges is not None and self.headers.get('If-Range', entry.etag) in (entry.etag, entry.lastmodifiedstring):
+            requested = byterange(ranges, entry.size)
+            if requested == (entry.size, entry.size):
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', 'bytes */{}'.format(entry.size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if requested is not None:
+                status, (start, end) = HTTPStatus.PARTIAL_CONTENT, requested
+        self.send_response(status)
+        self.send_header('Content-Type', entry.contenttype)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, entry.size))
+        for keyword, value in validators:
+            self.send_header(keyword, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            pass
+        elif isinstance(self.connection, socket) and not isinstance(self.connection, SSLSocket):
+            with open(path, 'rb') as staticfile:
+                try:
+                    for offset in range(start, end, self.writechunksize):
+                        self.deadline('write', self.writetimeout)
+                        self.connection.sendfile(staticfile, offset, min(self.writechunksize, end - offset))
+                finally:
+                    self.deadline(None, 0)
+        else:
+            for offset in range(start, end, self.writechunksize):
+                self.wfile.write(entry.body[offset:min(offset + self.writechunksize, end)])
+        self.log_request(status, end - start)
+
+    def dispatch(self) -> None:
+        """Run the handler routes match for the request, else answer 404 Not Found or 405 Method Not Allowed."""
+        if self.routes is None:
+            self.compileroutes()
+        handler, params, route, allowed = self.routes.match(self.command, self.path)
+        if handler is not None:
+            self.route = route
+            handler(self, **params)
+        elif allowed:
+            self.send_refusal(HTTPStatus.METHOD_NOT_ALLOWED, [('Allow', ', '.join(allowed))])
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def __getattr__(self, name: str) -> object:
+        # every routable method is dispatched, so that routes decide between 404 and 405
+        if name.startswith('do_') and name[3:] in ROUTEMETHODS:
+            return self.dispatch
+        raise AttributeError(name)
+
+    def __readwhole__(self, limit: int) -> bytes:
+        """
+        :return: the request body, which has to be held whole
+        :raises RequestBodyError: as readbody(), or if the body is larger than limit bytes
+        """
+        try:
+            declared = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            declared = 0
+        body = bytearray()
+        for data in ([] if declared > limit else self.readbody()):
+            body += data
+            if len(body) > limit:
+                break
+        if declared > limit or len(body) > limit:
+            raise RequestBodyError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body exceeds {} bytes'.format(limit))
+        return bytes(body)
+
+    def receive(self) -> None:
+        try:
+            if self.headers.get_content_type() in NDJSONTYPES:
+                body = dumps({'records': self.readrecords()}).encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                self.log_request(HTTPStatus.OK, len(body))
+                return
+            if self.journal is not None:
+                self.journal.append(self.__readwhole__(self.maxjournalbody))
+            else:
+                self.discardbody()
+        except RequestBodyError as e:
+            # the rest of the body is unread, so the connection cannot carry another request
+            self.close_connection = True
+            self.send_error(e.status, explain=e.message)
+            return
+        except JournalError as e:
+            self.log_error('%s', e)
+            self.close_connection = True
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, explain=str(e))
+            return
         self.stub()
-        pass
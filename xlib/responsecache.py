@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache of serialized HTTP responses
+"""
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import sha1
+from http import HTTPStatus
+from threading import Lock
+
+from xlib.compression import variantetag
+
+__version__ = '0.1'
+
+
+def notmodified(etag: str, lastmodified: int, ifnonematch: str, ifmodifiedsince: str) -> bool:
+    """
+    Evaluate conditional request headers against a response's validators
+    :param etag: entity tag of the response, quoted
+    :param lastmodified: last modification of the response in epoch seconds
+    :param ifnonematch: value of If-None-Match or None
+    :param ifmodifiedsince: value of If-Modified-Since or None; ignored if If-None-Match is present
+    :return: True if 304 Not Modified is to be sent
+    """
+    if ifnonematch is not None:
+        tags = [tag.strip() for tag in ifnonematch.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    if ifmodifiedsince is not None:
+        try:
+            return lastmodified <= parsedate_to_datetime(ifmodifiedsince).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+    return False
+
+
+class CachedResponse(object):
+    """
+    A response serialized once: status line and fixed headers in head, 304 status line and validators in nothead
+    The heads of compressed representations are serialized once each by variant()
+    Date, Vary and connection management headers are added per request
+    """
+    __slots__ = ('status', 'headers', 'serverversion', 'contenttype', 'head', 'nothead', 'body', 'etag', 'lastmodified',
+                 'variants')
+
+    def __init__(self, status: HTTPStatus, headers: list, body: bytes, lastmodified: float, serverversion: str):
+        self.status = status
+        self.headers = list(headers)
+        self.serverversion = serverversion
+        self.contenttype = next((v for k, v in self.headers if k.lower() == 'content-type'), None)
+        self.body = bytes(body)
+        self.etag = '"{}"'.format(sha1(self.body).hexdigest()[:20])
+        self.lastmodified = int(lastmodified)
+        self.head, self.nothead = self.serializeheads(self.etag, len(self.body), [])
+        self.variants = {}
+
+    def serializeheads(self, etag: str, length: int, extra: list) -> (bytes, bytes):
+        validators = [('ETag', etag), ('Last-Modified', formatdate(self.lastmodified, usegmt=True))]
+        return (self.serialize(self.status, [('Server', self.serverversion)] + self.headers + extra +
+                               [('Content-Length', str(length))] + validators),
+                self.serialize(HTTPStatus.NOT_MODIFIED, [('Server', self.serverversion)] + validators))
+
+    def variant(self, coding: str, body: bytes) -> (str, bytes, bytes):
+        """
+        :param coding: content coding
+        :param body: the body compressed with coding
+        :return: entity tag, head and 304 head of the compressed representation
+        """
+        variant = self.variants.get(coding)
+        if variant is None or variant[3] != len(body):
+            etag = variantetag(self.etag, coding)
+            variant = self.variants[coding] = (etag,) + self.serializeheads(etag, len(body), [
+                ('Content-Encoding', coding)]) + (len(body),)
+        return variant[:3]
+
+    @staticmethod
+    def serialize(status: HTTPStatus, headers: list) -> bytes:
+        lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)] + ['{}: {}'.format(k, v) for k, v in headers]
+        return ('\r\n'.join(lines) + '\r\n').encode('latin-1', 'strict')
+
+    def notmodified(self, ifnonematch: str, ifmodifiedsince: str) -> bool:
+        return notmodified(self.etag, self.lastmodified, ifnonematch, ifmodifiedsince)
+
+    @property
+    def size(self) -> int:
+        return len(self.head) + len(self.nothead) + len(self.body) + sum(
+            len(head) + len(nothead) for _, head, nothead, _ in list(self.variants.values()))
+
+
+class ResponseCache(object):
+    """
+    LRU cache of CachedResponse keyed by route, bounded by maxsize bytes of serialized responses
+    Responses larger than maxsize are returned by put() but not kept; a response is accounted at the size it had when
+    stored, and again by account() after it grew a variant, so dropping it takes off exactly what was added
+    invalidate() drops one route, or every route
+    """
+
+    def __init__(self, maxsize: int = 16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__size__ = 0
+        self.__entries__ = OrderedDict()
+        self.__lock__ = Lock()
+
+    def get(self, route: object) -> CachedResponse:
+        """
+        :param route: cache key
+        :return: cached response or None
+        """
+        with self.__lock__:
+            entry = self.__entries__.get(route)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries__.move_to_end(route)
+            return entry[0]
+
+    def put(self, route: object, response: CachedResponse) -> CachedResponse:
+        """
+        Store the response for route, evicting least recently used responses to stay within maxsize
+        :param route: cache key
+        :param response: response to store
+        :return: the response
+        """
+        with self.__lock__:
+            self.__drop__(route)
+            self.__store__(route, response)
+        return response
+
+    def account(self, route: object, response: CachedResponse) -> None:
+        """
+        Account for the size response has now, after variant() added to it, if it is still the one stored for route;
+        evicting least recently used responses to stay within maxsize, or response itself if it no longer fits
+        :param route: cache key
+        :param response: response returned by get() or put() for route
+        :return: None
+        """
+        with self.__lock__:
+            entry = self.__entries__.get(route)
+            if entry is not None and entry[0] is response:
+                self.__drop__(route)
+                self.__store__(route, response)
+
+    def __store__(self, route: object, response: CachedResponse) -> None:
+        # call with lock held, route not stored
+        size = response.size
+        if size <= self.maxsize:
+            self.__entries__[route] = (response, size)
+            self.__size__ += size
+            while self.__size__ > self.maxsize:
+                self.__size__ -= self.__entries__.popitem(last=False)[1][1]
+
+    def __drop__(self, route: object) -> None:
+        # call with lock held
+        entry = self.__entries__.pop(route, None)
+        if entry is not None:
+            self.__size__ -= entry[1]
+
+    def invalidate(self, route: object = None) -> None:
+        """
+        :param route: cache key to drop, None to drop every route
+        :return: None
+        """
+        with self.__lock__:
+            if route is None:
+                self.__entries__.clear()
+                self.__size__ = 0
+            else:
+                self.__drop__(route)
+
+    @property
+    def size(self) -> int:
+        return self.__size__
+
+    def __len__(self) -> int:
+        return len(self.__entries__)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Request routing: handlers registered by method and path pattern, compiled into a segment trie
+"""
+from urllib.parse import unquote
+
+__version__ = '0.1'
+ROUTEMETHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS')
+
+
+class RouteNode(object):
+    """
+    One path segment of the trie
+    methods maps a method to (handler, pattern, parameter names) for patterns ending at this node, prefix does the
+    same for patterns whose remaining path starts after this node
+    """
+    __slots__ = ('children', 'param', 'methods', 'prefix')
+
+    def __init__(self):
+        self.children = {}
+        self.param = None
+        self.methods = {}
+        self.prefix = {}
+
+
+class Router(object):
+    """
+    Registry of request handlers by method and path pattern
+    Segments of a pattern are literal, or
+        {name}      any non-empty segment, passed percent-decoded to the handler as keyword argument name
+        {name*}     last segment only: the rest of the path, possibly empty and not decoded, passed as name
+        *           last segment only: the rest of the path, not passed
+    Handlers are called as handler(requesthandler, **params)
+    compile() builds a dictionary of the literal patterns and a trie of all of them, so that match() costs one
+    dictionary lookup or a walk of the trie nodes the path segments lead to, however many routes there are; a literal
+    segment takes precedence over {name} at the same position, falling back to {name} if no pattern below the literal
+    matches, and a path that no full pattern matches for the method falls back to the longest prefix pattern that does
+    HEAD is handled by the GET handler of a pattern without a HEAD handler
+    hooks are called as hook(method, pattern, status, seconds) after each request that a route handled
+    """
+
+    def __init__(self):
+        self.__routes__ = {}
+        self.__static__ = None
+        self.__root__ = None
+        self.hooks = []
+
+    def add(self, method: str, pattern: str, handler: callable) -> None:
+        """
+        Register handler, replacing the one registered for the same method and pattern
+        :param method: request method
+        :param pattern: path pattern
+        :param handler: callable taking the RequestHandler and the path parameters as keyword arguments
+        :return: None
+        """
+        assert method in ROUTEMETHODS
+        self.__routes__[(method, pattern)] = (handler, self.__parse__(pattern))
+        self.__static__, self.__root__ = None, None
+
+    def route(self, method: str, pattern: str) -> callable:
+        """
+        Decorator form of add()
+        :return: decorator registering the function it decorates
+        """
+        def register(handler: callable) -> callable:
+            self.add(method, pattern, handler)
+            return handler
+        return register
+
+    def update(self, other: 'Router') -> None:
+        """
+        Register the routes and hooks of other, its routes replacing those registered for the same method and pattern
+        :param other: router to copy from
+        :return: None
+        """
+        self.__routes__.update(other.__routes__)
+        self.__static__, self.__root__ = None, None
+        self.hooks.extend(other.hooks)
+
+    @staticmethod
+    def __parse__(pattern: str) -> list:
+        """
+        :return: list of (kind, value) per segment, kind 'literal', 'param' or 'prefix', value a segment or name
+        """
+        assert pattern.startswith('/'), pattern
+        segments = pattern[1:].split('/')
+        parsed = []
+        for index, segment in enumerate(segments):
+            if segment == '*' or (segment.startswith('{') and segment.endswith('*}')):
+                assert index == len(segments) - 1, pattern
+                parsed.append(('prefix', segment[1:-2] or None))
+            elif segment.startswith('{') and segment.endswith('}'):
+                assert segment[1:-1].isidentifier(), pattern
+                parsed.append(('param', segment[1:-1]))
+            else:
+                assert '{' not in segment and '}' not in segment, pattern
+                parsed.append(('literal', segment))
+        return parsed
+
+    def compile(self) -> 'Router':
+        """
+        Build the lookup structures; match() compiles on first use if this was not called
+        :return: self
+        """
+        static, root = {}, RouteNode()
+        for (method, pattern), (handler, parsed) in self.__routes__.items():
+            node, names = root, []
+            for kind, value in parsed:
+                if kind == 'literal':
+                    node = node.children.setdefault(value, RouteNode())
+                elif kind == 'param':
+                    if node.param is None:
+                        node.param = RouteNode()
+                    node, names = node.param, names + [value]
+            if parsed[-1][0] == 'prefix':
+                node.prefix[method] = (handler, pattern, names + [parsed[-1][1]] if parsed[-1][1] else names)
+            else:
+                node.methods[method] = (handler, pattern, names)
+                if not names:
+                    static.setdefault(pattern, {})[method] = (handler, pattern)
+        self.__static__, self.__root__ = static, root
+        return self
+
+    def match(self, method: str, path: str) -> (callable, dict, str, list):
+        """
+        Find the handler for a request
+        :param method: request method
+        :param path: request path, query string included or not
+        :return: handler, its keyword arguments, and the pattern it was registered with, or if no route matches,
+            (None, None, None, methods that routes match the path for); an empty list of methods means 404
+        """
+        if self.__root__ is None:
+            self.compile()
+        path = path.partition('?')[0]
+        found = self.__handler__(self.__static__.get(path, {}), method)
+        if found is not None:
+            handler, pattern = found
+            return handler, {}, pattern, None
+        if not path.startswith('/'):
+            return None, None, None, []
+        segments, allowed, prefixes = path[1:].split('/'), set(), []
+        found = self.__search__(self.__root__, segments, 0, (), method, allowed, prefixes)
+        if found is not None:
+            handler, pattern, names, values = found
+            return handler, dict(zip(names, map(unquote, values))), pattern, None
+        # longest prefix first, of equal ones the one reached through literal segments
+        for node, index, values in sorted(prefixes, key=lambda prefix: -prefix[1]):
+            found = self.__handler__(node.prefix, method)
+            if found is not None:
+                handler, pattern, names = found
+                params = dict(zip(names, map(unquote, values)))
+                if len(names) > len(values):
+                    params[names[-1]] = '/'.join(segments[index:])
+                return handler, params, pattern, None
+            allowed.update(node.prefix)
+        if 'GET' in allowed:
+            allowed.add('HEAD')
+        return None, None, None, sorted(allowed)
+
+    def __search__(self, node: RouteNode, segments: list, index: int, values: tuple, method: str, allowed: set,
+                   prefixes: list) -> (callable, str, list, tuple):
+        """
+        Depth first search of the trie below node for segments[index:], literal children before {name}; every node
+        is at one depth, so each is visited at most once
+        :param values: segments matched by {name} so far
+        :param allowed: collects the methods of full patterns matching the path
+        :param prefixes: collects (node, index, values) of the nodes with prefix patterns on the way
+        :return: handler, pattern, parameter names and values of the first full pattern matching for method, or None
+        """
+        if node.prefix:
+            prefixes.append((node, index, values))
+        if index == len(segments):
+            found = self.__handler__(node.methods, method)
+            if found is not None:
+                return found + (values,)
+            allowed.update(node.methods)
+            return None
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self.__search__(child, segments, index + 1, values, method, allowed, prefixes)
+            if found is not None:
+                return found
+        if segment and node.param is not None:
+            return self.__search__(node.param, segments, index + 1, values + (segment,), method, allowed, prefixes)
+        return None
+
+    @staticmethod
+    def __handler__(handlers: dict, method: str) -> tuple:
+        """
+        :return: the entry of handlers for method, for HEAD the one for GET if there is none, or None
+        """
+        found = handlers.get(method)
+        if found is None and method == 'HEAD':
+            found = handlers.get('GET')
+        return found
+
+    def observe(self, method: str, pattern: str, status: int, seconds: float) -> None:
+        """
+        Pass the timing of a request a route handled to hooks
+        :param method: request method
+        :param pattern: pattern of the route that handled the request
+        :param status: response status
+        :param seconds: time taken to handle the request
+        :return: None
+        """
+        for hook in self.hooks:
+            hook(method, pattern, status, seconds)
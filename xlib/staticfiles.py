@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Static files served from memory maps
+"""
+import mimetypes
+import mmap
+import os
+import stat
+from collections import OrderedDict
+from email.utils import formatdate
+from os.path import abspath, join, normpath, realpath
+from threading import Lock
+from urllib.parse import unquote
+
+__version__ = '0.1'
+
+
+class MappedFile(object):
+    """
+    A file mapped read-only into memory; body is a memoryview of the whole file, sliced without copying
+    The map is released when the last reference to it goes, so eviction never invalidates a response being written
+    """
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'lastmodified', 'contenttype', 'body')
+
+    def __init__(self, path: str, filestat: os.stat_result):
+        self.path = path
+        self.size = filestat.st_size
+        self.mtime = filestat.st_mtime_ns
+        self.etag = '"{:x}-{:x}"'.format(self.mtime, self.size)
+        self.lastmodified = int(filestat.st_mtime)
+        self.contenttype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.size:
+            with open(path, 'rb') as mappedfile:
+                self.body = memoryview(mmap.mmap(mappedfile.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            self.body = memoryview(b'')
+
+    @property
+    def lastmodifiedstring(self) -> str:
+        return formatdate(self.lastmodified, usegmt=True)
+
+    def current(self, filestat: os.stat_result) -> bool:
+        return filestat.st_mtime_ns == self.mtime and filestat.st_size == self.size
+
+
+class StaticFiles(object):
+    """
+    Maps URL paths to files under root and keeps up to maxopen of them mapped, least recently used evicted first
+    Only regular, world-readable files are served, so files kept private by their mode (like the keystore) are not
+    A cached map is replaced when the file's mtime or size changes
+    """
+
+    def __init__(self, root: str, maxopen: int = 64):
+        self.root = realpath(abspath(root))
+        self.maxopen = maxopen
+        self.__maps__ = OrderedDict()
+        self.__lock__ = Lock()
+
+    def resolve(self, urlpath: str) -> (str, os.stat_result):
+        """
+        :param urlpath: path relative to root, as it appears in the URL
+        :return: filesystem path and its stat, or (None, None) if it is not a file that may be served
+        """
+        relative = normpath(unquote(urlpath.partition('?')[0]).lstrip('/'))
+        if relative.startswith('..') or any(part.startswith('.') for part in relative.split(os.sep)):
+            return None, None
+        path = realpath(join(self.root, relative))
+        if not path.startswith(self.root + os.sep):
+            return None, None
+        try:
+            filestat = os.stat(path)
+        except OSError:
+            return None, None
+        if not stat.S_ISREG(filestat.st_mode) or not filestat.st_mode & stat.S_IROTH:
+            return None, None
+        return path, filestat
+
+    def mapped(self, path: str, filestat: os.stat_result) -> MappedFile:
+        """
+        :param path: path returned by resolve()
+        :param filestat: stat returned by resolve()
+        :return: the mapped file, from the cache if it is still current
+        """
+        with self.__lock__:
+            entry = self.__maps__.get(path)
+            if entry is not None and entry.current(filestat):
+                self.__maps__.move_to_end(path)
+                return entry
+        entry = MappedFile(path, filestat)
+        with self.__lock__:
+            self.__maps__[path] = entry
+            self.__maps__.move_to_end(path)
+            while len(self.__maps__) > self.maxopen:
+                self.__maps__.popitem(last=False)
+        return entry
+
+    def invalidate(self, path: str = None) -> None:
+        """
+        :param path: filesystem path to drop from the cache, None to drop all
+        :return: None
+        """
+        with self.__lock__:
+            if path is None:
+                self.__maps__.clear()
+            else:
+                self.__maps__.pop(path, None)
+
+    def __len__(self) -> int:
+        return len(self.__maps__)
+
+
+def byterange(rangeheader: str, size: int) -> (int, int):
+    """
+    Parse a single-range Range header
+    :param rangeheader: value of the Range header
+    :param size: size of the file
+    :return: (start, end) with end exclusive; None if the header is to be ignored; (size, size) if unsatisfiable
+    """
+    unit, _, ranges = rangeheader.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, dash, last = ranges.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            return (max(0, size - length), size) if length > 0 else (size, size)
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if last and end <= start:
+        # last-pos before first-pos makes the range invalid, and an invalid Range is ignored (RFC 9110, 14.1.1)
+        return None
+    if start >= size:
+        return size, size
+    return start, min(end, size)
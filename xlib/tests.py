@@ -1,37 +1,258 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Test for Python implementation of Unix Daemon
+Load test and latency benchmark for Listener
+Starts a Listener daemon on localhost, drives it with concurrent clients and reports throughput, latency percentiles,
+TLS handshake cost and daemon RSS and thread count; results are written as JSON and compared against a baseline
+Exit status is 1 if throughput or p99 latency regressed more than the threshold against the baseline
+    python3 -m xlib.tests --concurrency 16 --requests 500 --output run.json --baseline previous.json
 """
+import argparse
 import http.client
+import random
 import ssl
+import sys
+import threading
 import time
-from json import loads
+from json import dump, load, loads
+from math import ceil
+from os import listdir
+from os.path import exists, join
 
-from xlib.listener import Listener
+from xlib.accesslog import ACCESSLOGMODES
+from xlib.listener import Listener, CERTFILESTORE, HOSTNAMEFILE, ENGINES, KEYTYPES
 
-if __name__ == '__main__':
-    print('ana')
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+
+def percentiles(samples: list) -> dict:
+    """
+    :param samples: latencies in seconds
+    :return: dictionary of nearest-rank percentiles, mean and max in milliseconds
+    """
+    if not samples:
+        return dict([(name, None) for name, _ in PERCENTILES] + [('mean', None), ('max', None)])
+    ordered = sorted(samples)
+    result = dict([(name, round(ordered[max(0, ceil(len(ordered) * rank / 100) - 1)] * 1000, 3))
+                   for name, rank in PERCENTILES])
+    result['mean'] = round(sum(ordered) / len(ordered) * 1000, 3)
+    result['max'] = round(ordered[-1] * 1000, 3)
+    return result
+
+
+def processtree(pid: int) -> list:
+    """
+    :param pid: root process
+    :return: pid and the pids of all its descendants
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in listdir('/proc/{}/task'.format(parent)):
+                with open('/proc/{}/task/{}/children'.format(parent, task)) as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def daemonusage(pid: int) -> (int, int):
+    """
+    :param pid: daemon process
+    :return: total resident set size in kB and total thread count of the daemon and its worker processes
+    """
+    rss, threads = 0, 0
+    for child in processtree(pid):
+        try:
+            with open('/proc/{}/status'.format(child)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+        except OSError:
+            pass
+    return rss, threads
+
+
+class LoadClient(threading.Thread):
+    """
+    One client issuing a share of the requests, over one kept-alive connection or a new connection per request
+    """
+
+    def __init__(self, host: str, port: int, context: ssl.SSLContext, requests: int, keepalive: bool,
+                 postratio: float, payload: bytes, seed: int):
+        super().__init__(daemon=True)
+        self.host, self.port, self.context = host, port, context
+        self.requests, self.keepalive, self.postratio, self.payload = requests, keepalive, postratio, payload
+        self.random = random.Random(seed)
+        self.latencies, self.handshakes, self.errors = [], [], 0
+        self.connection = None
+
+    def connect(self) -> None:
+        self.connection = http.client.HTTPSConnection(self.host, self.port, context=self.context, timeout=30)
+        start = time.perf_counter()
+        self.connection.connect()
+        self.handshakes.append(time.perf_counter() - start)
+
+    def run(self) -> None:
+        for _ in range(self.requests):
+            try:
+                if self.connection is None:
+                    self.connect()
+                start = time.perf_counter()
+                if self.random.random() < self.postratio:
+                    self.connection.request('POST', '/', body=self.payload,
+                                            headers={'Content-Type': 'application/octet-stream'})
+                else:
+                    self.connection.request('GET', '/')
+                response = self.connection.getresponse()
+                response.read()
+                self.latencies.append(time.perf_counter() - start)
+                if response.status >= 400:
+                    self.errors += 1
+                if not self.keepalive or response.will_close:
+                    self.connection.close()
+                    self.connection = None
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                if self.connection is not None:
+                    self.connection.close()
+                self.connection = None
+        if self.connection is not None:
+            self.connection.close()
 
-    listner = Listener()
-    listner.host = 'localhost'
-    listner.start()
-    print(listner.status())
-    listner = None
-    time.sleep(2)
 
+def startlistener(args: argparse.Namespace) -> Listener:
+    """
+    Start a Listener daemon on localhost configured from args and wait until it publishes its address
+    :return: the Listener
+    """
+    listener = Listener()
+    listener.host = 'localhost'
+    listener.engine = args.engine
+    listener.processes = args.processes
+    listener.keytype = args.keytype
+    listener.accesslog = args.accesslog
+    hostfile = join(listener.vardir, HOSTNAMEFILE)
+    assert listener.status() == 0, 'a Listener daemon is already running'
+    listener.start()
+    deadline = time.monotonic() + args.startuptimeout
+    while not exists(hostfile) or not exists(join(listener.vardir, CERTFILESTORE)):
+        assert time.monotonic() < deadline, 'Listener did not publish {} in time'.format(hostfile)
+        time.sleep(0.05)
+    time.sleep(args.settle)
+    return listener
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Run the benchmark described by args
+    :return: dictionary with the configuration and the results
+    """
+    listener = startlistener(args)
     try:
-        with open('../var/host.txt', 'r') as hostfile:
-            url, host, port = loads(hostfile.readline())
-        conn = http.client.HTTPSConnection(host=host, port=port,
-                                           context=ssl.create_default_context(cafile='../var/cert.pem'))
-        for url in ('/', '/ana'):
-            st = time.time()
-            conn.request(method='GET', url=url)
-            res = conn.getresponse()
-            print(url, res.status, res.reason, res.read())
-            print(time.time() - st)
+        with open(join(listener.vardir, HOSTNAMEFILE), 'r') as hostfile:
+            _, host, port = loads(hostfile.readline())
+        context = ssl.create_default_context(cafile=join(listener.vardir, CERTFILESTORE))
+        context.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+        pid = listener.status()
+        payload = random.Random(args.seed).randbytes(args.postsize)
+        if args.warmup:
+            warmup = LoadClient(host, port, context, args.warmup, True, args.postratio, payload, args.seed)
+            warmup.run()
+        clients = [LoadClient(host, port, context, args.requests, not args.noreuse, args.postratio, payload,
+                              args.seed + n) for n in range(args.concurrency)]
+        peak = [0, 0]
+        done = threading.Event()
+
+        def sample() -> None:
+            while not done.wait(0.2):
+                rss, threads = daemonusage(pid)
+                peak[0], peak[1] = max(peak[0], rss), max(peak[1], threads)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        rss, threads = daemonusage(pid)
     finally:
-        Listener().stop()
+        listener.stop()
+    latencies = sum([client.latencies for client in clients], [])
+    handshakes = sum([client.handshakes for client in clients], [])
+    return dict(
+        config=dict(engine=args.engine, processes=args.processes, keytype=args.keytype, accesslog=args.accesslog,
+                    concurrency=args.concurrency, requests=args.requests, reuse=not args.noreuse,
+                    postratio=args.postratio, postsize=args.postsize, seed=args.seed),
+        results=dict(elapsed=round(elapsed, 3),
+                     completed=len(latencies),
+                     errors=sum(client.errors for client in clients),
+                     throughput=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                     latency=percentiles(latencies),
+                     handshake=dict(count=len(handshakes), **percentiles(handshakes)),
+                     daemon=dict(rss_kb=rss, threads=threads, peak_rss_kb=max(peak[0], rss),
+                                 peak_threads=max(peak[1], threads))))
+
+
+def regressions(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    :param current: results of this run
+    :param baseline: results of an earlier run
+    :param threshold: allowed relative change, e.g. 0.1 for 10%
+    :return: list of regression descriptions, empty if none
+    """
+    found = []
+    now, before = current['results'], baseline['results']
+    if before['throughput'] and now['throughput'] < before['throughput'] * (1 - threshold):
+        found.append('throughput {} req/s vs baseline {} req/s'.format(now['throughput'], before['throughput']))
+    if before['latency']['p99'] and now['latency']['p99'] is not None and \
+            now['latency']['p99'] > before['latency']['p99'] * (1 + threshold):
+        found.append('p99 latency {} ms vs baseline {} ms'.format(now['latency']['p99'], before['latency']['p99']))
+    if now['errors'] > before['errors']:
+        found.append('{} errors vs baseline {}'.format(now['errors'], before['errors']))
+    return found
 
-    print('ana')
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test and latency benchmark for Listener')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--noreuse', action='store_true', help='open a new connection for every request')
+    parser.add_argument('--postratio', type=float, default=0.0, help='fraction of requests that are POSTs')
+    parser.add_argument('--postsize', type=int, default=1024, help='POST body size in bytes')
+    parser.add_argument('--warmup', type=int, default=20, help='requests sent before measuring')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='threaded')
+    parser.add_argument('--processes', type=int, default=1, help='pre-forked Listener worker processes')
+    parser.add_argument('--keytype', choices=KEYTYPES, default='rsa')
+    parser.add_argument('--accesslog', choices=ACCESSLOGMODES, default='full', help='access log mode')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the GET/POST mix and payload')
+    parser.add_argument('--startuptimeout', type=float, default=60.0, help='seconds to wait for the Listener')
+    parser.add_argument('--settle', type=float, default=0.5, help='seconds to wait after the Listener is up')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed regression against the baseline')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    dump(result, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, 'w') as output:
+            dump(result, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as baselinefile:
+            found = regressions(result, load(baselinefile), args.threshold)
+        for regression in found:
+            print('REGRESSION: ' + regression)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
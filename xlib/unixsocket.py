@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP over Unix domain sockets for clients on the same host
+"""
+import os
+import socket
+import struct
+from http.client import HTTPConnection
+
+__version__ = '0.1'
+PEERCRED = struct.Struct('3i')
+
+
+def peeraddress(connection: socket.socket) -> (str, int):
+    """
+    Identify the process at the other end of a Unix domain socket connection, where the platform tells
+    :param connection: accepted connection
+    :return: ('uid:<user id>', process id) of the peer, or ('unix', 0)
+    """
+    try:
+        pid, uid, _ = PEERCRED.unpack(connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size))
+    except (AttributeError, OSError):
+        return 'unix', 0
+    return 'uid:{}'.format(uid), pid
+
+
+class UnixSocketMixIn(object):
+    """
+    Mix-in class to serve on a Unix domain socket; server_address is the path of the socket file
+    The socket file gets socketmode permissions before it appears under its path: they are the access control
+    A socket file left at the path is replaced
+    Clients are identified as peeraddress() tells, in place of an IP address and port
+    """
+    address_family = socket.AF_UNIX
+    socketmode = 0o660
+
+    def server_bind(self) -> None:
+        pending = '{}.{}'.format(self.server_address, os.getpid())
+        try:
+            os.unlink(pending)
+        except FileNotFoundError:
+            pass
+        self.socket.bind(pending)
+        os.chmod(pending, self.socketmode)
+        os.replace(pending, self.server_address)
+        self.server_name, self.server_port = socket.gethostname(), 0
+
+    def get_request(self) -> (socket.socket, (str, int)):
+        connection, _ = self.socket.accept()
+        return connection, peeraddress(connection)
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    HTTPConnection to a server on the Unix domain socket at socketpath
+    """
+
+    def __init__(self, socketpath: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socketpath = socketpath
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socketpath)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Names of the files a Listener publishes in its vardir for its clients
+"""
+
+__version__ = '0.1'
+CERTFILESTORE = 'cert.pem'
+HOSTNAMEFILE = 'host.txt'
+UNIXSOCKETFILE = 'socket.txt'